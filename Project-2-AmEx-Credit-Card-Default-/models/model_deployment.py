@@ -1,23 +1,45 @@
 # %%
+import click
 import joblib
-import pandas as pd
-import numpy as np
-from xgboost import XGBClassifier
 import logging
+import os
 import sys
+from src.data.tables import (iter_table, read_table, write_table,
+                             write_table_chunks)
+from src.features.build_features import (CLEANER_COLUMNS, RAW_DTYPES,
+                                         SCORING_COLUMNS, clean_data,
+                                         feature_engineering, fit_cleaner)
+from src.instrumentation import run_report
+from src.models.bundle import EVALUATORS, load_bundle
+from src.models.incremental import (assets_fingerprint, find_changed,
+                                    load_state, merge_predictions, row_hashes,
+                                    save_state)
+from src.models.predict_model import make_predictions, prepare_for_prediction
+from src.models.ranking import RANK_BY, rank_top, reduce_top, select_top
+from src.models.train_model import (formatting, transform_features,
+                                    transform_params)
+from src.parallel import map_chunks
 
-def load_data(path):
+logger = logging.getLogger(__name__)
+
+def load_data(path, chunksize=None):
     """
-    Load the data and drop Unnamed column.
+    Load the columns scoring uses from a CSV, Parquet or Arrow file, with the
+    compact dtypes of RAW_DTYPES.
     
     Parameters:
     path where the data is stored.
+    chunksize number of rows per chunk; when given an iterator of chunks is
+    returned.
     
     Returns:
-    Dataframe.
+    Dataframe, or an iterator of Dataframes when chunksize is set.
     """
     try:
-        data = pd.read_csv(path)
+        if chunksize is not None:
+            return iter_table(path, chunksize, columns=SCORING_COLUMNS,
+                              dtype=RAW_DTYPES)
+        data = read_table(path, columns=SCORING_COLUMNS, dtype=RAW_DTYPES)
         return data
     except Exception as e:
         print(f"An error occurred: {e}")
@@ -33,164 +55,317 @@ def load_assets(model_path, imputer_path, scaler_path):
     scaler = joblib.load(scaler_path)
     return model, imputer, scaler
 
-def clean_data(df):
+def load_scoring_assets(bundle_path, model_path, imputer_path, scaler_path,
+                        evaluator='xgboost'):
     """
-    Function to clean data by handling missing values and anomalies.
+    Load the model, transform parameters and cleaner, from a bundle when
+    one is given or else from the model, imputer and scaler pickles (the
+    cleaner is then None). evaluator picks how a bundle's model is scored
+    (see load_bundle).
     """
-    # renaming columns
-    df = df.rename(columns={'credit_limit_used(%)': 'credit_limit_used_pctg'})
-    # Filling missing values for 'no_of_children', 'owns_car', 'migrant_worker', 'total_family_members' with mode
-    for col in ['no_of_children', 'owns_car', 'migrant_worker', 'total_family_members']:
-        df[col].fillna(df[col].mode()[0], inplace=True)
-
-    # Handling 'XNA' values in 'gender'
-    df['gender'] = df['gender'].replace('XNA', df['gender'].mode()[0])
+    if bundle_path:
+        logger.info("Loading model bundle")
+        bundle = load_bundle(bundle_path, evaluator)
+        return bundle['model'], bundle['params'], bundle['cleaner']
+    logger.info("Loading model, imputer, and scaler")
+    model, imputer, scaler = load_assets(model_path, imputer_path, scaler_path)
+    return model, transform_params(imputer, scaler), None
 
-    # Your data might have specific anomalies that you discovered during EDA.
-    # Include code to handle those anomalies here.
-    
-    return df
-
-def feature_engineering(df):
+def load_cleaner(cleaner_path, data_path, chunksize=None):
     """
-    Function for feature engineering, like combining certain features for new insights.
+    Load the fitted cleaner, or fit one on the input file when none has
+    been saved.
     """
-    # dropping columns to mitigate multicollinearity
-    df = df.drop(columns=['name', 'credit_limit', 'no_of_children'], axis=1)
-    # combining 'prev_defaults' and 'default_in_last_6months' into 'total_defaults'
-    if 'prev_defaults' in df.columns and 'default_in_last_6months' in df.columns:
-        df['total_defaults'] = df['prev_defaults'] + df['default_in_last_6months']
-        df = df.drop(columns=['prev_defaults', 'default_in_last_6months'])
-    
-    return df
+    if os.path.exists(cleaner_path):
+        return joblib.load(cleaner_path)
+    logger.warning(f"No fitted cleaner at {cleaner_path}; fitting fill "
+                   f"values on {data_path}")
+    if chunksize is None:
+        return fit_cleaner(read_table(data_path, columns=CLEANER_COLUMNS,
+                                      dtype=RAW_DTYPES))
+    return fit_cleaner(iter_table(data_path, chunksize,
+                                  columns=CLEANER_COLUMNS, dtype=RAW_DTYPES))
 
-def transform_data(df, imputer, scaler):
+def score_data(df, model, params, cleaner, nthread=None, batch_size=None):
     """
-    Function to perform necessary data transformations like encoding and scaling.
+    Run the full pipeline on a dataframe of raw customers and return
+    the predictions.
     """
-    # Encoding categorical variables and scaling
-    df['gender'] = df['gender'].map({'F': 0, 'M': 1})
-    df['owns_car'] = df['owns_car'].map({'N': 0, 'Y': 1})
-    df['owns_house'] = df['owns_house'].map({'N': 0, 'Y': 1})
+    # Data cleaning
+    logger.info("Cleaning data")
+    cleaned_data = clean_data(df, cleaner)
 
-    # One-hot encoding for 'occupation_type'
-    df = pd.get_dummies(df, columns=['occupation_type'], prefix=['ot'])
-    # imputting missing values
-    df = pd.DataFrame(imputer.transform(df), columns=df.columns)
-    # Scaling the dataset
-    df = pd.DataFrame(scaler.transform(df), columns=df.columns)
+    # Feature engineering
+    logger.info("Performing feature engineering")
+    engineered_data = feature_engineering(cleaned_data)
 
-    return df
+    # Formatting data
+    logger.info("Formatting data for predictions")
+    X, customer_ids = formatting(engineered_data)
 
+    # Data transformation
+    logger.info("Transforming data")
+    X = transform_features(X, params)
 
-def formatting(df):
-    # Assuming 'customer_id' is not a feature used in the model, 
-    # but an identifier that you'll want to keep for later reference.
-    if 'customer_id' in df.columns:
-        customer_ids = df['customer_id']
-        X = df.drop(columns=['customer_id'], axis=1)
-    else:
-        customer_ids = None
-        X = df
-    
-    return X, customer_ids
+    # Preparing data for prediction
+    logger.info("Preparing data for prediction")
+    X = prepare_for_prediction(X, model)
+
+    # Making predictions
+    logger.info("Making predictions")
+    if customer_ids is not None:
+        # X has a fresh index after transform_features, so drop the chunk's
+        # row labels
+        customer_ids = customer_ids.to_numpy()
+    return make_predictions(X, model, customer_ids, nthread, batch_size)
+
+def keep_top(df, results, top_n, rank_by=None):
+    """
+    Keep the top_n customers of df most likely to default, from its predictions
+    results, or the top_n of every rank_by group, which is taken from df.
+    """
+    if rank_by is not None:
+        results = results.assign(**{rank_by: df[rank_by].to_numpy()})
+    return select_top(results, top_n, rank_by)
 
-def prepare_for_prediction(X, model):
+def save_predictions(results, output_path, top_n=None, rank_by=None):
     """
-    Ensure the order of columns in the new data (X) matches the features used for training the model.
-    If there's a mismatch, reorder columns in X to match the training features.
+    Write an iterator of chunks' predictions to output_path one chunk at a
+    time, or, with top_n, merge the chunks' top rows and write only the ranked
+    top_n (per rank_by group). Returns the number of rows written.
     """
-    expected_features = model.get_booster().feature_names
-    received_features = list(X.columns)
+    if top_n is None:
+        return write_table_chunks(results, output_path)
+    top = reduce_top(results, top_n, rank_by)
+    if top is None:
+        logger.warning("No rows were scored")
+        return 0
+    top = rank_top(top, rank_by)
+    write_table(top, output_path)
+    return len(top)
 
-    # Check if all expected features are present
-    if not set(expected_features).issubset(received_features):
-        missing_features = set(expected_features) - set(received_features)
-        raise ValueError(f"Missing features: {missing_features}")
+def stream_predictions(data_path, model, params, cleaner, chunksize,
+                       nthread=None, batch_size=None, top_n=None,
+                       rank_by=None):
+    """
+    Score the file at data_path in chunks of chunksize rows, yielding each
+    chunk's predictions. Every chunk is cleaned with the same fitted cleaner,
+    so the output matches a full-file run while only one chunk is held in
+    memory. With top_n, only each chunk's top rows are yielded (see keep_top).
+    """
+    n_rows = 0
+    for chunk in load_data(data_path, chunksize=chunksize):
+        results = score_data(chunk, model, params, cleaner, nthread,
+                             batch_size)
+        if top_n is not None:
+            results = keep_top(chunk, results, top_n, rank_by)
+        n_rows += len(chunk)
+        logger.info(f"Scored {n_rows} rows")
+        yield results
 
-    # If features are present but in different order, reorder them
-    if expected_features != received_features:
-        X = X[expected_features]
-    
-    return X
+# scoring assets of a worker process, loaded once by _init_worker
+_worker_assets = {}
 
-# predictions
+def _init_worker(asset_paths, cleaner, nthread, batch_size, top_n, rank_by):
+    model, params, bundle_cleaner = load_scoring_assets(**asset_paths)
+    _worker_assets.update(model=model, params=params,
+                          cleaner=cleaner or bundle_cleaner, nthread=nthread,
+                          batch_size=batch_size, top_n=top_n, rank_by=rank_by)
 
-def make_predictions(X, model, customer_ids):
+def _score_shard(shard):
+    assets = _worker_assets
+    results = score_data(shard, assets['model'], assets['params'],
+                         assets['cleaner'], assets['nthread'],
+                         assets['batch_size'])
+    # with top_n only the shard's top rows are sent back
+    if assets['top_n'] is not None:
+        results = keep_top(shard, results, assets['top_n'], assets['rank_by'])
+    return results, len(shard)
+
+def parallel_predictions(data_path, asset_paths, cleaner, chunksize, workers,
+                         nthread=None, batch_size=None, top_n=None,
+                         rank_by=None):
     """
-    Make predictions, and return results.
+    Score the file at data_path in shards of chunksize rows (50000 by default)
+    on a pool of workers processes (0 for one per core), each loading the
+    scoring assets once. Shards' predictions are yielded in input order and at
+    most two per worker are in flight, so memory stays bounded. Boosters use
+    one thread per worker unless nthread says otherwise. With top_n, workers
+    only return each shard's top rows (see keep_top).
     """
-    predictions = model.predict(X)
-    results = pd.DataFrame({'customer_id': customer_ids, 'prediction_default': predictions})
-    return results
+    workers = workers or os.cpu_count()
+    chunksize = chunksize or 50000
+    logger.info(f"Scoring shards of {chunksize} rows on {workers} worker "
+                "processes")
+    n_rows = 0
+    initargs = (asset_paths, cleaner, nthread or 1, batch_size, top_n, rank_by)
+    shards = load_data(data_path, chunksize=chunksize)
+    for results, n_scored in map_chunks(_score_shard, shards, workers,
+                                        _init_worker, initargs,
+                                        'model_deployment worker'):
+        n_rows += n_scored
+        logger.info(f"Scored {n_rows} rows")
+        yield results
 
-def main():
-    # paths
-    data_path = '../data/raw/test.csv'
-    imputer_path = '../model-xgb/simple_imputer.pkl'
-    scaler_path = '../model-xgb/min-max-scaler.pkl'
-    xgb_model_path = '../model-xgb/best_xgb_model.pkl'
+def incremental_predictions(df, state_path, model, params, cleaner,
+                            nthread=None, batch_size=None):
+    """
+    Score only the customers of df that are new or changed since the run that
+    saved the state at state_path, and merge their predictions with that run's.
+    Returns the results of the whole book and the new state's arguments for
+    save_state, which is only to be saved once the results are written.
+    """
+    customer_ids = df['customer_id'].to_numpy()
+    hashes = row_hashes(df)
+    fingerprint = assets_fingerprint(model, params, cleaner)
 
-    logger.info("Starting the data processing pipeline")
+    state = load_state(state_path)
+    changed = find_changed(customer_ids, hashes, state, fingerprint)
+    logger.info(f"Rescoring {changed.sum()} of {len(df)} customers")
 
-    # Load data
+    new_results = None
+    if changed.any():
+        new_results = score_data(df[changed], model, params, cleaner, nthread,
+                                 batch_size)
+    results = merge_predictions(customer_ids, changed, new_results, state)
+    return results, (results, hashes, fingerprint)
+
+def score_file(data_path, model, params, cleaner, nthread=None,
+               batch_size=None, top_n=None, rank_by=None, state_path=None):
+    """
+    Score the whole file at data_path in one pass or, with state_path, only the
+    customers changed since the last run (see incremental_predictions). Returns
+    the predictions as one chunk for save_predictions, only the top rows with
+    top_n (see keep_top), and the new scoring state, or None.
+    """
     logger.info("Loading data")
     df = load_data(data_path)
     if df is None:
         logger.error(f"Failed to load data from {data_path}")
         sys.exit(1)
 
+    state = None
+    if state_path is not None:
+        results, state = incremental_predictions(df, state_path, model, params,
+                                                 cleaner, nthread, batch_size)
+    else:
+        results = score_data(df, model, params, cleaner, nthread, batch_size)
+    if top_n is not None:
+        results = keep_top(df, results, top_n, rank_by)
+    return [results], state
+
+@click.command()
+@click.option('--data-path', default='../data/raw/test.csv',
+              type=click.Path(exists=True))
+@click.option('--model-path', default='../models/best_xgb_model.pkl',
+              type=click.Path())
+@click.option('--imputer-path', default='../models/simple_imputer.pkl',
+              type=click.Path())
+@click.option('--scaler-path', default='../models/min-max-scaler.pkl',
+              type=click.Path())
+@click.option('--cleaner-path', default='../models/cleaner.pkl',
+              type=click.Path())
+@click.option('--bundle-path', default=None, type=click.Path(exists=True),
+              help='Model bundle to load instead of the model, imputer, '
+                   'scaler and cleaner files.')
+@click.option('--output-path', default='../reports/documentation/results.csv',
+              type=click.Path())
+@click.option('--chunksize', default=None, type=click.IntRange(min=1),
+              help='Score the input in chunks of this many rows instead of '
+                   'loading it whole.')
+@click.option('--nthread', default=None, type=click.IntRange(min=1),
+              help='Threads used by the booster; all cores by default.')
+@click.option('--batch-size', default=None, type=click.IntRange(min=1),
+              help='Rows passed to the booster per prediction call.')
+@click.option('--workers', default=None, type=click.IntRange(min=0),
+              help='Score shards on this many processes (0 for one per core).')
+@click.option('--incremental', is_flag=True,
+              help='Only rescore customers that are new or changed since the '
+                   'last run.')
+@click.option('--state-path', default='../models/scoring_state.pkl',
+              type=click.Path(),
+              help='Row hashes of the last run, used and updated by '
+                   '--incremental.')
+@click.option('--evaluator', default='xgboost', type=click.Choice(EVALUATORS),
+              help='Score the bundle with the XGBoost booster or its trees '
+                   'in NumPy.')
+@click.option('--top-n', default=None, type=click.IntRange(min=1),
+              help='Only save the top N customers most likely to default, '
+                   'ranked.')
+@click.option('--rank-by', default=None, type=click.Choice(RANK_BY),
+              help='With --top-n, keep and rank the top N of every group of '
+                   'this column.')
+def main(data_path, model_path, imputer_path, scaler_path, cleaner_path,
+         bundle_path, output_path, chunksize, nthread, batch_size, workers,
+         incremental, state_path, evaluator, top_n, rank_by):
+    logger.info("Starting the data processing pipeline")
+    check_options(chunksize, workers, incremental, evaluator, bundle_path,
+                  top_n, rank_by)
+
     # Load assets
+    asset_paths = {'bundle_path': bundle_path, 'model_path': model_path,
+                   'imputer_path': imputer_path, 'scaler_path': scaler_path,
+                   'evaluator': evaluator}
     try:
-        logger.info("Loading model, imputer, and scaler")
-        model, imputer, scaler = load_assets(xgb_model_path, imputer_path, scaler_path)
+        model, params, cleaner = load_scoring_assets(**asset_paths)
     except FileNotFoundError as e:
         logger.error(f"Asset not found: {e}")
         sys.exit(1)
     except Exception as e:
         logger.error(f"An error occurred while loading assets: {e}")
         sys.exit(1)
+    if cleaner is None:
+        cleaner = load_cleaner(cleaner_path, data_path, chunksize)
 
-    # Data cleaning
-    logger.info("Cleaning data")
-    cleaned_data = clean_data(df)
-
-    # Feature engineering
-    logger.info("Performing feature engineering")
-    engineered_data = feature_engineering(cleaned_data)
-
-    # Formatting data
-    logger.info("Formatting data for predictions")
-    X, customer_ids = formatting(engineered_data)
-
-    # Data transformation
-    logger.info("Transforming data")
-    X = transform_data(X, imputer, scaler, original_features)
-
-    # Preparing data for prediction
-    logger.info("Preparing data for prediction")
-    X = prepare_for_prediction(X, model)
-
-    # Making predictions
-    logger.info("Making predictions")
-    results = make_predictions(X, model, customer_ids)
+    state = None
+    if workers is not None:
+        results = parallel_predictions(data_path, asset_paths, cleaner,
+                                       chunksize, workers, nthread, batch_size,
+                                       top_n, rank_by)
+    elif chunksize is not None:
+        logger.info(f"Streaming predictions in chunks of {chunksize} rows")
+        results = stream_predictions(data_path, model, params, cleaner,
+                                     chunksize, nthread, batch_size, top_n,
+                                     rank_by)
+    else:
+        results, state = score_file(data_path, model, params, cleaner, nthread,
+                                    batch_size, top_n, rank_by,
+                                    state_path if incremental else None)
 
-    # Save results
+    # Save results as CSV, Parquet or Arrow depending on the extension
     try:
-        output_path = '../reports/documentation/results.csv'
-        results.to_csv(output_path, index=False)
-        logger.info(f"Results successfully saved to {output_path}")
+        n_rows = save_predictions(results, output_path, top_n, rank_by)
+        logger.info(f"{n_rows} results successfully saved to {output_path}")
     except Exception as e:
         logger.error(f"Failed to save results: {e}")
         sys.exit(1)
 
+    # the state describes the results just written, so it is only saved
+    # after them
+    if state is not None:
+        save_state(state_path, *state)
+        logger.info(f"Scoring state saved to {state_path}")
+
+def check_options(chunksize, workers, incremental, evaluator, bundle_path,
+                  top_n, rank_by):
+    """
+    Reject option combinations main cannot run.
+    """
+    if incremental and (chunksize is not None or workers is not None):
+        raise click.UsageError("--incremental scores the changed rows in one "
+                               "pass; drop --chunksize and --workers")
+    if rank_by is not None and top_n is None:
+        raise click.UsageError("--rank-by needs --top-n")
+    if evaluator == 'numpy' and bundle_path is None:
+        raise click.UsageError("--evaluator numpy needs --bundle-path")
+
 if __name__ == "__main__":
     # Setup logging
     logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(message)s')
-    logger = logging.getLogger(__name__)
 
     try:
-        main()
+        with run_report('model_deployment'):
+            main()
     except Exception as e:
         logger.exception("Fatal error in main loop")
         sys.exit(1)
\ No newline at end of file
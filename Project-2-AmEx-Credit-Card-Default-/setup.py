@@ -19,9 +19,17 @@ setup(
         'click>=7.0',
         'python-dotenv>=0.15.0',
         'scikit-learn>=1.2.2',
-        'xgboost=1.7.6',
-        'numpy>=1.24.3'
+        'joblib>=1.2.0',
+        'xgboost==1.7.6',
+        'numpy>=1.24.3',
+        'pyarrow>=10.0.0',
+        'imbalanced-learn>=0.10.0'
     ],
+    entry_points={
+        'console_scripts': [
+            'amex=src.cli:main'
+        ],
+    },
     extras_require={
         'dev': [
             'pytest>=6.0'
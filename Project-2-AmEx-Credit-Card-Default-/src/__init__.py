@@ -1,10 +1,20 @@
 # src/__init__.py
-from .data.make_dataset import load_data
-from .features.build_features import clean_data, feature_engineering
-from .models.train_model import transform_data, formatting  # adjust to predict_model if necessary
+import importlib
 
-# Add the following lines to enable logging in this module
-import logging
+# helpers re-exported from the package, imported on first use so that importing
+# src (e.g. for src.cli) does not load pandas, scikit-learn or XGBoost
+_EXPORTS = {
+    'load_data': 'src.data.make_dataset',
+    'clean_data': 'src.features.build_features',
+    'feature_engineering': 'src.features.build_features',
+    'transform_data': 'src.models.train_model',
+    'formatting': 'src.models.train_model',
+}
 
-log_fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-logging.basicConfig(level=logging.INFO, format=log_fmt)
+__all__ = list(_EXPORTS)
+
+
+def __getattr__(name):
+    if name not in _EXPORTS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    return getattr(importlib.import_module(_EXPORTS[name]), name)
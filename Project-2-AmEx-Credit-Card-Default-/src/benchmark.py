@@ -0,0 +1,170 @@
+# src/benchmark.py
+# -*- coding: utf-8 -*-
+import click
+import joblib
+import logging
+import os
+import pandas as pd
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from src.data.make_synthetic import generate_customers
+from src.data.tables import apply_dtype
+from src.features.build_features import (CLEANER_COLUMNS, RAW_DTYPES,
+                                         SCORING_COLUMNS, clean_data,
+                                         feature_engineering, fit_cleaner)
+from src.instrumentation import code_version
+from src.models.predict_model import make_predictions, prepare_for_prediction
+from src.models.train_model import formatting, transform_data
+
+BENCHMARK_COLUMNS = ['run_at', 'version', 'stage', 'n_rows', 'seconds',
+                     'rows_per_second', 'peak_memory_mb']
+
+
+@click.command()
+@click.option('--sizes', default='10000,100000,1000000',
+              help='Comma-separated numbers of synthetic customers to score. '
+                   'Every stage holds its input and output in memory, about '
+                   '0.7 GB at a million customers, so larger sizes such as '
+                   '10000000 are opt-in.')
+@click.option('--repeat', default=3, type=click.IntRange(min=1),
+              help='Timed runs of each stage; the fastest is recorded.')
+@click.option('--model-path', default='models/best_xgb_model.pkl',
+              type=click.Path(exists=True))
+@click.option('--imputer-path', default='models/simple_imputer.pkl',
+              type=click.Path(exists=True))
+@click.option('--scaler-path', default='models/min-max-scaler.pkl',
+              type=click.Path(exists=True))
+@click.option('--output-path', default='metrics/benchmarks.csv',
+              type=click.Path(), help='CSV the results are appended to.')
+@click.option('--tolerance', default=0.2, type=click.FloatRange(min=0),
+              help='Warn when a stage is this much slower than in the last '
+                   'recorded version.')
+@click.option('--seed', default=0, type=int)
+def main(sizes, repeat, model_path, imputer_path, scaler_path, output_path,
+         tolerance, seed):
+    """ Times and memory-profiles every scoring stage on synthetic customers of
+        each size, and appends the results to output_path.
+    """
+    logger = logging.getLogger(__name__)
+    model = joblib.load(model_path)
+    imputer = joblib.load(imputer_path)
+    scaler = joblib.load(scaler_path)
+
+    results = []
+    for n_rows in [int(size) for size in sizes.split(',')]:
+        logger.info(f'Benchmarking {n_rows} customers')
+        data, cleaner = make_benchmark_data(n_rows, seed)
+        results.extend(benchmark_stages(data, model, imputer, scaler, cleaner,
+                                        repeat))
+        del data
+
+    results = pd.DataFrame(results)
+    results.insert(0, 'version', code_version())
+    results.insert(0, 'run_at',
+                   datetime.now(timezone.utc).isoformat(timespec='seconds'))
+    results['rows_per_second'] = (results['n_rows']
+                                  / results['seconds']).round()
+    results = results[BENCHMARK_COLUMNS]
+
+    if os.path.exists(output_path):
+        find_regressions(results, pd.read_csv(output_path), tolerance)
+    results.to_csv(output_path, mode='a',
+                   header=not os.path.exists(output_path), index=False)
+    logger.info('Benchmarks saved to '
+                f'{output_path}:\n{results.to_string(index=False)}')
+
+
+def make_benchmark_data(n_rows, seed=0):
+    """
+    Generate n_rows synthetic customers with the columns and dtypes scoring
+    loads, and return them with a cleaner fitted on the full synthetic rows.
+    Each block of customers is cut down to those columns and the cleaner's as
+    it is generated, so the unused string columns are never held for all rows.
+    """
+    columns = SCORING_COLUMNS + [col for col in CLEANER_COLUMNS
+                                 if col not in SCORING_COLUMNS]
+    data = pd.concat([block[columns]
+                      for block in generate_customers(n_rows, seed,
+                                                      target=False)],
+                     ignore_index=True)
+    data = apply_dtype(data, RAW_DTYPES)
+    return data[SCORING_COLUMNS], fit_cleaner(data)
+
+
+def measure(func, arg, repeat):
+    """
+    Call func(arg) repeat times and return (result, fastest time in seconds,
+    peak traced memory in MB). Memory is traced in a separate, untimed call,
+    and covers Python and NumPy allocations but not XGBoost's native ones.
+    """
+    seconds = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func(arg)
+        seconds = min(seconds, time.perf_counter() - started)
+
+    tracemalloc.start()
+    try:
+        func(arg)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return result, seconds, peak / (1 << 20)
+
+
+def benchmark_stages(data, model, imputer, scaler, cleaner, repeat=3):
+    """
+    Run data through clean_data, feature_engineering, transform_data,
+    prepare_for_prediction and make_predictions, each stage taking the previous
+    one's output, and return one record per stage plus their total.
+    """
+    customer_ids = data['customer_id'].to_numpy()
+    stages = [
+        ('clean_data', lambda df: clean_data(df, cleaner)),
+        ('feature_engineering', feature_engineering),
+        ('transform_data',
+         lambda df: transform_data(formatting(df)[0], imputer, scaler)),
+        ('prepare_for_prediction',
+         lambda X: prepare_for_prediction(X, model)),
+        ('make_predictions',
+         lambda X: make_predictions(X, model, customer_ids)),
+    ]
+
+    records, value = [], data
+    for stage, func in stages:
+        value, seconds, peak_memory_mb = measure(func, value, repeat)
+        records.append({'stage': stage, 'n_rows': len(data),
+                        'seconds': round(seconds, 6),
+                        'peak_memory_mb': round(peak_memory_mb, 1)})
+    records.append({'stage': 'total', 'n_rows': len(data),
+                    'seconds': sum(record['seconds'] for record in records),
+                    'peak_memory_mb': max(record['peak_memory_mb']
+                                          for record in records)})
+    return records
+
+
+def find_regressions(results, history, tolerance):
+    """
+    Log a warning for every stage and size that is more than tolerance slower
+    than in the latest recorded run of another version. Returns those rows.
+    """
+    logger = logging.getLogger(__name__)
+    history = history[history['version'] != results['version'].iloc[0]]
+    baseline = (history.groupby(['stage', 'n_rows']).last()['seconds']
+                .rename('baseline_seconds'))
+    compared = results.join(baseline, on=['stage', 'n_rows'])
+    regressions = compared[compared['seconds']
+                           > compared['baseline_seconds'] * (1 + tolerance)]
+    for row in regressions.itertuples():
+        slower = row.seconds / row.baseline_seconds - 1
+        logger.warning(f'{row.stage} on {row.n_rows} rows took '
+                       f'{row.seconds:.3f} s, {slower:.0%} slower than before')
+    return regressions
+
+
+if __name__ == '__main__':
+    log_fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    logging.basicConfig(level=logging.INFO, format=log_fmt)
+
+    main()
@@ -0,0 +1,130 @@
+# src/benchmark_resampling.py
+# -*- coding: utf-8 -*-
+import click
+import logging
+import numpy as np
+import os
+import pandas as pd
+import time
+from datetime import datetime, timezone
+from sklearn.metrics import roc_auc_score
+from sklearn.model_selection import train_test_split
+from xgboost import XGBClassifier
+from src.benchmark import measure
+from src.data.make_synthetic import generate_customers
+from src.data.tables import apply_dtype
+from src.features.build_features import (RAW_DTYPES, TARGET, clean_data,
+                                         feature_engineering, fit_cleaner)
+from src.instrumentation import code_version
+from src.models.fit_model import fit_transforms
+from src.models.predict_model import predict_default_proba
+from src.models.resampling import RESAMPLING, balance_weight, make_sampler
+from src.models.train_model import (formatting, transform_features,
+                                    transform_params)
+
+RESAMPLING_BENCHMARK_COLUMNS = ['run_at', 'version', 'method', 'n_rows',
+                                'rows_out', 'resample_seconds',
+                                'resample_peak_memory_mb', 'fit_seconds',
+                                'test_auc']
+
+
+@click.command()
+@click.option('--sizes', default='100000,1000000',
+              help='Comma-separated numbers of synthetic training customers.')
+@click.option('--methods', default=','.join(RESAMPLING),
+              help='Comma-separated resampling methods to compare.')
+@click.option('--chunksize', default=100_000, type=click.IntRange(min=1),
+              help='Rows per SMOTE block with chunked_smote.')
+@click.option('--n-trees', default=100, type=click.IntRange(min=1),
+              help='Trees boosted on each method\'s rows, to time training '
+                   'and score it.')
+@click.option('--repeat', default=1, type=click.IntRange(min=1),
+              help='Timed runs of each method; the fastest is recorded.')
+@click.option('--output-path', default='metrics/resampling_benchmarks.csv',
+              type=click.Path(), help='CSV the results are appended to.')
+@click.option('--seed', default=0, type=int)
+def main(sizes, methods, chunksize, n_trees, repeat, output_path, seed):
+    """ Compares the class-imbalance resampling methods on synthetic customers
+        of each size: the time and peak memory of resampling, the rows it
+        leaves to train on, the time to boost n_trees trees on them and the
+        test ROC AUC. Appends the results to output_path.
+    """
+    logger = logging.getLogger(__name__)
+    methods = methods.split(',')
+    unknown = set(methods) - set(RESAMPLING)
+    if unknown:
+        raise click.BadParameter(f'unknown methods {sorted(unknown)}',
+                                 param_hint='--methods')
+
+    results = []
+    for n_rows in [int(size) for size in sizes.split(',')]:
+        logger.info(f'Benchmarking resampling of {n_rows} customers')
+        X, y, X_test, y_test = make_training_data(n_rows, seed)
+        for method in methods:
+            results.append(benchmark_resampling(X, y, X_test, y_test, method,
+                                                chunksize, n_trees, repeat,
+                                                seed))
+
+    results = pd.DataFrame(results)
+    results.insert(0, 'version', code_version())
+    results.insert(0, 'run_at',
+                   datetime.now(timezone.utc).isoformat(timespec='seconds'))
+    results = results[RESAMPLING_BENCHMARK_COLUMNS]
+    results.to_csv(output_path, mode='a',
+                   header=not os.path.exists(output_path), index=False)
+    logger.info('Benchmarks saved to '
+                f'{output_path}:\n{results.to_string(index=False)}')
+
+
+def make_training_data(n_rows, seed=0):
+    """
+    Generate n_rows labelled synthetic customers and return their transformed
+    training and test features and labels, split 70/30 as fit_model does.
+    """
+    data = apply_dtype(pd.concat(generate_customers(n_rows, seed),
+                                 ignore_index=True), RAW_DTYPES)
+    features = feature_engineering(clean_data(data, fit_cleaner(data)))
+    y = features.pop(TARGET).to_numpy(dtype=np.int64)
+    X, _ = formatting(features)
+    X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.3,
+                                                        stratify=y,
+                                                        random_state=seed)
+    params = transform_params(*fit_transforms(X_train))
+    return (transform_features(X_train, params).to_numpy(), y_train,
+            transform_features(X_test, params).to_numpy(), y_test)
+
+
+def benchmark_resampling(X, y, X_test, y_test, method, chunksize, n_trees,
+                         repeat=1, seed=0):
+    """
+    Resample X, y with method and return a record of its cost and of boosting
+    n_trees trees on the result.
+    """
+    sampler = make_sampler(method, seed, chunksize)
+    if sampler is None:
+        (X_out, y_out), seconds, peak_memory_mb = (X, y), 0.0, 0.0
+    else:
+        (X_out, y_out), seconds, peak_memory_mb = measure(
+            lambda rows: sampler.fit_resample(*rows), (X, y), repeat)
+
+    weights = ({'scale_pos_weight': balance_weight(y)} if method == 'weight'
+               else {})
+    model = XGBClassifier(tree_method='hist', n_estimators=n_trees,
+                          random_state=seed, **weights)
+    started = time.perf_counter()
+    model.fit(X_out, y_out)
+    fit_seconds = time.perf_counter() - started
+    probabilities = predict_default_proba(X_test, model)
+
+    return {'method': method, 'n_rows': len(y), 'rows_out': len(y_out),
+            'resample_seconds': round(seconds, 6),
+            'resample_peak_memory_mb': round(peak_memory_mb, 1),
+            'fit_seconds': round(fit_seconds, 6),
+            'test_auc': round(roc_auc_score(y_test, probabilities), 6)}
+
+
+if __name__ == '__main__':
+    log_fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    logging.basicConfig(level=logging.INFO, format=log_fmt)
+
+    main()
@@ -0,0 +1,163 @@
+# src/cache.py
+# -*- coding: utf-8 -*-
+import hashlib
+import json
+import logging
+import numpy as np
+import os
+import shutil
+import tempfile
+import time
+from functools import partial
+from pathlib import Path
+
+# digests of input files, remembered by size and modification time, in the
+# cache directory
+DIGESTS_FILE = 'digests.json'
+
+
+def run_stage(cache_dir, stage, key, compute, force=False):
+    """
+    Return the cache entry directory of stage for the fingerprint key. On a
+    miss, or when force is set, compute(directory) writes the stage outputs
+    into a staging directory that then replaces the entry, so an interrupted
+    stage never leaves a partial entry behind. Hits refresh the entry's
+    last-used time.
+    """
+    logger = logging.getLogger(__name__)
+    entry = Path(cache_dir) / stage / key
+    if entry.is_dir() and not force:
+        os.utime(entry)
+        logger.info(f'{stage}: cache hit {key}')
+        return entry
+
+    started = time.perf_counter()
+    entry.parent.mkdir(parents=True, exist_ok=True)
+    staging = Path(tempfile.mkdtemp(prefix=f'.{key}-', dir=entry.parent))
+    try:
+        compute(staging)
+        if entry.exists():
+            shutil.rmtree(entry)
+        os.replace(staging, entry)
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+    logger.info(f'{stage}: computed {key} in '
+                f'{time.perf_counter() - started:.2f} s')
+    return entry
+
+
+def run_cached(cache_dir, stage, key, outputs, compute, force=False,
+               max_bytes=None):
+    """
+    Run an entry point's work through the cache, skipping it when an entry for
+    the fingerprint key exists. outputs maps a name to each file the work
+    writes; compute(paths) writes them to paths, which maps the same names to
+    files of a new entry (see run_stage). Hit or miss, the entry's files are
+    then copied to their outputs. An entry without a file for every output is
+    recomputed. With max_bytes, the cache is then evicted down to that size
+    (see evict).
+    """
+    # the cached files keep their outputs' extensions, which pick their format
+    files = {name: name + Path(path).suffix for name, path in outputs.items()}
+    entry = Path(cache_dir) / stage / key
+    force = force or not all((entry / file).exists()
+                             for file in files.values())
+
+    def compute_entry(directory):
+        compute({name: directory / file for name, file in files.items()})
+
+    entry = run_stage(cache_dir, stage, key, compute_entry, force)
+    for name, path in outputs.items():
+        shutil.copyfile(entry / files[name], path)
+    if max_bytes is not None:
+        evict(cache_dir, max_bytes)
+    return entry
+
+
+def evict(cache_dir, max_bytes):
+    """
+    Delete least recently used cache entries, of every stage, until the cache
+    holds at most max_bytes. Returns the size of what is left.
+    """
+    logger = logging.getLogger(__name__)
+    entries = []
+    for stage in Path(cache_dir).iterdir():
+        if not stage.is_dir():
+            continue
+        for entry in stage.glob('[!.]*'):
+            size = sum(f.stat().st_size for f in entry.rglob('*')
+                       if f.is_file())
+            entries.append((entry.stat().st_mtime, size, entry))
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, entry in sorted(entries):
+        if total <= max_bytes:
+            break
+        shutil.rmtree(entry)
+        total -= size
+        logger.info(f'Evicted {entry.parent.name} entry {entry.name} '
+                    f'({size / (1 << 20):.1f} MB)')
+    return total
+
+
+def fingerprint(stage, code_files, **parts):
+    """
+    Hash a stage's inputs, given as digests, together with the source of the
+    code_files it runs.
+    """
+    code = hashlib.blake2b(digest_size=16)
+    for path in code_files:
+        code.update(Path(path).read_bytes())
+    parts = dict(parts, stage=stage, code=code.hexdigest())
+    return hashlib.blake2b(json.dumps(parts, sort_keys=True).encode(),
+                           digest_size=8).hexdigest()
+
+
+def file_digest(path, cache_dir):
+    """
+    Hash the contents of the file at path. Digests are remembered in the cache
+    directory by file size and modification time, so an unchanged input is only
+    read once.
+    """
+    path = Path(path).resolve()
+    stat = path.stat()
+    signature = [stat.st_size, stat.st_mtime_ns]
+    memo_path = Path(cache_dir) / DIGESTS_FILE
+    memo = json.loads(memo_path.read_text()) if memo_path.exists() else {}
+    known = memo.get(str(path))
+    if known is not None and known['signature'] == signature:
+        return known['digest']
+
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as file:
+        for block in iter(partial(file.read, 1 << 20), b''):
+            digest.update(block)
+    memo[str(path)] = {'signature': signature, 'digest': digest.hexdigest()}
+    memo_path.parent.mkdir(parents=True, exist_ok=True)
+    memo_path.write_text(json.dumps(memo))
+    return digest.hexdigest()
+
+
+def params_digest(params):
+    digest = hashlib.blake2b(digest_size=16)
+    for name in ['fill_values', 'scale', 'offset']:
+        digest.update(np.ascontiguousarray(params[name],
+                                           dtype='<f8').tobytes())
+    digest.update(json.dumps(None if params['clip'] is None
+                             else list(map(float, params['clip']))).encode())
+    return digest.hexdigest()
+
+
+def model_digest(model):
+    booster = model.get_booster() if hasattr(model, 'get_booster') else model
+    return hashlib.blake2b(bytes(booster.save_raw('ubj')),
+                           digest_size=16).hexdigest()
+
+
+def json_digest(value):
+    """
+    Hash a JSON-like value, e.g. a fitted cleaner. NumPy scalars are hashed as
+    the Python numbers they hold.
+    """
+    payload = json.dumps(value, sort_keys=True, default=lambda v: v.item())
+    return hashlib.blake2b(payload.encode(), digest_size=16).hexdigest()
@@ -0,0 +1,94 @@
+# src/cli.py
+# -*- coding: utf-8 -*-
+import click
+import copy
+import functools
+import importlib
+import logging
+
+# subcommand: (module whose click main it runs, run report name, help shown in
+# the command list); modules are only imported when their subcommand is used
+COMMANDS = {
+    'make-dataset': ('src.data.make_dataset', 'make_dataset',
+                     'Clean and engineer raw data into the processed '
+                     'data set.'),
+    'build-features': ('src.features.build_features', 'build_features',
+                       'Clean and engineer raw data with a fitted cleaner.'),
+    'transform': ('src.models.train_model', 'train_model',
+                  'Impute and scale processed data for the model.'),
+    'train': ('src.models.fit_model', 'fit_model',
+              'Refit the cleaner, imputer, scaler and model on labelled raw '
+              'data.'),
+    'bundle': ('src.models.bundle', 'bundle',
+               'Pack the model, imputer, scaler and cleaner into one bundle '
+               'file.'),
+    'predict': ('src.models.predict_model', 'predict_model',
+                'Score transformed data with a model or bundle.'),
+    'pipeline': ('src.pipeline', 'pipeline',
+                 'Score raw data through the cached pipeline stages.'),
+    'explain': ('src.models.explain', 'explain',
+                'Give the top reasons behind each customer\'s default '
+                'probability.'),
+    'visualize': ('src.visualization.visualize', 'visualize',
+                  'Draw the EDA figures of the processed data.'),
+    'serve': ('src.models.serve', 'serve',
+              'Serve a model bundle over HTTP.'),
+    'synthetic': ('src.data.make_synthetic', 'make_synthetic',
+                  'Generate synthetic customers like the raw data.'),
+}
+
+
+def _reported(command, report):
+    # the subcommand runs under the run report its script's __main__ block
+    # gives it
+    callback = command.callback
+
+    @functools.wraps(callback)
+    def run(*args, **kwargs):
+        from src.instrumentation import run_report
+        with run_report(report):
+            return callback(*args, **kwargs)
+
+    command = copy.copy(command)
+    command.callback = run
+    return command
+
+
+class LazyGroup(click.Group):
+    """
+    Click group over COMMANDS that imports a subcommand's module only when that
+    subcommand is run or its help is asked for. The command list is written
+    from COMMANDS, so listing the subcommands imports nothing.
+    """
+
+    def list_commands(self, ctx):
+        return list(COMMANDS)
+
+    def get_command(self, ctx, name):
+        if name not in COMMANDS:
+            return None
+        module, report, _ = COMMANDS[name]
+        return _reported(importlib.import_module(module).main, report)
+
+    def format_commands(self, ctx, formatter):
+        with formatter.section('Commands'):
+            formatter.write_dl([(name, command[2])
+                                for name, command in COMMANDS.items()])
+
+
+@click.group(cls=LazyGroup)
+@click.option('--log-level', default='INFO', show_default=True,
+              type=click.Choice(['DEBUG', 'INFO', 'WARNING', 'ERROR']))
+def main(log_level):
+    """ AmEx credit card default prediction: data preparation, training,
+        scoring and reporting commands.
+    """
+    log_fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    logging.basicConfig(level=log_level, format=log_fmt)
+
+    from dotenv import find_dotenv, load_dotenv
+    load_dotenv(find_dotenv())
+
+
+if __name__ == '__main__':
+    main()
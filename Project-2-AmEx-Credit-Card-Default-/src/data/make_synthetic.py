@@ -0,0 +1,147 @@
+# src/data/make_synthetic.py
+# -*- coding: utf-8 -*-
+import click
+import logging
+import numpy as np
+import pandas as pd
+from src.data.tables import write_table_chunks
+from src.features.build_features import RAW_COLUMNS, TARGET
+from src.instrumentation import instrumented, run_report
+
+# Marginals of the 45,528-customer competition training set, from
+# notebooks/data_wrangling_2capstone.ipynb and notebooks/eda_amex_project.ipynb
+MISSING_RATES = {'no_of_children': 0.0170, 'owns_car': 0.0120,
+                 'no_of_days_employed': 0.0102, 'yearly_debt_payments': 0.0021,
+                 'migrant_worker': 0.0019, 'total_family_members': 0.0018,
+                 'credit_score': 0.0002}
+GENDERS = {'F': 29957, 'M': 15570, 'XNA': 1}
+OCCUPATIONS = {'Unknown': 14299, 'Laborers': 8134, 'Sales staff': 4725,
+               'Core staff': 4062, 'Managers': 3168, 'Drivers': 2747,
+               'High skill tech staff': 1682, 'Accountants': 1474,
+               'Medicine staff': 1275, 'Security staff': 1025,
+               'Cooking staff': 902, 'Cleaning staff': 665,
+               'Private service staff': 387, 'Low-skill Laborers': 336,
+               'Waiters/barmen staff': 203, 'Secretaries': 199,
+               'Realty agents': 101, 'HR staff': 78, 'IT staff': 66}
+# (median, log-scale spread) of the lognormal money columns, fitted to
+# their quartiles
+INCOME = (171715.0, 0.48)
+DEBT_PAYMENTS = (29082.0, 0.55)
+CREDIT_LIMIT = (35688.0, 0.59)
+# placeholder no_of_days_employed of pensioners and the unemployed
+UNEMPLOYED_DAYS = 365252
+FIRST_NAMES = ['Aditi', 'Arjun', 'Divya', 'Karan', 'Meera', 'Nikhil', 'Pooja',
+               'Rahul', 'Sneha', 'Vikram']
+LAST_NAMES = ['Gupta', 'Iyer', 'Kapoor', 'Khan', 'Mehta', 'Nair', 'Rao',
+              'Reddy', 'Sharma', 'Singh']
+BLOCK_SIZE = 100_000
+
+
+@click.command()
+@click.argument('output_filepath', type=click.Path())
+@click.option('--n-rows', default=45528, type=click.IntRange(min=1),
+              help='Number of customers to generate.')
+@click.option('--seed', default=0, type=int)
+@click.option('--target/--no-target', default=True,
+              help='Include the credit_card_default column, as in train.csv.')
+def main(output_filepath, n_rows, seed, target):
+    """ Generates synthetic customers with the columns and distributions of the
+        AmEx raw data (saved in output_filepath as CSV, Parquet or Arrow).
+    """
+    logger = logging.getLogger(__name__)
+    logger.info(f'Generating {n_rows} synthetic customers')
+
+    n_rows = write_table_chunks(generate_customers(n_rows, seed, target),
+                                output_filepath)
+    logger.info(f'{n_rows} customers saved to {output_filepath}')
+
+
+def generate_customers(n_rows, seed=0, target=True):
+    """
+    Yield n_rows synthetic customers in DataFrames of at most BLOCK_SIZE rows.
+    Each block has its own random stream derived from seed, so a given seed
+    always produces the same customers.
+    """
+    for block, start in enumerate(range(0, n_rows, BLOCK_SIZE)):
+        rng = np.random.default_rng([seed, block])
+        yield make_customers(start, min(BLOCK_SIZE, n_rows - start), rng,
+                             target)
+
+
+def _choice(rng, counts, n):
+    values = list(counts)
+    weights = np.array([counts[value] for value in values], dtype=np.float64)
+    picks = rng.choice(len(values), n, p=weights / weights.sum())
+    return np.array(values, dtype=object)[picks]
+
+
+def _lognormal(rng, median_spread, z):
+    median, spread = median_spread
+    return np.round(median * np.exp(spread * z), 2)
+
+
+@instrumented('make_customers')
+def make_customers(start, n, rng, target=True):
+    """
+    Draw n customers, numbered from start, with RAW_COLUMNS (and the target).
+    Money columns are correlated with income, family size follows the number
+    of children, and default risk rises with past defaults, credit utilisation
+    and a low credit score, at the training set's 8% default rate.
+    """
+    ids = np.arange(start, start + n)
+    children = rng.choice(5, n, p=[0.70, 0.20, 0.087, 0.011, 0.002])
+    income_z = rng.standard_normal(n)
+    employed_days = np.round(1800 * np.exp(rng.standard_normal(n)))
+    employed_days = np.maximum(employed_days, 2)
+    prev_defaults = rng.choice(3, n, p=[0.945, 0.049, 0.006])
+    recent_rate = np.where(prev_defaults > 0, 0.35, 0.035)
+    recent_defaults = (rng.random(n) < recent_rate).astype(np.int64)
+    credit_limit_used = rng.integers(0, 100, n)
+    credit_score = np.round(500 + 449 * rng.beta(2.33, 1.37, n))
+
+    df = pd.DataFrame({
+        'customer_id': [f'CST_{100000 + i}' for i in ids],
+        'name': [f'{FIRST_NAMES[i % 10]} {LAST_NAMES[i // 10 % 10]}'
+                 for i in ids],
+        'age': rng.integers(23, 56, n),
+        'gender': _choice(rng, GENDERS, n),
+        'owns_car': np.where(rng.random(n) < 0.339, 'Y', 'N').astype(object),
+        'owns_house': np.where(rng.random(n) < 0.695, 'Y', 'N').astype(object),
+        'no_of_children': children.astype(np.float64),
+        'net_yearly_income': _lognormal(rng, INCOME, income_z),
+        'no_of_days_employed': np.where(rng.random(n) < 0.18, UNEMPLOYED_DAYS,
+                                        employed_days),
+        'occupation_type': _choice(rng, OCCUPATIONS, n),
+        'total_family_members': (1 + children
+                                 + (rng.random(n) < 0.69)).astype(np.float64),
+        'migrant_worker': (rng.random(n) < 0.179).astype(np.float64),
+        'yearly_debt_payments': _lognormal(rng, DEBT_PAYMENTS,
+                                           0.5 * income_z
+                                           + 0.87 * rng.standard_normal(n)),
+        'credit_limit': _lognormal(rng, CREDIT_LIMIT,
+                                   0.6 * income_z
+                                   + 0.8 * rng.standard_normal(n)),
+        'credit_limit_used(%)': credit_limit_used,
+        'credit_score': credit_score,
+        'prev_defaults': prev_defaults,
+        'default_in_last_6months': recent_defaults,
+    }, columns=RAW_COLUMNS)
+
+    for col, rate in MISSING_RATES.items():
+        df.loc[rng.random(n) < rate, col] = np.nan
+
+    if target:
+        logit = (-3.6 + 3.0 * (prev_defaults > 0) + 2.5 * recent_defaults
+                 + 0.03 * (credit_limit_used - 50)
+                 - 0.008 * (credit_score - 780))
+        defaults = rng.random(n) < 1 / (1 + np.exp(-logit))
+        df[TARGET] = defaults.astype(np.int64)
+    return df
+
+
+if __name__ == '__main__':
+    log_fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    logging.basicConfig(level=logging.INFO, format=log_fmt)
+
+    with run_report('make_synthetic'):
+        main()
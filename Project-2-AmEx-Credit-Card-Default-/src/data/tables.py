@@ -0,0 +1,150 @@
+# src/data/tables.py
+# -*- coding: utf-8 -*-
+import pandas as pd
+from pathlib import Path
+from src.instrumentation import instrumented, stage
+
+# file formats by extension; anything else is read and written as CSV
+FORMATS = {'.parquet': 'parquet', '.pq': 'parquet',
+           '.arrow': 'arrow', '.feather': 'arrow', '.ipc': 'arrow'}
+
+
+def table_format(path):
+    """
+    Return 'parquet', 'arrow' (Arrow IPC file, also known as Feather v2) or
+    'csv' depending on the file extension of path.
+    """
+    return FORMATS.get(Path(path).suffix.lower(), 'csv')
+
+
+def _available(path, columns):
+    # keep the requested columns the file actually has, in the requested order
+    if columns is None:
+        return None
+    fmt = table_format(path)
+    if fmt == 'parquet':
+        import pyarrow.parquet as pq
+        names = pq.read_schema(path).names
+    elif fmt == 'arrow':
+        import pyarrow as pa
+        with pa.memory_map(str(path)) as source:
+            names = pa.ipc.open_file(source).schema.names
+    else:
+        names = pd.read_csv(path, nrows=0).columns
+    names = set(names)
+    return [col for col in columns if col in names]
+
+
+def apply_dtype(df, dtype):
+    """
+    Cast the columns of df named in the dtype mapping, as read_csv(dtype=...)
+    does; columns df lacks are ignored.
+    """
+    if dtype is None:
+        return df
+    return df.astype({col: col_dtype for col, col_dtype in dtype.items()
+                      if col in df.columns})
+
+
+@instrumented('read_table')
+def read_table(path, columns=None, dtype=None):
+    """
+    Read a CSV, Parquet or Arrow IPC file into a DataFrame. Only the listed
+    columns are read when columns is given; listed columns the file lacks are
+    skipped, so optional ones such as the target can be requested. dtype maps
+    column names to the dtypes to load them as, whatever the file format.
+    """
+    columns = _available(path, columns)
+    fmt = table_format(path)
+    if fmt == 'parquet':
+        return apply_dtype(pd.read_parquet(path, columns=columns), dtype)
+    if fmt == 'arrow':
+        return apply_dtype(pd.read_feather(path, columns=columns), dtype)
+    return pd.read_csv(path, usecols=columns, dtype=dtype)
+
+
+def iter_table(path, chunksize, columns=None, dtype=None):
+    """
+    Yield the rows of a CSV, Parquet or Arrow IPC file as DataFrames of at most
+    chunksize rows, reading only the listed columns when columns is given and
+    loading them with the dtypes in the dtype mapping.
+    """
+    chunks = _iter_chunks(path, chunksize, _available(path, columns), dtype)
+    while True:
+        # time each chunk's read as a read_table call
+        with stage('read_table') as frame:
+            chunk = next(chunks, None)
+            frame['rows'] = 0 if chunk is None else len(chunk)
+        if chunk is None:
+            return
+        yield chunk
+
+
+def _iter_chunks(path, chunksize, columns, dtype):
+    fmt = table_format(path)
+    if fmt == 'parquet':
+        import pyarrow.parquet as pq
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunksize,
+                                                       columns=columns):
+            yield apply_dtype(batch.to_pandas(), dtype)
+    elif fmt == 'arrow':
+        import pyarrow as pa
+        with pa.memory_map(str(path)) as source:
+            reader = pa.ipc.open_file(source)
+            for i in range(reader.num_record_batches):
+                batch = reader.get_batch(i)
+                if columns is not None:
+                    batch = batch.select(columns)
+                for start in range(0, batch.num_rows, chunksize):
+                    chunk = batch.slice(start, chunksize).to_pandas()
+                    yield apply_dtype(chunk, dtype)
+    else:
+        yield from pd.read_csv(path, usecols=columns, dtype=dtype,
+                               chunksize=chunksize)
+
+
+@instrumented('write_table')
+def write_table(df, path):
+    """
+    Write df to a CSV, Parquet or Arrow IPC file, chosen by the extension
+    of path.
+    """
+    fmt = table_format(path)
+    if fmt == 'parquet':
+        df.to_parquet(path, index=False)
+    elif fmt == 'arrow':
+        df.reset_index(drop=True).to_feather(path)
+    else:
+        df.to_csv(path, index=False)
+
+
+def write_table_chunks(chunks, path):
+    """
+    Write an iterable of DataFrames with the same columns to a single CSV,
+    Parquet or Arrow IPC file, one chunk at a time. Returns the number of rows.
+    """
+    fmt = table_format(path)
+    n_rows, started, writer, schema = 0, False, None, None
+    try:
+        for chunk in chunks:
+            if fmt == 'csv':
+                chunk.to_csv(path, mode='a' if started else 'w',
+                             header=not started, index=False)
+            else:
+                import pyarrow as pa
+                table = pa.Table.from_pandas(chunk, schema=schema,
+                                             preserve_index=False)
+                if writer is None:
+                    schema = table.schema
+                    if fmt == 'parquet':
+                        import pyarrow.parquet as pq
+                        writer = pq.ParquetWriter(path, schema)
+                    else:
+                        writer = pa.ipc.new_file(str(path), schema)
+                writer.write_table(table)
+            started = True
+            n_rows += len(chunk)
+    finally:
+        if writer is not None:
+            writer.close()
+    return n_rows
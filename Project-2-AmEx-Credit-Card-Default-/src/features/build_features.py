@@ -1,48 +1,188 @@
 # src/features/build_features.py
 # -*- coding: utf-8 -*-
 import click
+import joblib
 import logging
+import numpy as np
 import pandas as pd
 from pathlib import Path
+from src.cache import file_digest, fingerprint, json_digest, run_cached
+from src.data import tables
+from src.data.tables import read_table, write_table
+from src.instrumentation import instrumented, run_report
 
 @click.command()
 @click.argument('input_filepath', type=click.Path(exists=True))
 @click.argument('output_filepath', type=click.Path())
-def main(input_filepath, output_filepath):
+@click.option('--cleaner-filepath', type=click.Path(exists=True), default=None,
+              help='Fitted cleaner (see fit_cleaner) to apply instead of the '
+                   'modes of the input.')
+@click.option('--cache-dir', default=None, type=click.Path(file_okay=False),
+              help='Reuse the output of an earlier run on the same input, '
+                   'cleaner and code from this cache.')
+@click.option('--force', is_flag=True,
+              help='With --cache-dir, recompute the cached output.')
+@click.option('--max-cache-mb', default=2048, type=click.IntRange(min=0),
+              help='With --cache-dir, least recently used entries are '
+                   'evicted beyond this size.')
+def main(input_filepath, output_filepath, cleaner_filepath, cache_dir, force,
+         max_cache_mb):
     """ Runs data processing scripts to turn raw data from (input_filepath) into
         cleaned and engineered data ready to be analyzed (saved in output_filepath).
     """
     logger = logging.getLogger(__name__)
     logger.info('Making final data set from raw data')
 
-    # Load data
-    data = pd.read_csv(input_filepath)
+    cleaner = joblib.load(cleaner_filepath) if cleaner_filepath else None
+    if cache_dir is None:
+        build_features(input_filepath, output_filepath, cleaner)
+    else:
+        key = fingerprint('build_features', [tables.__file__, __file__],
+                          data=file_digest(input_filepath, cache_dir),
+                          cleaner=json_digest(cleaner))
+        run_cached(cache_dir, 'build_features', key, {'data': output_filepath},
+                   lambda paths: build_features(input_filepath, paths['data'],
+                                                cleaner),
+                   force, max_cache_mb << 20)
+    logger.info(f'Data saved to {output_filepath}')
+
+
+def build_features(input_filepath, output_filepath, cleaner=None):
+    """
+    Clean and engineer the raw data at input_filepath into output_filepath,
+    with the fitted cleaner, or one fitted on the input when cleaner is None.
+    """
+    # Load data, reading only the columns cleaning and feature engineering use
+    data = read_table(input_filepath, columns=PROCESSING_COLUMNS,
+                      dtype=RAW_DTYPES)
 
     # Clean data
-    cleaned_data = clean_data(data)
+    cleaned_data = clean_data(data, cleaner)
     
     # Feature Engineering
     engineered_data = feature_engineering(cleaned_data)
     
-    # Save the processed data
-    engineered_data.to_csv(output_filepath, index=False)
-    logger.info(f'Data saved to {output_filepath}')
+    # Save the processed data as CSV, Parquet or Arrow depending on
+    # the extension
+    write_table(engineered_data, output_filepath)
+
+
+# raw customer columns expected by clean_data, without the
+# 'credit_card_default' target
+RAW_COLUMNS = ['customer_id', 'name', 'age', 'gender', 'owns_car',
+               'owns_house', 'no_of_children', 'net_yearly_income',
+               'no_of_days_employed', 'occupation_type',
+               'total_family_members', 'migrant_worker',
+               'yearly_debt_payments', 'credit_limit', 'credit_limit_used(%)',
+               'credit_score', 'prev_defaults', 'default_in_last_6months']
+TARGET = 'credit_card_default'
+# compact load-time dtypes of the raw columns: categoricals for the string
+# flags, nullable small integers for counts and 0/1 flags, float32 for the
+# whole-number scores and percentages, which it holds exactly. Money stays
+# float64: rounding it before the imputer and scaler would change the features
+RAW_DTYPES = {'gender': 'category', 'owns_car': 'category',
+              'owns_house': 'category', 'occupation_type': 'category',
+              'age': 'Int16', 'no_of_children': 'Int8',
+              'no_of_days_employed': 'Int32', 'total_family_members': 'Int8',
+              'migrant_worker': 'Int8', 'prev_defaults': 'Int8',
+              'default_in_last_6months': 'Int8',
+              'net_yearly_income': 'float64',
+              'yearly_debt_payments': 'float64', 'credit_limit': 'float64',
+              'credit_limit_used(%)': 'float32', 'credit_score': 'float32',
+              TARGET: 'Int8'}
+# raw columns feature_engineering drops to mitigate multicollinearity
+DROPPED_COLUMNS = ['name', 'credit_limit', 'no_of_children']
+# raw columns scoring reads; everything else is dropped before the model
+# sees it
+SCORING_COLUMNS = [col for col in RAW_COLUMNS if col not in DROPPED_COLUMNS]
+# raw columns make_dataset and build_features read: scoring columns, the
+# cleaner's and the target
+PROCESSING_COLUMNS = SCORING_COLUMNS + ['no_of_children', TARGET]
+# features the model is trained on, in model column order
+# (see metrics/model_metrics.csv)
+NUMERIC_FEATURES = ['age', 'gender', 'owns_car', 'owns_house',
+                    'net_yearly_income', 'no_of_days_employed',
+                    'total_family_members', 'migrant_worker',
+                    'yearly_debt_payments', 'credit_limit_used_pctg',
+                    'credit_score', 'total_defaults']
+# occupation_type vocabulary frozen at training time, one 'ot_' column
+# per occupation
+OCCUPATION_TYPES = ['Accountants', 'Cleaning staff', 'Cooking staff',
+                    'Core staff', 'Drivers', 'HR staff',
+                    'High skill tech staff', 'IT staff', 'Laborers',
+                    'Low-skill Laborers', 'Managers', 'Medicine staff',
+                    'Private service staff', 'Realty agents', 'Sales staff',
+                    'Secretaries', 'Security staff', 'Unknown',
+                    'Waiters/barmen staff']
+FEATURE_COLUMNS = NUMERIC_FEATURES + [f'ot_{occupation}'
+                                      for occupation in OCCUPATION_TYPES]
+# categories of the binary flags; a value's position is its encoded value
+BINARY_CATEGORIES = {'gender': ['F', 'M'], 'owns_car': ['N', 'Y'],
+                     'owns_house': ['N', 'Y']}
+
+# columns whose missing values are filled with their training-time mode
+FILL_COLUMNS = ['no_of_children', 'owns_car', 'migrant_worker',
+                'total_family_members']
+# every raw column fit_cleaner needs to see
+CLEANER_COLUMNS = FILL_COLUMNS + ['gender']
+
+
+@instrumented('fit_cleaner')
+def fit_cleaner(data):
+    """
+    Learn the fill values clean_data applies, so scoring batches are cleaned
+    with training-time statistics instead of their own.
+
+    data is a DataFrame or an iterable of DataFrame chunks (e.g. read_csv with
+    chunksize). Value counts are merged across chunks and ties are broken like
+    Series.mode, so the result equals the modes of the concatenated data.
+    Returns a dict mapping each of CLEANER_COLUMNS to its mode.
+    """
+    if isinstance(data, pd.DataFrame):
+        data = [data]
+
+    counts = {}
+    for chunk in data:
+        for col in CLEANER_COLUMNS:
+            chunk_counts = chunk[col].value_counts()
+            if isinstance(chunk[col].dtype, pd.CategoricalDtype):
+                # drop unused categories and compare values, not
+                # category positions
+                chunk_counts = chunk_counts[chunk_counts > 0]
+                chunk_counts.index = chunk_counts.index.astype(object)
+            if col in counts:
+                counts[col] = counts[col].add(chunk_counts, fill_value=0)
+            else:
+                counts[col] = chunk_counts
+
+    cleaner = {}
+    for col, col_counts in counts.items():
+        modes = col_counts[col_counts == col_counts.max()]
+        cleaner[col] = modes.sort_index().index[0]
+    return cleaner
 
 
-def clean_data(df):
+@instrumented('clean_data')
+def clean_data(df, cleaner=None):
     logger = logging.getLogger(__name__)
     logger.info('Cleaning data')
     """
-    Function to clean data by handling missing values and anomalies.
+    Function to clean data by handling missing values and anomalies. cleaner
+    holds the fill values from fit_cleaner; when omitted they are fitted on df.
     """
+    if cleaner is None:
+        cleaner = fit_cleaner(df)
     # renaming columns
     df = df.rename(columns={'credit_limit_used(%)': 'credit_limit_used_pctg'})
+    # a categorical column (see RAW_DTYPES) only takes fill values among
+    # its categories
+    for col in FILL_COLUMNS + ['gender']:
+        _add_category(df, col, cleaner[col])
     # Filling missing values for 'no_of_children', 'owns_car', 'migrant_worker', 'total_family_members' with mode
-    for col in ['no_of_children', 'owns_car', 'migrant_worker', 'total_family_members']:
-        df[col].fillna(df[col].mode()[0], inplace=True)
+    df = df.fillna({col: cleaner[col] for col in FILL_COLUMNS})
 
     # Handling 'XNA' values in 'gender'
-    df['gender'] = df['gender'].replace('XNA', df['gender'].mode()[0])
+    df['gender'] = df['gender'].where(df['gender'] != 'XNA', cleaner['gender'])
 
     # Your data might have specific anomalies that you discovered during EDA.
     # Include code to handle those anomalies here.
@@ -50,6 +190,13 @@ def clean_data(df):
     return df
 
 
+def _add_category(df, col, value):
+    if (col in df.columns and isinstance(df[col].dtype, pd.CategoricalDtype)
+            and value not in df[col].cat.categories):
+        df[col] = df[col].cat.add_categories([value])
+
+
+@instrumented('feature_engineering')
 def feature_engineering(df):
     logger = logging.getLogger(__name__)
     logger.info('Engineering features')
@@ -57,7 +204,7 @@ def feature_engineering(df):
     Function for feature engineering, like combining certain features for new insights.
     """
     # dropping columns to mitigate multicollinearity
-    df = df.drop(columns=['name', 'credit_limit', 'no_of_children'], axis=1)
+    df = df.drop(columns=DROPPED_COLUMNS, axis=1, errors='ignore')
     # combining 'prev_defaults' and 'default_in_last_6months' into 'total_defaults'
     if 'prev_defaults' in df.columns and 'default_in_last_6months' in df.columns:
         df['total_defaults'] = df['prev_defaults'] + df['default_in_last_6months']
@@ -66,6 +213,69 @@ def feature_engineering(df):
     return df
 
 
+def encode_features(df, out=None, params=None):
+    """
+    Encode engineered features straight into a matrix laid out
+    as FEATURE_COLUMNS.
+
+    The binary flags and occupation_type are converted to integer category
+    codes against the frozen vocabularies, so the matrix width never depends on
+    the batch. Unknown flag values become NaN and unknown occupations an
+    all-zero one-hot row, as with the map/get_dummies encoding this replaces.
+
+    params holds the fitted imputer and scaler parameters (see
+    src.models.train_model.transform_params). When given, each column is
+    imputed and scaled on its way into the matrix, which is then float32, so
+    the whole transform costs one allocation. out may be a preallocated
+    (len(df), len(FEATURE_COLUMNS)) matrix to fill.
+    """
+    if out is None:
+        dtype = np.float64 if params is None else np.float32
+        out = np.empty((len(df), len(FEATURE_COLUMNS)), dtype=dtype)
+
+    for j, col in enumerate(NUMERIC_FEATURES):
+        if col in BINARY_CATEGORIES:
+            codes = pd.Categorical(df[col],
+                                   categories=BINARY_CATEGORIES[col]).codes
+            values = np.where(codes < 0, np.nan, codes)
+        else:
+            values = df[col].to_numpy(dtype=np.float64, na_value=np.nan)
+        if params is not None:
+            values = _impute_and_scale(values, params, j)
+        out[:, j] = values
+
+    # One-hot encoding for 'occupation_type' from its category codes
+    one_hot_columns = slice(len(NUMERIC_FEATURES), len(FEATURE_COLUMNS))
+    levels = np.array([[0.0], [1.0]])
+    if params is not None:
+        levels = _impute_and_scale(levels, params, one_hot_columns)
+    else:
+        levels = np.broadcast_to(levels, (2, len(OCCUPATION_TYPES)))
+    one_hot = out[:, one_hot_columns]
+    one_hot[:] = levels[0]
+    codes = pd.Categorical(df['occupation_type'],
+                           categories=OCCUPATION_TYPES).codes
+    rows = np.flatnonzero(codes >= 0)
+    one_hot[rows, codes[rows]] = levels[1][codes[rows]]
+
+    return out
+
+
+def _impute_and_scale(values, params, columns):
+    """
+    Fill NaNs and apply the min-max affine map for the given feature columns.
+    Works in float64 with the same operations as SimpleImputer and
+    MinMaxScaler, so the result rounds to float32 exactly like the sklearn
+    pipeline's output.
+    """
+    values = np.where(np.isnan(values), params['fill_values'][columns], values)
+    values *= params['scale'][columns]
+    values += params['offset'][columns]
+    if params['clip'] is not None:
+        np.clip(values, params['clip'][0], params['clip'][1], out=values)
+    return values
+
+
 if __name__ == '__main__':
     log_fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
     logging.basicConfig(level=logging.INFO, format=log_fmt)
@@ -73,4 +283,5 @@ if __name__ == '__main__':
     # not used in this stub but often useful for finding various files
     project_dir = Path(__file__).resolve().parents[2]
 
-    main()
+    with run_report('build_features'):
+        main()
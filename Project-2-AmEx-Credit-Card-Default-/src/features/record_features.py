@@ -0,0 +1,122 @@
+# src/features/record_features.py
+# -*- coding: utf-8 -*-
+import math
+import numpy as np
+from src.features.build_features import (BINARY_CATEGORIES, FEATURE_COLUMNS,
+                                         FILL_COLUMNS, NUMERIC_FEATURES,
+                                         OCCUPATION_TYPES)
+
+# raw fields read from a record for each numeric feature that is not a
+# binary flag
+RAW_FIELDS = {'credit_limit_used_pctg': 'credit_limit_used(%)'}
+
+
+def _is_missing(value):
+    return value is None or (isinstance(value, float) and math.isnan(value))
+
+
+def _number(value, field):
+    # float() accepts what the batch loader parses; anything else names
+    # its field
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"{field} must be a number, not {value!r}") from None
+
+
+def _category(value, field):
+    if isinstance(value, (list, dict)):
+        raise ValueError(f"{field} must be a single value, not {value!r}")
+    return value
+
+
+def _scale(value, params, j):
+    # same float64 operations as encode_features, on a Python float
+    if math.isnan(value):
+        value = float(params['fill_values'][j])
+    value = value * float(params['scale'][j]) + float(params['offset'][j])
+    if params['clip'] is not None:
+        value = min(max(value, params['clip'][0]), params['clip'][1])
+    return value
+
+
+def build_record_tables(params, cleaner):
+    """
+    Precompute everything encode_record needs from the fitted transform
+    parameters (see transform_params) and cleaner: the final, scaled value of
+    every binary flag and occupation, the impute/scale constants of the other
+    numeric features, and a template feature vector with every occupation
+    column switched off.
+    """
+    tables = {'params': params, 'cleaner': dict(cleaner), 'binary': {},
+              'numeric': []}
+
+    for j, col in enumerate(NUMERIC_FEATURES):
+        if col in BINARY_CATEGORIES:
+            # values seen after cleaning map to their scaled code, anything
+            # else to the scaled fill
+            lookup = {value: _scale(float(code), params, j)
+                      for code, value in enumerate(BINARY_CATEGORIES[col])}
+            tables['binary'][col] = (j, lookup, _scale(math.nan, params, j))
+        elif col != 'total_defaults':
+            tables['numeric'].append((j, RAW_FIELDS.get(col, col)))
+
+    one_hot_start = len(NUMERIC_FEATURES)
+    template = np.empty(len(FEATURE_COLUMNS), dtype=np.float32)
+    on_values = np.empty(len(OCCUPATION_TYPES), dtype=np.float32)
+    for k in range(len(OCCUPATION_TYPES)):
+        template[one_hot_start + k] = _scale(0.0, params, one_hot_start + k)
+        on_values[k] = _scale(1.0, params, one_hot_start + k)
+    tables['template'] = template
+    tables['occupations'] = {occupation: (one_hot_start + k, on_values[k])
+                             for k, occupation in enumerate(OCCUPATION_TYPES)}
+    tables['total_defaults'] = NUMERIC_FEATURES.index('total_defaults')
+    return tables
+
+
+def encode_record(record, tables, out=None):
+    """
+    Turn one raw customer dict into the model's float32 feature vector without
+    pandas, matching clean_data, feature_engineering and transform_features
+    value for value. Missing fields, None and NaN are all treated as missing.
+    out may be a preallocated vector (e.g. a row of a batch matrix) to fill.
+    Raises ValueError naming the field when a value cannot be encoded.
+    """
+    if out is None:
+        out = np.empty(len(FEATURE_COLUMNS), dtype=np.float32)
+    out[:] = tables['template']
+    params, cleaner = tables['params'], tables['cleaner']
+
+    for j, field in tables['numeric']:
+        value = record.get(field)
+        if _is_missing(value) and field in FILL_COLUMNS:
+            value = cleaner[field]
+        out[j] = _scale(math.nan if _is_missing(value)
+                        else _number(value, field), params, j)
+
+    for col, (j, lookup, missing_value) in tables['binary'].items():
+        value = _category(record.get(col), col)
+        if col in FILL_COLUMNS and _is_missing(value):
+            value = cleaner[col]
+        elif col == 'gender' and value == 'XNA':
+            value = cleaner['gender']
+        out[j] = lookup.get(value, missing_value)
+
+    prev_defaults = record.get('prev_defaults')
+    recent_defaults = record.get('default_in_last_6months')
+    if _is_missing(prev_defaults) or _is_missing(recent_defaults):
+        total_defaults = math.nan
+    else:
+        total_defaults = (
+            _number(prev_defaults, 'prev_defaults')
+            + _number(recent_defaults, 'default_in_last_6months'))
+    j = tables['total_defaults']
+    out[j] = _scale(total_defaults, params, j)
+
+    occupation_type = _category(record.get('occupation_type'),
+                                'occupation_type')
+    occupation = tables['occupations'].get(occupation_type)
+    if occupation is not None:
+        out[occupation[0]] = occupation[1]
+
+    return out
@@ -0,0 +1,289 @@
+# src/instrumentation.py
+# -*- coding: utf-8 -*-
+import functools
+import json
+import logging
+import numpy as np
+import os
+import pandas as pd
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+
+# run reports are appended here, one JSON object per line, next to
+# model_metrics.csv
+REPORT_PATH = (Path(__file__).resolve().parents[1] / 'metrics'
+               / 'run_reports.jsonl')
+# AMEX_METRICS=1 turns instrumentation on; AMEX_TRACE_ALLOCATIONS=1 also traces
+# Python/NumPy allocations, which slows allocation-heavy stages down
+METRICS_ENV = 'AMEX_METRICS'
+TRACE_ALLOCATIONS_ENV = 'AMEX_TRACE_ALLOCATIONS'
+
+# the active run: None when instrumentation is off, so stages cost one check
+_run = None
+_lock = threading.Lock()
+# stages running in this process, in any thread
+_active_stages = 0
+
+
+def code_version():
+    """
+    Return the short git commit of the working tree, or 'unknown' outside git.
+    """
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'],
+                              capture_output=True, text=True, check=True,
+                              cwd=REPORT_PATH.parents[1]).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def _read_peak_rss():
+    # peak resident set size in bytes since the last _reset_peak_rss
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def _reset_peak_rss():
+    # Linux resets the high-water mark on writing 5 to clear_refs; elsewhere
+    # the peak stays the process's, which still bounds the stage's
+    try:
+        with open('/proc/self/clear_refs', 'w') as clear_refs:
+            clear_refs.write('5')
+    except OSError:
+        pass
+
+
+def start_run(command, trace_allocations=None):
+    """
+    Start collecting stage metrics for command in this process.
+    """
+    global _run
+    if trace_allocations is None:
+        trace_allocations = (os.environ.get(TRACE_ALLOCATIONS_ENV, '0')
+                             not in ('', '0'))
+    if trace_allocations and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    _run = {'command': command, 'started': time.perf_counter(),
+            'trace_allocations': trace_allocations, 'peak_rss': 0,
+            'stages': {}}
+
+
+def metrics_enabled():
+    return _run is not None
+
+
+def _new_entry():
+    return {'calls': 0, 'rows': 0, 'seconds': 0.0, 'peak_rss_mb': None,
+            'peak_alloc_mb': None}
+
+
+def _record(name, rows, seconds, peak_rss, peak_alloc):
+    with _lock:
+        if peak_rss is not None:
+            _run['peak_rss'] = max(_run['peak_rss'], peak_rss)
+        entry = _run['stages'].setdefault(name, _new_entry())
+        entry['calls'] += 1
+        entry['rows'] += rows or 0
+        entry['seconds'] += seconds
+        for key, value in (('peak_rss_mb', peak_rss),
+                           ('peak_alloc_mb', peak_alloc)):
+            if value is not None:
+                value = round(value / (1 << 20), 1)
+                if entry[key] is None or value > entry[key]:
+                    entry[key] = value
+
+
+@contextmanager
+def stage(name, rows=None):
+    """
+    Time the enclosed block as one call of the stage name, and record its rows,
+    peak RSS and, when allocations are traced, peak traced allocations. Does
+    nothing when instrumentation is off. rows may be set on the yielded dict
+    once known.
+
+    The peaks are process-wide, so only a stage that starts while no other runs
+    resets them. A nested stage, or one running alongside another thread's,
+    reports the peak since the outermost running stage began, an upper bound.
+    """
+    global _active_stages
+    if _run is None:
+        yield {}
+        return
+
+    frame = {'rows': rows}
+    tracing = _run['trace_allocations'] and tracemalloc.is_tracing()
+    with _lock:
+        alone = _active_stages == 0
+        _active_stages += 1
+    if alone:
+        _reset_peak_rss()
+        if tracing:
+            tracemalloc.reset_peak()
+    started = time.perf_counter()
+    try:
+        yield frame
+    finally:
+        seconds = time.perf_counter() - started
+        with _lock:
+            _active_stages -= 1
+        peak_rss = _read_peak_rss()
+        peak_alloc = tracemalloc.get_traced_memory()[1] if tracing else None
+        if _run is not None:
+            _record(name, frame['rows'], seconds, peak_rss, peak_alloc)
+
+
+def _count_rows(value):
+    if isinstance(value, (pd.DataFrame, pd.Series, np.ndarray)):
+        return len(value)
+    return None
+
+
+def instrumented(name):
+    """
+    Decorator running each call of a pipeline function as the stage name.
+    Rows are counted from its DataFrame or array result, or else from its
+    first argument.
+    """
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _run is None:
+                return func(*args, **kwargs)
+            with stage(name) as frame:
+                result = func(*args, **kwargs)
+                rows = _count_rows(result)
+                if rows is None and args:
+                    rows = _count_rows(args[0])
+                frame['rows'] = rows
+            return result
+        return wrapper
+    return decorate
+
+
+def drain_stages():
+    """
+    Return the stage metrics collected so far in this process and start afresh,
+    e.g. to send a worker process's metrics back to the parent.
+    """
+    if _run is None:
+        return {}
+    with _lock:
+        stages, _run['stages'] = _run['stages'], {}
+    return stages
+
+
+def merge_stages(stages):
+    """
+    Add stage metrics from drain_stages, e.g. from a worker process, to
+    this run.
+    """
+    if _run is None:
+        return
+    with _lock:
+        for name, other in stages.items():
+            entry = _run['stages'].setdefault(name, _new_entry())
+            for key in ('calls', 'rows', 'seconds'):
+                entry[key] += other[key]
+            for key in ('peak_rss_mb', 'peak_alloc_mb'):
+                value = other[key]
+                if value is not None and (entry[key] is None
+                                          or value > entry[key]):
+                    entry[key] = value
+
+
+def finish_run(status='ok', report_path=REPORT_PATH):
+    """
+    Stop collecting, append the run report to report_path and log a summary of
+    the stages. Returns the report, or None when instrumentation was off.
+    """
+    global _run
+    if _run is None:
+        return None
+    run, _run = _run, None
+    logger = logging.getLogger(__name__)
+
+    stages = []
+    for name, entry in run['stages'].items():
+        seconds = entry['seconds']
+        rows_per_second = None
+        if entry['rows'] and seconds:
+            rows_per_second = round(entry['rows'] / seconds)
+        stages.append({'stage': name, **entry, 'seconds': round(seconds, 6),
+                       'rows_per_second': rows_per_second})
+        summary = (f"{name}: {entry['calls']} call(s), {entry['rows']} rows, "
+                   f'{seconds:.3f} s')
+        if rows_per_second:
+            summary += f', {rows_per_second} rows/s'
+        if entry['peak_rss_mb'] is not None:
+            summary += f", peak RSS {entry['peak_rss_mb']} MB"
+        logger.info(summary)
+
+    # stages reset the high-water mark, so the process peak is the largest
+    # one seen
+    peak_rss = max(_read_peak_rss() or 0, run['peak_rss']) or None
+    finished_at = datetime.now(timezone.utc).isoformat(timespec='seconds')
+    report = {
+        'command': run['command'],
+        'argv': sys.argv[1:],
+        'version': code_version(),
+        'finished_at': finished_at,
+        'status': status,
+        'seconds': round(time.perf_counter() - run['started'], 6),
+        'process_peak_rss_mb': (None if peak_rss is None
+                                else round(peak_rss / (1 << 20), 1)),
+        'trace_allocations': run['trace_allocations'],
+        'stages': stages,
+    }
+    try:
+        os.makedirs(Path(report_path).parent, exist_ok=True)
+        with open(report_path, 'a') as file:
+            file.write(json.dumps(report) + '\n')
+    except OSError as e:
+        logger.warning(f'Could not write the run report to {report_path}: {e}')
+    return report
+
+
+@contextmanager
+def run_report(command):
+    """
+    Collect stage metrics while the enclosed block (typically a click main)
+    runs and append a run report to REPORT_PATH when it ends, however it ends.
+    Off unless AMEX_METRICS=1 is set, as every stage then reads /proc and
+    resets the peak RSS, which the per-batch stages of a long-running service
+    should not pay.
+    """
+    if os.environ.get(METRICS_ENV, '0') in ('', '0'):
+        yield
+        return
+
+    start_run(command)
+    status = 'failed'
+    try:
+        yield
+        status = 'ok'
+    except SystemExit as e:
+        # click's standalone mode always exits, with code 0 on success
+        status = 'ok' if e.code in (None, 0) else 'failed'
+        raise
+    except KeyboardInterrupt:
+        status = 'interrupted'
+        raise
+    finally:
+        finish_run(status)
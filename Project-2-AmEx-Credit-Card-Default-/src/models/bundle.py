@@ -0,0 +1,224 @@
+# src/models/bundle.py
+# -*- coding: utf-8 -*-
+import click
+import hashlib
+import joblib
+import json
+import logging
+import mmap
+import numpy as np
+import struct
+from src.features.build_features import FEATURE_COLUMNS
+from src.instrumentation import instrumented, run_report
+from src.models.forest import Forest, export_forest
+from src.models.train_model import transform_params
+
+# Layout of a bundle file:
+#   MAGIC | header length (uint64, little-endian) | JSON header | data section
+# The data section starts on an ALIGNMENT boundary and holds every numeric
+# array, each aligned so it can be mapped in place, followed by the booster in
+# UBJSON. Version 2 adds the booster's trees exported as node arrays (see
+# src.models.forest).
+MAGIC = b'AMEXBNDL'
+FORMAT_VERSION = 2
+ALIGNMENT = 64
+PARAM_ARRAYS = ['fill_values', 'scale', 'offset']
+# what load_bundle scores with: the XGBoost booster, or the exported trees with
+# NumPy alone
+EVALUATORS = ['xgboost', 'numpy']
+# on-disk dtypes of the exported trees' arrays
+FOREST_DTYPES = {'feature': '<i8', 'threshold': '<f4', 'left': '<i8',
+                 'missing': '<f4', 'value': '<f4', 'roots': '<i8'}
+
+
+@click.command()
+@click.argument('model_filepath', type=click.Path(exists=True))
+@click.argument('imputer_filepath', type=click.Path(exists=True))
+@click.argument('scaler_filepath', type=click.Path(exists=True))
+@click.argument('output_filepath', type=click.Path())
+@click.option('--cleaner-filepath', type=click.Path(exists=True), default=None,
+              help='Fitted cleaner (see fit_cleaner) to pack with the model.')
+def main(model_filepath, imputer_filepath, scaler_filepath, output_filepath,
+         cleaner_filepath):
+    """ Packs the pickled model, imputer, scaler and cleaner into a single
+        bundle file (saved in output_filepath).
+    """
+    logger = logging.getLogger(__name__)
+    logger.info('Building model bundle')
+
+    model = joblib.load(model_filepath)
+    imputer = joblib.load(imputer_filepath)
+    scaler = joblib.load(scaler_filepath)
+    cleaner = joblib.load(cleaner_filepath) if cleaner_filepath else None
+    if cleaner is None:
+        logger.warning('No cleaner given; scoring will fit fill values on '
+                       'its input')
+
+    bundle_id = save_bundle(output_filepath, model,
+                            transform_params(imputer, scaler), cleaner)
+    logger.info(f'Bundle {bundle_id} saved to {output_filepath}')
+
+
+def _align(n):
+    return -(-n // ALIGNMENT) * ALIGNMENT
+
+
+def _lay_out(arrays, chunks, position):
+    # append each array to the data section at an aligned offset, returning
+    # their entries
+    entries = {}
+    for name, array in arrays.items():
+        position = _align(position)
+        entries[name] = {'offset': position, 'dtype': array.dtype.str,
+                         'shape': list(array.shape)}
+        chunks.append((position, array.tobytes()))
+        position += array.nbytes
+    return entries, position
+
+
+def _map_arrays(mapped, data_start, entries):
+    arrays = {}
+    for name, entry in entries.items():
+        dtype = np.dtype(entry['dtype'])
+        count = int(np.prod(entry['shape']))
+        array = np.frombuffer(mapped, dtype=dtype, count=count,
+                              offset=data_start + entry['offset'])
+        arrays[name] = array.reshape(entry['shape'])
+    return arrays
+
+
+def _to_builtin(value):
+    # numpy scalars from fit_cleaner are not JSON serializable
+    return value.item() if isinstance(value, np.generic) else value
+
+
+@instrumented('save_bundle')
+def save_bundle(path, model, params, cleaner=None):
+    """
+    Write the model, its trees exported for the NumPy evaluator, the transform
+    parameters (see transform_params) and the cleaner fill values to a single
+    bundle file. Returns the bundle id, a hash of the contents that changes
+    whenever any of them does.
+    """
+    booster = model.get_booster()
+    if booster.feature_names != FEATURE_COLUMNS:
+        raise ValueError("Model was trained on features "
+                         f"{booster.feature_names}")
+    forest = export_forest(booster)
+
+    # lay out the data section
+    chunks = []
+    arrays, position = _lay_out({name: np.ascontiguousarray(params[name],
+                                                            dtype='<f8')
+                                 for name in PARAM_ARRAYS}, chunks, 0)
+    forest_arrays, position = _lay_out(
+        {name: np.ascontiguousarray(forest[name], dtype=dtype)
+         for name, dtype in FOREST_DTYPES.items()}, chunks, position)
+    raw_booster = bytes(booster.save_raw('ubj'))
+    position = _align(position)
+    booster_entry = {'offset': position, 'length': len(raw_booster),
+                     'format': 'ubj'}
+    chunks.append((position, raw_booster))
+
+    data = bytearray(position + len(raw_booster))
+    for offset, payload in chunks:
+        data[offset:offset + len(payload)] = payload
+
+    header = {
+        'format_version': FORMAT_VERSION,
+        'feature_names': FEATURE_COLUMNS,
+        'cleaner': (None if cleaner is None
+                    else {k: _to_builtin(v) for k, v in cleaner.items()}),
+        'clip': (None if params['clip'] is None
+                 else [float(v) for v in params['clip']]),
+        'arrays': arrays,
+        'forest': {'arrays': forest_arrays,
+                   'base_margin': forest['base_margin'],
+                   'depth': forest['depth']},
+        'booster': booster_entry,
+    }
+    digest = hashlib.sha256(json.dumps(header, sort_keys=True).encode())
+    digest.update(data)
+    header['bundle_id'] = digest.hexdigest()[:16]
+
+    header_bytes = json.dumps(header).encode()
+    data_start = _align(len(MAGIC) + 8 + len(header_bytes))
+    header_bytes = header_bytes.ljust(data_start - len(MAGIC) - 8)
+    with open(path, 'wb') as file:
+        file.write(MAGIC)
+        file.write(struct.pack('<Q', len(header_bytes)))
+        file.write(header_bytes)
+        file.write(data)
+
+    return header['bundle_id']
+
+
+def is_bundle(path):
+    """
+    Check whether the file at path is a model bundle.
+    """
+    with open(path, 'rb') as file:
+        return file.read(len(MAGIC)) == MAGIC
+
+
+@instrumented('load_bundle')
+def load_bundle(path, evaluator='xgboost'):
+    """
+    Map a bundle file into memory and return its contents as a dict with the
+    'model', transform 'params', 'cleaner', 'feature_names', 'bundle_id' and
+    'format_version'. The model is an XGBClassifier, or with the 'numpy'
+    evaluator a Forest over the exported trees, which loads without importing
+    XGBoost. The parameter and tree arrays are read-only views on the mapped
+    file rather than copies.
+    """
+    if evaluator not in EVALUATORS:
+        raise ValueError(f"Unknown evaluator {evaluator}; expected one of "
+                         f"{EVALUATORS}")
+    with open(path, 'rb') as file:
+        mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    if mapped[:len(MAGIC)] != MAGIC:
+        raise ValueError(f"{path} is not a model bundle")
+    (header_length,) = struct.unpack_from('<Q', mapped, len(MAGIC))
+    data_start = len(MAGIC) + 8 + header_length
+    header = json.loads(bytes(mapped[len(MAGIC) + 8:data_start]))
+    if header['format_version'] > FORMAT_VERSION:
+        raise ValueError("Unsupported bundle format version "
+                         f"{header['format_version']}")
+
+    params = {'clip': header['clip'],
+              **_map_arrays(mapped, data_start, header['arrays'])}
+
+    if evaluator == 'numpy' and 'forest' in header:
+        forest = {'base_margin': header['forest']['base_margin'],
+                  'depth': header['forest']['depth'],
+                  'feature_names': header['feature_names'],
+                  **_map_arrays(mapped, data_start,
+                                header['forest']['arrays'])}
+        model = Forest(forest)
+    else:
+        from xgboost import XGBClassifier
+        entry = header['booster']
+        start = data_start + entry['offset']
+        model = XGBClassifier()
+        model.load_model(bytearray(mapped[start:start + entry['length']]))
+        if evaluator == 'numpy':
+            # version 1 bundles carry no exported trees
+            model = Forest(export_forest(model))
+
+    return {
+        'model': model,
+        'params': params,
+        'cleaner': header['cleaner'],
+        'feature_names': header['feature_names'],
+        'bundle_id': header['bundle_id'],
+        'format_version': header['format_version'],
+    }
+
+
+if __name__ == '__main__':
+    log_fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    logging.basicConfig(level=logging.INFO, format=log_fmt)
+
+    with run_report('bundle'):
+        main()
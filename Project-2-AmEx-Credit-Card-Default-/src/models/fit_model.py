@@ -0,0 +1,337 @@
+# src/models/fit_model.py
+# -*- coding: utf-8 -*-
+import click
+import joblib
+import logging
+import numpy as np
+import os
+import pandas as pd
+import tempfile
+from scipy.stats import randint, uniform
+from sklearn.experimental import enable_halving_search_cv  # noqa: F401
+from sklearn.impute import SimpleImputer
+from sklearn.metrics import average_precision_score, roc_auc_score
+from sklearn.model_selection import (HalvingRandomSearchCV, StratifiedKFold,
+                                     train_test_split)
+from sklearn.preprocessing import MinMaxScaler
+from xgboost import XGBClassifier
+from src.data.tables import read_table
+from src.features.build_features import (CLEANER_COLUMNS, FEATURE_COLUMNS,
+                                         PROCESSING_COLUMNS, RAW_DTYPES,
+                                         TARGET, clean_data, encode_features,
+                                         feature_engineering, fit_cleaner)
+from src.instrumentation import instrumented, run_report
+from src.models.out_of_core import (fit_booster_out_of_core, iter_split,
+                                    predict_chunks, write_training_chunks)
+from src.models.predict_model import predict_default_proba
+from src.models.resampling import (RESAMPLING, balance_weight, make_sampler,
+                                   resample)
+from src.models.train_model import (formatting, transform_features,
+                                    transform_params)
+
+# the search space of notebooks/modeling_amex.ipynb; n_estimators is the
+# successive-halving resource and is shortened by early stopping on the
+# final fit
+PARAM_DISTRIBUTIONS = {
+    'learning_rate': uniform(0.01, 0.2),
+    'max_depth': randint(3, 11),
+    'subsample': uniform(0.6, 0.4),
+    'colsample_bytree': uniform(0.3, 0.7),
+}
+ARTIFACTS = {'model': 'best_xgb_model.pkl', 'imputer': 'simple_imputer.pkl',
+             'scaler': 'min-max-scaler.pkl', 'cleaner': 'cleaner.pkl'}
+
+
+@click.command()
+@click.argument('input_filepath', type=click.Path(exists=True))
+@click.argument('output_dir', type=click.Path(file_okay=False))
+@click.option('--metrics-path', default='metrics/model_metrics.csv',
+              type=click.Path(),
+              help='CSV the model, its hyperparameters and test scores are '
+                   'appended to.')
+@click.option('--resampling', default=None, type=click.Choice(RESAMPLING),
+              help='How the minority class is rebalanced in the training '
+                   'split (see src/models/resampling.py); smote by default, '
+                   'none out of core.')
+@click.option('--test-size', default=0.3,
+              type=click.FloatRange(0, 1, min_open=True, max_open=True))
+@click.option('--validation-size', default=0.1,
+              type=click.FloatRange(0, 1, min_open=True, max_open=True),
+              help='Share of the training split held out for early stopping.')
+@click.option('--n-candidates', default=81, type=click.IntRange(min=1),
+              help='Hyperparameter candidates drawn for successive halving.')
+@click.option('--min-trees', default=20, type=click.IntRange(min=1),
+              help='Trees each candidate is first evaluated with.')
+@click.option('--max-trees', default=540, type=click.IntRange(min=1),
+              help='Trees the last candidates are evaluated with, and the '
+                   'early stopping cap.')
+@click.option('--early-stopping-rounds', default=50,
+              type=click.IntRange(min=1))
+@click.option('--out-of-core', is_flag=True,
+              help='Stream the data from disk in chunks instead of loading '
+                   'it, reusing the cleaner, imputer, scaler and '
+                   'hyperparameters in --artifacts-dir.')
+@click.option('--chunksize', default=100_000, type=click.IntRange(min=1),
+              help='Rows per chunk out of core, and per SMOTE block with '
+                   'chunked_smote.')
+@click.option('--artifacts-dir', default='models',
+              type=click.Path(file_okay=False),
+              help='Fitted artifacts reused out of core.')
+@click.option('--chunk-dir', default=None, type=click.Path(file_okay=False),
+              help='Where transformed chunks are staged out of core; the '
+                   'system temporary directory by default.')
+@click.option('--n-jobs', default=-1, type=int,
+              help='Parallel jobs; -1 uses every core.')
+@click.option('--seed', default=246, type=int)
+def main(input_filepath, output_dir, metrics_path, resampling, test_size,
+         validation_size, n_candidates, min_trees, max_trees,
+         early_stopping_rounds, out_of_core, chunksize, artifacts_dir,
+         chunk_dir, n_jobs, seed):
+    """ Refits the cleaner, imputer, scaler and XGBoost model on raw labelled
+        data from (input_filepath), with a successive-halving hyperparameter
+        search, and saves them in output_dir. The same seed always gives the
+        same artifacts.
+
+        With --out-of-core, data larger than memory is streamed from disk
+        through the fitted transforms in --artifacts-dir and only the model is
+        refitted, with the hyperparameters of the model there.
+    """
+    logger = logging.getLogger(__name__)
+    logger.info('Training the model')
+
+    if out_of_core:
+        if resampling == 'smote':
+            raise click.UsageError('--resampling smote needs all the data in '
+                                   'memory; use chunked_smote or weight')
+        model, imputer, scaler, cleaner, scores = train_out_of_core(
+            input_filepath, resampling or 'none', artifacts_dir, chunk_dir,
+            chunksize, test_size, validation_size, max_trees,
+            early_stopping_rounds, n_jobs, seed)
+    else:
+        model, imputer, scaler, cleaner, scores = train_in_memory(
+            input_filepath, resampling or 'smote', chunksize, test_size,
+            validation_size, n_candidates, min_trees, max_trees,
+            early_stopping_rounds, n_jobs, seed)
+    logger.info(f"Test AUC-ROC {scores['AUC-ROC']:.6f}, AUC-PR "
+                f"{scores['AUC-PR']:.6f}")
+
+    os.makedirs(output_dir, exist_ok=True)
+    for name, artifact in (('model', model), ('imputer', imputer),
+                           ('scaler', scaler), ('cleaner', cleaner)):
+        joblib.dump(artifact, os.path.join(output_dir, ARTIFACTS[name]))
+    record_metrics(metrics_path, model, scores)
+    logger.info(f'Model, imputer, scaler and cleaner saved to {output_dir}')
+
+
+def train_in_memory(path, resampling, chunksize, test_size, validation_size,
+                    n_candidates, min_trees, max_trees, early_stopping_rounds,
+                    n_jobs, seed):
+    """
+    Fit the cleaner, imputer, scaler and model on the raw labelled data at
+    path. Returns them with the model's test scores.
+    """
+    data = read_table(path, columns=PROCESSING_COLUMNS, dtype=RAW_DTYPES)
+    if TARGET not in data.columns:
+        raise click.UsageError(f'{path} has no {TARGET} column')
+    data = data.dropna(subset=[TARGET]).reset_index(drop=True)
+    y = data[TARGET].to_numpy(dtype=np.int64)
+
+    # the raw rows are split first, so the cleaner, imputer and scaler are only
+    # fitted on the 'fit' rows: the test split never influences the fitted
+    # artifacts, and the validation split only decides when boosting stops
+    train_rows, test_rows = train_test_split(np.arange(len(data)),
+                                             test_size=test_size, stratify=y,
+                                             random_state=seed)
+    fit_rows, val_rows = train_test_split(train_rows,
+                                          test_size=validation_size,
+                                          stratify=y[train_rows],
+                                          random_state=seed)
+
+    cleaner = fit_cleaner(data.iloc[fit_rows])
+    features = feature_engineering(clean_data(data, cleaner))
+    X, _ = formatting(features.drop(columns=TARGET))
+    X_fit, X_val, X_test = (X.iloc[rows]
+                            for rows in (fit_rows, val_rows, test_rows))
+    y_fit, y_val, y_test = (y[rows]
+                            for rows in (fit_rows, val_rows, test_rows))
+
+    imputer, scaler = fit_transforms(X_fit)
+    params = transform_params(imputer, scaler)
+    X_fit, X_val, X_test = (transform_features(df, params)
+                            for df in (X_fit, X_val, X_test))
+    sampler = make_sampler(resampling, seed, chunksize)
+    weights = ({'scale_pos_weight': balance_weight(y_fit)}
+               if resampling == 'weight' else {})
+
+    best_params = search_hyperparameters(X_fit, y_fit, sampler, n_candidates,
+                                         min_trees, max_trees, seed, n_jobs,
+                                         weights)
+    best_params = {**best_params, **weights}
+    X_fit, y_fit = resample(X_fit, y_fit, sampler)
+    model = fit_booster(X_fit, y_fit, X_val, y_val, best_params, max_trees,
+                        early_stopping_rounds, seed, n_jobs)
+    scores = evaluate(y_test, predict_default_proba(X_test, model))
+    return model, imputer, scaler, cleaner, scores
+
+
+def train_out_of_core(path, resampling, artifacts_dir, chunk_dir, chunksize,
+                      test_size, validation_size, max_trees,
+                      early_stopping_rounds, n_jobs, seed):
+    """
+    Refit the model on the raw labelled data at path without loading it: chunks
+    go through the cleaner, imputer and scaler in artifacts_dir to disk, and
+    boosting reads them back through a QuantileDMatrix (see
+    src.models.out_of_core). The cleaner is fitted in a first pass over the
+    'fit' rows when artifacts_dir has none, as in train_in_memory. Splits are
+    drawn by customer_id hash rather than stratified. With chunked_smote each
+    chunk's training rows are resampled on their own before they are staged.
+    Returns the artifacts with the model's test scores.
+    """
+    imputer = joblib.load(os.path.join(artifacts_dir, ARTIFACTS['imputer']))
+    scaler = joblib.load(os.path.join(artifacts_dir, ARTIFACTS['scaler']))
+    params = transform_params(imputer, scaler)
+    hyperparameters = load_hyperparameters(os.path.join(artifacts_dir,
+                                                        ARTIFACTS['model']))
+    cleaner_path = os.path.join(artifacts_dir, ARTIFACTS['cleaner'])
+    if os.path.exists(cleaner_path):
+        cleaner = joblib.load(cleaner_path)
+    else:
+        cleaner = fit_cleaner(iter_split(path, chunksize, CLEANER_COLUMNS,
+                                         'fit', test_size, validation_size))
+
+    if chunk_dir is not None:
+        os.makedirs(chunk_dir, exist_ok=True)
+    sampler = make_sampler(resampling, seed, chunksize)
+    with tempfile.TemporaryDirectory(prefix='fit_model-',
+                                     dir=chunk_dir) as directory:
+        paths = write_training_chunks(path, chunksize, cleaner, params,
+                                      directory, test_size, validation_size,
+                                      sampler)
+        if resampling == 'weight':
+            labels = (np.load(y_path, mmap_mode='r')
+                      for _, y_path in paths['fit'])
+            hyperparameters['scale_pos_weight'] = balance_weight(*labels)
+        model = fit_booster_out_of_core(paths, hyperparameters, max_trees,
+                                        early_stopping_rounds, seed, n_jobs)
+        scores = evaluate(*predict_chunks(model, paths['test']))
+    return model, imputer, scaler, cleaner, scores
+
+
+def load_hyperparameters(model_path):
+    """
+    Read the PARAM_DISTRIBUTIONS hyperparameters of the fitted XGBClassifier
+    at model_path.
+    """
+    fitted = joblib.load(model_path).get_params()
+    return {name: fitted[name] for name in PARAM_DISTRIBUTIONS
+            if fitted.get(name) is not None}
+
+
+@instrumented('fit_transforms')
+def fit_transforms(X):
+    """
+    Fit the median SimpleImputer and the MinMaxScaler on the encoded features
+    of X, named as FEATURE_COLUMNS so transform_params can check them.
+    """
+    encoded = pd.DataFrame(encode_features(X), columns=FEATURE_COLUMNS)
+    imputer = SimpleImputer(strategy='median').fit(encoded)
+    imputed = pd.DataFrame(imputer.transform(encoded), columns=FEATURE_COLUMNS)
+    scaler = MinMaxScaler().fit(imputed)
+    return imputer, scaler
+
+
+@instrumented('search_hyperparameters')
+def search_hyperparameters(X, y, sampler, n_candidates, min_trees, max_trees,
+                           seed, n_jobs=-1, params=None):
+    """
+    Successive halving over PARAM_DISTRIBUTIONS: n_candidates start with
+    min_trees trees, and each round the best third goes on with three times as
+    many, up to max_trees, scored by 3-fold cross-validated ROC AUC. Candidates
+    are fitted in parallel on n_jobs cores with the histogram tree method, one
+    thread each.
+
+    sampler (see make_sampler) rebalances each training fold only, so synthetic
+    rows never reach a validation fold and inflate its score. params are fixed
+    XGBoost parameters, e.g. scale_pos_weight. Returns the best candidate's
+    searched parameters, without n_estimators.
+    """
+    logger = logging.getLogger(__name__)
+    estimator = XGBClassifier(tree_method='hist', random_state=seed, n_jobs=1,
+                              **(params or {}))
+    distributions, resource = PARAM_DISTRIBUTIONS, 'n_estimators'
+    if sampler is not None:
+        from imblearn.pipeline import Pipeline
+        estimator = Pipeline([('resample', sampler), ('model', estimator)])
+        distributions = {f'model__{k}': v for k, v in distributions.items()}
+        resource = f'model__{resource}'
+
+    search = HalvingRandomSearchCV(
+        estimator, distributions, n_candidates=n_candidates, factor=3,
+        resource=resource, min_resources=min_trees, max_resources=max_trees,
+        aggressive_elimination=True,
+        cv=StratifiedKFold(n_splits=3, shuffle=True, random_state=seed),
+        scoring='roc_auc', refit=False, random_state=seed, n_jobs=n_jobs)
+    search.fit(X, y)
+
+    best_params = {k.split('__')[-1]: v for k, v in search.best_params_.items()
+                   if k != resource}
+    logger.info(f'Best of {n_candidates} candidates after '
+                f'{search.n_iterations_} rounds: {best_params}, CV AUC-ROC '
+                f'{search.best_score_:.6f}')
+    return best_params
+
+
+@instrumented('fit_booster')
+def fit_booster(X, y, X_val, y_val, params, max_trees, early_stopping_rounds,
+                seed, n_jobs=-1):
+    """
+    Boost up to max_trees trees with params, stopping once the validation ROC
+    AUC has not improved for early_stopping_rounds, then refit with the best
+    number of trees, so the saved booster predicts with all of its trees.
+    """
+    logger = logging.getLogger(__name__)
+    model = XGBClassifier(tree_method='hist', n_estimators=max_trees,
+                          eval_metric='auc',
+                          early_stopping_rounds=early_stopping_rounds,
+                          random_state=seed, n_jobs=n_jobs, **params)
+    model.fit(X, y, eval_set=[(X_val, y_val)], verbose=False)
+    n_trees = model.best_iteration + 1
+    logger.info(f'Early stopping kept {n_trees} of {max_trees} trees, '
+                f'validation AUC-ROC {model.best_score:.6f}')
+
+    return XGBClassifier(tree_method='hist', n_estimators=n_trees,
+                         random_state=seed, n_jobs=n_jobs, **params).fit(X, y)
+
+
+def evaluate(y, probabilities):
+    return {'AUC-ROC': roc_auc_score(y, probabilities),
+            'AUC-PR': average_precision_score(y, probabilities)}
+
+
+def record_metrics(path, model, scores):
+    """
+    Append the model's features, hyperparameters and test scores to path, in
+    the layout of metrics/model_metrics.csv.
+    """
+    params = model.get_params()
+    hyperparameters = (['tree_method'] + sorted(PARAM_DISTRIBUTIONS)
+                       + ['n_estimators'])
+    if params.get('scale_pos_weight') is not None:
+        hyperparameters.append('scale_pos_weight')
+    row = pd.DataFrame([{
+        'Model': 'XGBoost',
+        'Features': ', '.join(FEATURE_COLUMNS),
+        'Hyperparameters': ', '.join(f'{name}={params[name]}'
+                                     for name in hyperparameters),
+        'Performance Metrics': ', '.join(f'{name}={value:.6f}'
+                                         for name, value in scores.items()),
+    }])
+    row.to_csv(path, mode='a', header=not os.path.exists(path), index=False)
+
+
+if __name__ == '__main__':
+    log_fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    logging.basicConfig(level=logging.INFO, format=log_fmt)
+
+    with run_report('fit_model'):
+        main()
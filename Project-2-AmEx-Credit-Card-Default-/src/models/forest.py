@@ -0,0 +1,143 @@
+# src/models/forest.py
+# -*- coding: utf-8 -*-
+import json
+import numpy as np
+
+# node arrays of an exported forest, all trees' nodes concatenated
+FOREST_ARRAYS = ['feature', 'threshold', 'left', 'missing', 'value', 'roots']
+# rows walked down the trees at once; the node matrix holds rows times
+# trees indices
+BATCH_SIZE = 256
+
+
+def export_forest(model):
+    """
+    Flatten the trees of a binary:logistic XGBClassifier or Booster into node
+    arrays that Forest evaluates with NumPy alone. Returns a dict of the
+    FOREST_ARRAYS plus the 'base_margin', the 'depth' of the deepest tree and
+    the 'feature_names':
+
+    feature[i]       feature tested at node i (0 at leaves)
+    threshold[i]     node i sends a row left when its value is below this, and
+                     NaN at leaves, which no value reaches
+    left[i]          left child of node i, the right one being left[i] + 1; a
+                     leaf is its own left child
+    missing[i]       value a missing feature stands for at node i, -inf when
+                     missing values go left and inf when they go right
+    value[i]         leaf value of node i (0 for split nodes)
+    roots[t]         root node of tree t
+    """
+    booster = model.get_booster() if hasattr(model, 'get_booster') else model
+    learner = json.loads(bytes(booster.save_raw('json')))['learner']
+    objective = learner['objective']['name']
+    booster_name = learner['gradient_booster']['name']
+    if objective != 'binary:logistic' or booster_name != 'gbtree':
+        raise ValueError("Only binary:logistic tree boosters can be "
+                         f"exported, not {objective}")
+
+    parts = {name: [] for name in FOREST_ARRAYS}
+    depth, n_nodes = 0, 0
+    for tree in learner['gradient_booster']['model']['trees']:
+        if any(tree['split_type']):
+            raise ValueError('Trees with categorical splits cannot be '
+                             'exported')
+        nodes, tree_depth = _export_tree(tree)
+        nodes['left'] += n_nodes
+        nodes['roots'] = [n_nodes]
+        for name, values in nodes.items():
+            parts[name].append(values)
+        depth = max(depth, tree_depth)
+        n_nodes += len(nodes['value'])
+
+    forest = {name: np.concatenate(values) for name, values in parts.items()}
+    base_score = float(learner['learner_model_param']['base_score'])
+    return {
+        'feature': forest['feature'].astype(np.intp),
+        'threshold': forest['threshold'].astype(np.float32),
+        'left': forest['left'].astype(np.intp),
+        'missing': forest['missing'].astype(np.float32),
+        'value': forest['value'].astype(np.float32),
+        'roots': forest['roots'].astype(np.intp),
+        'base_margin': float(np.log(base_score / (1 - base_score))),
+        'depth': depth,
+        'feature_names': booster.feature_names,
+    }
+
+
+def _export_tree(tree):
+    # renumber the nodes breadth first, so every split node's children
+    # are adjacent
+    left, right = tree['left_children'], tree['right_children']
+    order, depths = [0], [0]
+    for node, depth in zip(order, depths):
+        if left[node] != -1:
+            order += [left[node], right[node]]
+            depths += [depth + 1, depth + 1]
+    order = np.array(order)
+    position = np.empty(len(order), dtype=np.intp)
+    position[order] = np.arange(len(order))
+
+    leaves = np.asarray(left)[order] == -1
+    conditions = np.asarray(tree['split_conditions'], dtype=np.float32)[order]
+    default_left = np.asarray(tree['default_left'], dtype=bool)[order]
+    return {
+        'feature': np.where(leaves, 0,
+                            np.asarray(tree['split_indices'])[order]),
+        'threshold': np.where(leaves, np.nan, conditions),
+        'left': np.where(leaves, np.arange(len(order)),
+                         position[np.asarray(left)[order]]),
+        'missing': np.where(default_left, -np.inf, np.inf),
+        'value': np.where(leaves, conditions, 0),
+    }, max(depths)
+
+
+class Forest:
+    """
+    NumPy evaluator of an exported forest (see export_forest). Every row of a
+    batch descends all trees together, one level per step, so a forest of depth
+    d takes d vectorised steps whatever the number of trees. Stands in for the
+    booster in the scoring code: get_booster, feature_names, set_param and
+    inplace_predict behave as the Booster's do for binary:logistic.
+    """
+
+    def __init__(self, forest, batch_size=BATCH_SIZE):
+        for name in FOREST_ARRAYS:
+            setattr(self, name, np.asarray(forest[name]))
+        self.base_margin = forest['base_margin']
+        self.depth = forest['depth']
+        self.feature_names = forest['feature_names']
+        self.batch_size = batch_size
+
+    def get_booster(self):
+        return self
+
+    def set_param(self, params):
+        # the evaluator is single-threaded; nthread has nothing to set
+        pass
+
+    def predict_margin(self, X):
+        X = np.ascontiguousarray(X, dtype=np.float32)
+        margins = np.empty(len(X))
+        for start in range(0, len(X), self.batch_size):
+            batch = slice(start, start + self.batch_size)
+            margins[batch] = self._margin(X[batch])
+        return margins
+
+    def inplace_predict(self, X, validate_features=False):
+        return (1 / (1 + np.exp(-self.predict_margin(X)))).astype(np.float32)
+
+    def _margin(self, X):
+        n_rows, n_features = X.shape
+        values = X.ravel()
+        row_starts = np.arange(0, n_rows * n_features, n_features)[:, None]
+        has_missing = np.isnan(values).any()
+        nodes = np.broadcast_to(self.roots, (n_rows, len(self.roots)))
+        for _ in range(self.depth):
+            x = values.take(row_starts + self.feature.take(nodes))
+            if has_missing:
+                x = np.where(np.isnan(x), self.missing.take(nodes), x)
+            # rows at or above the threshold go to the right child, next to the
+            # left one
+            nodes = self.left.take(nodes) + (x >= self.threshold.take(nodes))
+        return (self.value.take(nodes).sum(axis=1, dtype=np.float64)
+                + self.base_margin)
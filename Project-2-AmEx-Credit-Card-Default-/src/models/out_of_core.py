@@ -0,0 +1,172 @@
+# src/models/out_of_core.py
+# -*- coding: utf-8 -*-
+import logging
+import numpy as np
+import pandas as pd
+import warnings
+import xgboost as xgb
+from pathlib import Path
+from xgboost import XGBClassifier
+from src.data.tables import iter_table
+from src.features.build_features import (FEATURE_COLUMNS, PROCESSING_COLUMNS,
+                                         RAW_DTYPES, TARGET, clean_data,
+                                         feature_engineering)
+from src.instrumentation import instrumented
+from src.models.predict_model import predict_default_proba
+from src.models.resampling import resample
+from src.models.train_model import formatting, transform_features
+
+SPLITS = ['fit', 'validation', 'test']
+
+
+def assign_splits(customer_ids, test_size, validation_size):
+    """
+    Assign each customer to the 'fit', 'validation' or 'test' split from a
+    hash of its customer_id, so chunks can be split independently and a
+    customer always lands in the same split, whatever the chunk size. Shares
+    are approximate.
+    """
+    hashes = pd.util.hash_pandas_object(customer_ids, index=False).to_numpy()
+    position = hashes / 2.0 ** 64
+    splits = np.full(len(customer_ids), 'fit', dtype=object)
+    validation_end = test_size + (1 - test_size) * validation_size
+    splits[position < validation_end] = 'validation'
+    splits[position < test_size] = 'test'
+    return splits
+
+
+def iter_split(path, chunksize, columns, split, test_size, validation_size):
+    """
+    Yield the labelled rows of the raw data at path that assign_splits puts in
+    split, in chunks of at most chunksize rows, with the listed columns. Rows
+    are split as write_training_chunks splits them, so e.g. a cleaner fitted on
+    the 'fit' rows never sees a test customer.
+    """
+    columns = list(dict.fromkeys(columns + ['customer_id', TARGET]))
+    for chunk in iter_table(path, chunksize, columns=columns,
+                            dtype=RAW_DTYPES):
+        if TARGET not in chunk.columns:
+            raise ValueError(f'{path} has no {TARGET} column')
+        chunk = chunk.dropna(subset=[TARGET])
+        splits = assign_splits(chunk['customer_id'], test_size,
+                               validation_size)
+        yield chunk[splits == split]
+
+
+@instrumented('write_training_chunks')
+def write_training_chunks(path, chunksize, cleaner, params, chunk_dir,
+                          test_size, validation_size, sampler=None):
+    """
+    Stream the raw labelled data at path in chunks of chunksize rows through
+    clean_data, feature_engineering and transform_features with the fitted
+    cleaner and transform params, the transforms scoring applies, and save each
+    chunk's float32 features and labels as .npy files under chunk_dir/<split>/.
+    sampler (see src.models.resampling.make_sampler) rebalances each chunk's
+    'fit' rows, whose synthetic rows are staged with them. Returns the
+    (features, labels) paths of each split, in SPLITS order.
+    """
+    chunk_dir = Path(chunk_dir)
+    paths = {split: [] for split in SPLITS}
+    for split in SPLITS:
+        (chunk_dir / split).mkdir(parents=True, exist_ok=True)
+
+    for i, chunk in enumerate(iter_table(path, chunksize,
+                                         columns=PROCESSING_COLUMNS,
+                                         dtype=RAW_DTYPES)):
+        if TARGET not in chunk.columns:
+            raise ValueError(f'{path} has no {TARGET} column')
+        chunk = chunk.dropna(subset=[TARGET])
+        features = feature_engineering(clean_data(chunk, cleaner))
+        y = features.pop(TARGET).to_numpy(dtype=np.float32)
+        X, customer_ids = formatting(features)
+        splits = assign_splits(customer_ids, test_size, validation_size)
+        X = transform_features(X, params).to_numpy()
+
+        for split in SPLITS:
+            rows = splits == split
+            if not rows.any():
+                continue
+            X_split, y_split = X[rows], y[rows]
+            if split == 'fit':
+                X_split, y_split = resample(X_split, y_split, sampler)
+            X_path = chunk_dir / split / f'{i:06d}-X.npy'
+            y_path = chunk_dir / split / f'{i:06d}-y.npy'
+            np.save(X_path, X_split)
+            np.save(y_path, y_split.astype(np.float32))
+            paths[split].append((X_path, y_path))
+    return paths
+
+
+class ChunkIter(xgb.DataIter):
+    """
+    Feed XGBoost the (features, labels) .npy chunks from write_training_chunks
+    one at a time, memory-mapped, so a QuantileDMatrix can be built without
+    ever holding the whole matrix in memory.
+    """
+
+    def __init__(self, paths):
+        self._paths = paths
+        self._position = 0
+        super().__init__()
+
+    def next(self, input_data):
+        if self._position == len(self._paths):
+            return 0
+        X_path, y_path = self._paths[self._position]
+        input_data(data=np.load(X_path, mmap_mode='r'), label=np.load(y_path),
+                   feature_names=FEATURE_COLUMNS)
+        self._position += 1
+        return 1
+
+    def reset(self):
+        self._position = 0
+
+
+@instrumented('fit_booster_out_of_core')
+def fit_booster_out_of_core(paths, params, max_trees, early_stopping_rounds,
+                            seed, n_jobs=-1):
+    """
+    Boost on the 'fit' chunks with params and the histogram tree method,
+    stopping once the ROC AUC on the 'validation' chunks has not improved for
+    early_stopping_rounds. Both are QuantileDMatrix built chunk by chunk, which
+    keep only the binned features (one byte per value) in memory. Returns an
+    XGBClassifier holding the trees up to the best iteration.
+    """
+    logger = logging.getLogger(__name__)
+    train = xgb.QuantileDMatrix(ChunkIter(paths['fit']), nthread=n_jobs)
+    validation = xgb.QuantileDMatrix(ChunkIter(paths['validation']), ref=train,
+                                     nthread=n_jobs)
+    logger.info(f'Training on {train.num_row()} rows, validating on '
+                f'{validation.num_row()}')
+
+    booster = xgb.train({**params, 'tree_method': 'hist',
+                         'objective': 'binary:logistic', 'eval_metric': 'auc',
+                         'seed': seed, 'nthread': n_jobs}, train,
+                        num_boost_round=max_trees,
+                        evals=[(validation, 'validation')],
+                        early_stopping_rounds=early_stopping_rounds,
+                        verbose_eval=False)
+    n_trees = booster.best_iteration + 1
+    logger.info(f'Early stopping kept {n_trees} of {max_trees} trees, '
+                f'validation AUC-ROC {booster.best_score:.6f}')
+
+    # wrapped like a bundle's booster, for the scoring code and the
+    # artifact files
+    model = XGBClassifier(tree_method='hist', n_estimators=n_trees,
+                          random_state=seed, n_jobs=n_jobs, **params)
+    with warnings.catch_warnings():
+        warnings.filterwarnings('ignore',
+                                message='Loading a native XGBoost model')
+        model.load_model(bytearray(booster[:n_trees].save_raw('ubj')))
+    return model
+
+
+def predict_chunks(model, paths):
+    """
+    Return the labels and predicted default probabilities of the given chunks.
+    """
+    y = np.concatenate([np.load(y_path) for _, y_path in paths])
+    probabilities = np.concatenate(
+        [predict_default_proba(np.load(X_path, mmap_mode='r'), model)
+         for X_path, _ in paths])
+    return y, probabilities
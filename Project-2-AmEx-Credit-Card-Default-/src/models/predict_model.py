@@ -2,39 +2,69 @@
 # -*- coding: utf-8 -*-
 import click
 import logging
+import numpy as np
 import pandas as pd
-import pickle
+import joblib
 from pathlib import Path
+from src.data.tables import iter_table, read_table, write_table_chunks
+from src.features.record_features import encode_record
+from src.instrumentation import instrumented, run_report
+from src.models.bundle import EVALUATORS, is_bundle, load_bundle
 
 @click.command()
 @click.argument('input_filepath', type=click.Path(exists=True))
 @click.argument('model_filepath', type=click.Path(exists=True))
 @click.argument('output_filepath', type=click.Path())
-def main(input_filepath, model_filepath, output_filepath):
+@click.option('--chunksize', default=None, type=click.IntRange(min=1),
+              help='Read, score and append the input in chunks of this many '
+                   'rows.')
+@click.option('--nthread', default=None, type=click.IntRange(min=1),
+              help='Threads used by the booster; all cores by default.')
+@click.option('--batch-size', default=None, type=click.IntRange(min=1),
+              help='Rows passed to the booster per prediction call.')
+@click.option('--evaluator', default='xgboost', type=click.Choice(EVALUATORS),
+              help='Score a bundle with the XGBoost booster or its trees in '
+                   'NumPy.')
+def main(input_filepath, model_filepath, output_filepath, chunksize, nthread,
+         batch_size, evaluator):
     """ Loads data from the input file, loads the trained model from the model file,
         makes predictions on the data, and saves the results to the output file.
     """
     logger = logging.getLogger(__name__)
     logger.info('Making predictions with the model')
 
-    # Load data
-    data = pd.read_csv(input_filepath)
-    customer_ids = data['customer_id']  # Assuming customer_id is a column in your data
+    # Load model, from a model bundle or a pickled model
+    if is_bundle(model_filepath):
+        model = load_bundle(model_filepath, evaluator)['model']
+    elif evaluator == 'numpy':
+        raise click.UsageError('--evaluator numpy needs a model bundle')
+    else:
+        model = joblib.load(model_filepath)
 
-    # Load model
-    with open(model_filepath, 'rb') as file:
-        model = pickle.load(file)
+    # Load data, whole or as an iterator of chunks, reading only the
+    # model's columns
+    columns = ['customer_id'] + model.get_booster().feature_names
+    if chunksize is None:
+        chunks = [read_table(input_filepath, columns=columns)]
+    else:
+        chunks = iter_table(input_filepath, chunksize, columns=columns)
 
-    # Prepare data for prediction
-    X = prepare_for_prediction(data, model)
+    def score_chunks():
+        for data in chunks:
+            # Assuming customer_id is a column in your data
+            customer_ids = data['customer_id'].to_numpy()
 
-    # Make predictions
-    results = make_predictions(X, model, customer_ids)
+            # Prepare data for prediction
+            X = prepare_for_prediction(data, model)
 
-    # Save results to output file
-    results.to_csv(output_filepath, index=False)
-    logger.info(f'Predictions saved to {output_filepath}')
+            # Make predictions
+            yield make_predictions(X, model, customer_ids, nthread, batch_size)
 
+    # Save results to output file as CSV, Parquet or Arrow, one chunk at a time
+    n_rows = write_table_chunks(score_chunks(), output_filepath)
+    logger.info(f'{n_rows} predictions saved to {output_filepath}')
+
+@instrumented('prepare_for_prediction')
 def prepare_for_prediction(X, model):
     """
     Ensure the order of columns in the new data (X) matches the features used for training the model.
@@ -54,16 +84,59 @@ def prepare_for_prediction(X, model):
     
     return X
 
-def make_predictions(X, model, customer_ids):
+@instrumented('predict_default_proba')
+def predict_default_proba(X, model, nthread=None, batch_size=None):
+    """
+    Predict default probabilities with the booster's in-place prediction on a
+    contiguous float32 matrix, skipping the sklearn wrapper's validation and
+    DMatrix conversion. nthread sets the booster's thread count and batch_size
+    bounds the rows per prediction call.
+    """
+    booster = model.get_booster() if hasattr(model, 'get_booster') else model
+    if nthread is not None:
+        booster.set_param({'nthread': nthread})
+
+    X = np.ascontiguousarray(X, dtype=np.float32)
+    if batch_size is None or batch_size >= len(X):
+        return booster.inplace_predict(X, validate_features=False)
+
+    probabilities = np.empty(len(X), dtype=np.float32)
+    for start in range(0, len(X), batch_size):
+        batch = X[start:start + batch_size]
+        probabilities[start:start + batch_size] = booster.inplace_predict(
+            batch, validate_features=False)
+    return probabilities
+
+def predict_record(record, tables, model, cache=None):
+    """
+    Score one raw customer dict through the pandas-free path (see
+    src.features.record_features) and return (prediction, probability). With a
+    PredictionCache, a customer it holds is neither encoded nor scored.
+    """
+    probability = None if cache is None else cache.get(record)
+    if probability is None:
+        x = encode_record(record, tables)
+        probability = float(predict_default_proba(x[np.newaxis, :], model)[0])
+        if cache is not None:
+            cache.put(record, probability)
+    return int(probability > 0.5), probability
+
+@instrumented('make_predictions')
+def make_predictions(X, model, customer_ids, nthread=None, batch_size=None):
     """
-    Make predictions, and return results.
+    Make predictions, and return results with the default probability and the
+    label XGBClassifier.predict would give (probability above 0.5).
     """
-    predictions = model.predict(X)
-    results = pd.DataFrame({'customer_id': customer_ids, 'prediction_default': predictions})
+    probabilities = predict_default_proba(X, model, nthread, batch_size)
+    predictions = (probabilities > 0.5).astype(np.int64)
+    results = pd.DataFrame({'customer_id': customer_ids,
+                            'prediction_default': predictions,
+                            'probability_default': probabilities})
     return results
 
 if __name__ == '__main__':
     log_fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
     logging.basicConfig(level=logging.INFO, format=log_fmt)
 
-    main()
+    with run_report('predict_model'):
+        main()
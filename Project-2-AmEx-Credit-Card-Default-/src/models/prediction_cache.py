@@ -0,0 +1,118 @@
+# src/models/prediction_cache.py
+# -*- coding: utf-8 -*-
+import hashlib
+import json
+import math
+import numbers
+import numpy as np
+import threading
+import time
+from collections import OrderedDict
+from src.features.build_features import SCORING_COLUMNS
+
+# raw fields a prediction depends on: every scoring column but the customer_id
+CACHE_FIELDS = [col for col in SCORING_COLUMNS if col != 'customer_id']
+
+
+def _canonical(value):
+    # values encode_record treats alike hash alike: missing values and numbers
+    # however typed
+    if isinstance(value, numbers.Number):
+        value = float(value)
+        return None if math.isnan(value) else value
+    return value
+
+
+class PredictionCache:
+    """
+    Bounded in-process cache of default probabilities keyed by a customer's raw
+    record, so a hit skips both encoding and the trees. Keys are BLAKE2b
+    digests of the record's CACHE_FIELDS, canonicalised so field order, missing
+    values and int or float numbers do not matter, keyed with the bundle id: a
+    cache never answers for another model, and entries of a replaced bundle can
+    no longer be hit and age out. The least recently used entry is evicted
+    beyond max_entries, and entries expire ttl seconds after they were stored.
+    Safe to share between threads.
+
+    The cache sits in front of the record paths (predict_record and the scoring
+    service). make_predictions scores matrices that are already transformed, so
+    there is nothing left for a cache there to skip.
+    """
+
+    def __init__(self, bundle_id, max_entries=100_000, ttl=3600.0,
+                 clock=time.monotonic):
+        self.bundle_id = bundle_id
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._clock = clock
+        self._hash_key = str(bundle_id).encode()[:hashlib.blake2b.MAX_KEY_SIZE]
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._counters = {'hits': 0, 'misses': 0, 'evictions': 0,
+                          'expirations': 0}
+
+    def key(self, record):
+        values = [_canonical(record.get(field)) for field in CACHE_FIELDS]
+        payload = json.dumps(values, default=str).encode()
+        return hashlib.blake2b(payload, digest_size=16,
+                               key=self._hash_key).digest()
+
+    def get(self, record):
+        """
+        Return the cached probability of the raw customer record, or None.
+        """
+        key = self.key(record)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] <= self._clock():
+                del self._entries[key]
+                self._counters['expirations'] += 1
+                entry = None
+            if entry is None:
+                self._counters['misses'] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._counters['hits'] += 1
+            return entry[0]
+
+    def get_many(self, records):
+        """
+        Look up a list of raw customer records. Returns their probabilities
+        as a float32 array, NaN where missed, and the positions of the
+        records missed.
+        """
+        probabilities = np.full(len(records), np.nan, dtype=np.float32)
+        missed = []
+        for i, record in enumerate(records):
+            probability = self.get(record)
+            if probability is None:
+                missed.append(i)
+            else:
+                probabilities[i] = probability
+        return probabilities, missed
+
+    def put(self, record, probability):
+        key = self.key(record)
+        with self._lock:
+            self._entries[key] = (probability, self._clock() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._counters['evictions'] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """
+        Return the hit, miss, eviction and expiration counters, the number of
+        entries and the hit rate.
+        """
+        with self._lock:
+            stats = dict(self._counters, size=len(self._entries),
+                         bundle_id=self.bundle_id)
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = (round(stats['hits'] / lookups, 4) if lookups
+                             else None)
+        return stats
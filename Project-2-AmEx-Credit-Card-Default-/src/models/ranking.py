@@ -0,0 +1,77 @@
+# src/models/ranking.py
+# -*- coding: utf-8 -*-
+import numpy as np
+import pandas as pd
+
+RANK_COLUMN = 'probability_default'
+# raw columns the top customers can be ranked within
+RANK_BY = ['occupation_type']
+
+
+def _top_positions(scores, n):
+    # positions of the n highest scores in their original order; argpartition
+    # is linear where a sort is n log n. Ties at the cut go to the earliest
+    # rows, so the pick does not depend on how the rows were chunked
+    if len(scores) <= n:
+        return np.arange(len(scores))
+    cut = len(scores) - n
+    threshold = np.partition(scores, cut)[cut]
+    above = np.flatnonzero(scores > threshold)
+    tied = np.flatnonzero(scores == threshold)[:n - len(above)]
+    return np.sort(np.concatenate([above, tied]))
+
+
+def select_top(results, n, by=None):
+    """
+    Return the n rows of results with the highest probability_default, or the n
+    highest of every group of the by column (missing values forming a group of
+    their own), in their original order. results is never sorted.
+    """
+    scores = results[RANK_COLUMN].to_numpy()
+    if by is None or results.empty:
+        positions = _top_positions(scores, n)
+    else:
+        groups = results.groupby(by, sort=False, dropna=False,
+                                 observed=True).indices
+        tops = [rows[_top_positions(scores[rows], n)]
+                for rows in groups.values()]
+        positions = np.sort(np.concatenate(tops))
+    return results.iloc[positions].reset_index(drop=True)
+
+
+def merge_top(a, b, n, by=None):
+    """
+    Combine the select_top of two sets of rows, a's coming first in the input,
+    into the select_top of their union. Neither holds more than n rows per
+    group, so the merge never grows with the number of rows scored.
+    """
+    return select_top(pd.concat([a, b], ignore_index=True), n, by)
+
+
+def reduce_top(chunks, n, by=None):
+    """
+    Merge the select_top of each chunk of results, in chunk order, into the
+    select_top of them all. Returns None for no chunks.
+    """
+    top = None
+    for chunk in chunks:
+        top = chunk if top is None else merge_top(top, chunk, n, by)
+    return top
+
+
+def rank_top(top, by=None):
+    """
+    Sort the selected rows by descending probability_default, by group first
+    when by is given, and number them from 1 (within each group) in a leading
+    'risk_rank' column. Tied rows keep their input order.
+    """
+    top = top.sort_values(RANK_COLUMN, ascending=False, kind='stable')
+    if by is None:
+        rank = np.arange(1, len(top) + 1)
+    else:
+        top = top.sort_values(by, kind='stable', na_position='last')
+        rank = top.groupby(by, sort=False, dropna=False,
+                           observed=True).cumcount().to_numpy() + 1
+    top = top.reset_index(drop=True)
+    top.insert(0, 'risk_rank', rank)
+    return top
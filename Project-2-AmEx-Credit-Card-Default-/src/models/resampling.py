@@ -0,0 +1,93 @@
+# src/models/resampling.py
+# -*- coding: utf-8 -*-
+import click
+import numpy as np
+import pandas as pd
+from sklearn.base import BaseEstimator
+from src.instrumentation import instrumented
+
+# smote: exact SMOTE over all training rows, as in the preprocessing notebook;
+# chunked_smote: SMOTE within random blocks of rows, so neighbour searches and
+# their working memory stay bounded (out of core, synthetic rows go to disk);
+# weight: no synthetic rows, the positive class is weighted by scale_pos_weight
+RESAMPLING = ['smote', 'chunked_smote', 'weight', 'none']
+
+
+def _smote(k_neighbors, random_state):
+    try:
+        from imblearn.over_sampling import SMOTE
+    except ImportError:
+        raise click.UsageError('SMOTE needs imbalanced-learn; install it or '
+                               'use --resampling weight')
+    return SMOTE(k_neighbors=k_neighbors, random_state=random_state)
+
+
+class ChunkedSMOTE(BaseEstimator):
+    """
+    SMOTE applied independently to random blocks of about chunksize rows. Each
+    block's minority rows only get neighbours from the same block, which keeps
+    the neighbour search linear in the number of blocks instead of growing with
+    the whole minority class. Blocks with too few minority rows to interpolate
+    are passed through. Usable wherever an imbalanced-learn sampler is, e.g. as
+    a Pipeline step.
+    """
+
+    def __init__(self, chunksize=100_000, k_neighbors=5, random_state=None):
+        self.chunksize = chunksize
+        self.k_neighbors = k_neighbors
+        self.random_state = random_state
+
+    def fit_resample(self, X, y):
+        rng = np.random.default_rng(self.random_state)
+        y = np.asarray(y)
+        n_blocks = max(1, -(-len(y) // self.chunksize))
+        X_parts, y_parts = [], []
+        for block in np.array_split(rng.permutation(len(y)), n_blocks):
+            X_block = (X.iloc[block] if isinstance(X, pd.DataFrame)
+                       else X[block])
+            y_block = y[block]
+            counts = np.bincount(y_block.astype(np.int64), minlength=2)
+            if counts.min() > self.k_neighbors:
+                smote = _smote(self.k_neighbors, int(rng.integers(2 ** 31)))
+                X_block, y_block = smote.fit_resample(X_block, y_block)
+            X_parts.append(X_block)
+            y_parts.append(y_block)
+
+        if isinstance(X, pd.DataFrame):
+            X_out = pd.concat(X_parts, ignore_index=True)
+            return X_out, np.concatenate(y_parts)
+        return np.concatenate(X_parts), np.concatenate(y_parts)
+
+
+def make_sampler(method, seed, chunksize=100_000):
+    """
+    Return the sampler for method (see RESAMPLING), or None when no rows are
+    synthesised.
+    """
+    if method == 'smote':
+        return _smote(5, seed)
+    if method == 'chunked_smote':
+        return ChunkedSMOTE(chunksize=chunksize, random_state=seed)
+    return None
+
+
+def balance_weight(*labels):
+    """
+    Return the scale_pos_weight that balances the classes of the given label
+    arrays, e.g. one per chunk: the number of negatives per positive.
+    """
+    positives = sum(int(np.count_nonzero(y)) for y in labels)
+    rows = sum(len(y) for y in labels)
+    return (rows - positives) / max(positives, 1)
+
+
+@instrumented('resample')
+def resample(X, y, sampler):
+    """
+    Rebalance the classes of the training rows X, y with sampler
+    from make_sampler.
+    """
+    if sampler is None:
+        return X, y
+    X, y = sampler.fit_resample(X, y)
+    return X.astype(np.float32), y
@@ -0,0 +1,352 @@
+# src/models/serve.py
+# -*- coding: utf-8 -*-
+import asyncio
+import click
+import joblib
+import json
+import logging
+import numpy as np
+from functools import partial
+from src.features.build_features import FEATURE_COLUMNS
+from src.features.record_features import build_record_tables, encode_record
+from src.instrumentation import instrumented, run_report
+from src.models.bundle import load_bundle
+from src.models.predict_model import predict_default_proba
+from src.models.prediction_cache import PredictionCache
+
+MAX_BODY_BYTES = 1 << 20
+REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found',
+           413: 'Payload Too Large', 500: 'Internal Server Error'}
+
+
+@click.command()
+@click.option('--bundle-path', required=True, type=click.Path(exists=True),
+              help='Model bundle to serve (see src/models/bundle.py).')
+@click.option('--cleaner-path', default=None, type=click.Path(exists=True),
+              help='Fitted cleaner, if the bundle was built without one.')
+@click.option('--host', default='127.0.0.1')
+@click.option('--port', default=8000, type=int)
+@click.option('--max-batch-size', default=256, type=click.IntRange(min=1),
+              help='Most customers scored in one booster call.')
+@click.option('--max-wait-ms', default=2.0, type=click.FloatRange(min=0),
+              help='Longest a request waits for others to join its batch.')
+@click.option('--nthread', default=None, type=click.IntRange(min=1),
+              help='Threads used by the booster; all cores by default.')
+@click.option('--cache-size', default=100_000, type=click.IntRange(min=0),
+              help='Most customers whose predictions are cached (0 turns '
+                   'caching off).')
+@click.option('--cache-ttl', default=3600.0, type=click.FloatRange(min=0),
+              help='Seconds a cached prediction is reused for.')
+def main(bundle_path, cleaner_path, host, port, max_batch_size, max_wait_ms,
+         nthread, cache_size, cache_ttl):
+    """ Serves the model bundle over HTTP: POST a customer, or a list of
+        customers, as JSON to /predict; GET /health reports the loaded bundle
+        and the prediction cache counters.
+    """
+    logger = logging.getLogger(__name__)
+    logger.info(f'Loading model bundle from {bundle_path}')
+
+    bundle = load_bundle(bundle_path)
+    if cleaner_path:
+        bundle['cleaner'] = joblib.load(cleaner_path)
+    if bundle['cleaner'] is None:
+        raise click.UsageError('Online scoring needs a fitted cleaner: '
+                               'rebuild the bundle with one or pass '
+                               '--cleaner-path')
+
+    tables = build_record_tables(bundle['params'], bundle['cleaner'])
+    cache = (PredictionCache(bundle['bundle_id'], cache_size, cache_ttl)
+             if cache_size else None)
+    encode = partial(encode_records, tables=tables)
+    score = partial(score_batch, model=bundle['model'], nthread=nthread)
+    asyncio.run(serve(encode, score, bundle['bundle_id'], host, port,
+                      max_batch_size, max_wait_ms / 1000, cache))
+
+
+def encode_records(records, tables, rows=None):
+    """
+    Encode the raw customer dicts of records at positions rows (all of them by
+    default) into a float32 matrix, one row per customer, with the pandas-free
+    encode_record, which agrees exactly with the batch pipeline; fields missing
+    from a record are treated as missing values. Raises ValueError naming the
+    customer's position in records and the field that cannot be encoded.
+    """
+    rows = range(len(records)) if rows is None else rows
+    X = np.empty((len(rows), len(FEATURE_COLUMNS)), dtype=np.float32)
+    for x, i in zip(X, rows):
+        try:
+            encode_record(records[i], tables, out=x)
+        except ValueError as e:
+            raise ValueError(f'Customer {i}: {e}') from None
+    return X
+
+
+@instrumented('score_batch')
+def score_batch(X, model, nthread=None):
+    """
+    Return the default probabilities of the encoded customers X.
+    """
+    return predict_default_proba(X, model, nthread)
+
+
+def lookup_records(records, cache=None):
+    """
+    Return the cached probabilities of records, NaN where missed, and the
+    positions of the records left to encode and score (see PredictionCache).
+    """
+    if cache is None:
+        probabilities = np.full(len(records), np.nan, dtype=np.float32)
+        return probabilities, list(range(len(records)))
+    return cache.get_many(records)
+
+
+def store_records(records, missed, probabilities, cache=None):
+    # cache the probabilities just scored for the missed records
+    if cache is not None:
+        for i in missed:
+            cache.put(records[i], probabilities[i])
+
+
+def format_results(records, probabilities):
+    """
+    Return one result dict per customer of records, in order.
+    """
+    return [{'customer_id': record.get('customer_id'),
+             'prediction_default': int(probability > 0.5),
+             'probability_default': float(probability)}
+            for record, probability in zip(records, probabilities)]
+
+
+def score_records(records, tables, model, nthread=None, cache=None):
+    """
+    Score a list of raw customer dicts and return one result dict per customer,
+    in order (see encode_records and score_batch). With a PredictionCache, only
+    the customers it does not hold are encoded and scored.
+    """
+    probabilities, missed = lookup_records(records, cache)
+    if missed:
+        X = encode_records(records, tables, missed)
+        probabilities[missed] = score_batch(X, model, nthread)
+        store_records(records, missed, probabilities, cache)
+    return format_results(records, probabilities)
+
+
+async def batch_scorer(queue, score, max_batch_size, max_wait):
+    """
+    Coalesce queued requests into micro-batches and score each batch in
+    one call.
+
+    Requests are queued already encoded, as (X, future), so a batch only
+    holds valid customers. A batch closes when it holds max_batch_size
+    customers or max_wait seconds after its first request arrived. Scoring
+    runs in a worker thread, so requests keep queueing, and form the next
+    batch, while the booster is busy. Each future receives the probabilities
+    of its own rows of X.
+    """
+    loop = asyncio.get_running_loop()
+    while True:
+        batch = await _collect_batch(queue, max_batch_size, max_wait)
+        X = (batch[0][0] if len(batch) == 1
+             else np.concatenate([X for X, _ in batch]))
+        try:
+            probabilities = await loop.run_in_executor(None, score, X)
+        except Exception as e:
+            # only a failure of the model itself gets here, and it fails the
+            # whole batch
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            continue
+        _resolve(batch, probabilities)
+
+
+async def _collect_batch(queue, max_batch_size, max_wait):
+    # wait for a request, then for others until the batch is full or max_wait
+    # seconds have passed since the first one arrived
+    loop = asyncio.get_running_loop()
+    batch = [await queue.get()]
+    n_records = len(batch[0][0])
+    deadline = loop.time() + max_wait
+    while n_records < max_batch_size:
+        timeout = deadline - loop.time()
+        if timeout <= 0:
+            break
+        try:
+            batch.append(await asyncio.wait_for(queue.get(), timeout))
+        except asyncio.TimeoutError:
+            break
+        n_records += len(batch[-1][0])
+    return batch
+
+
+def _resolve(batch, probabilities):
+    # hand each request the probabilities of its own rows of the batch
+    start = 0
+    for request_X, future in batch:
+        if not future.done():
+            future.set_result(probabilities[start:start + len(request_X)])
+        start += len(request_X)
+
+
+def _http_response(status, body, keep_alive=True):
+    payload = json.dumps(body).encode()
+    head = (f'HTTP/1.1 {status} {REASONS[status]}\r\n'
+            'Content-Type: application/json\r\n'
+            f'Content-Length: {len(payload)}\r\n'
+            f'Connection: {"keep-alive" if keep_alive else "close"}\r\n\r\n')
+    return head.encode() + payload
+
+
+async def _read_request(reader):
+    """
+    Read one HTTP/1.1 request and return (method, path, headers, body),
+    or None when the client has closed the connection.
+    """
+    request_line = await reader.readline()
+    if not request_line:
+        return None
+    method, path, _ = request_line.decode('latin-1').split(' ', 2)
+
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+
+    length = int(headers.get('content-length', 0))
+    if length > MAX_BODY_BYTES:
+        return method, path, headers, None
+    body = await reader.readexactly(length) if length else b''
+    return method, path, headers, body
+
+
+async def handle_connection(reader, writer, queue, encode, bundle_id,
+                            cache=None):
+    """
+    Answer requests on one keep-alive connection, looking /predict customers up
+    in cache, encoding the rest with encode, queueing them for the batch scorer
+    and waiting for their share of the batch results.
+    """
+    logger = logging.getLogger(__name__)
+    try:
+        while True:
+            try:
+                request = await _read_request(reader)
+            except (ValueError, asyncio.IncompleteReadError):
+                writer.write(_http_response(400,
+                                            {'error': 'Malformed request'},
+                                            keep_alive=False))
+                break
+            if request is None:
+                break
+            response, keep_alive = await _respond(request, queue, encode,
+                                                  bundle_id, cache)
+            writer.write(response)
+            await writer.drain()
+            if not keep_alive:
+                break
+    except ConnectionError:
+        pass
+    except Exception:
+        logger.exception('Failed to handle request')
+    finally:
+        writer.close()
+
+
+async def _respond(request, queue, encode, bundle_id, cache=None):
+    """
+    Route one request read by _read_request and return (response, keep_alive):
+    whether the connection stays open for another request.
+    """
+    method, path, headers, body = request
+    keep_alive = (headers.get('connection', '').lower() != 'close'
+                  and body is not None)
+
+    if method == 'GET' and path == '/health':
+        health = {'status': 'ok', 'bundle_id': bundle_id,
+                  'cache': None if cache is None else cache.stats()}
+        response = _http_response(200, health, keep_alive)
+    elif method == 'POST' and path == '/predict':
+        response = await _predict(body, queue, encode, keep_alive, cache)
+    else:
+        response = _http_response(
+            404, {'error': f'No route for {method} {path}'}, keep_alive)
+    return response, keep_alive
+
+
+async def _predict(body, queue, encode, keep_alive, cache=None):
+    if body is None:
+        return _http_response(413,
+                              {'error': f'Body larger than {MAX_BODY_BYTES} '
+                                        'bytes'}, False)
+    try:
+        payload = json.loads(body)
+    except ValueError:
+        return _http_response(400, {'error': 'Body is not valid JSON'},
+                              keep_alive)
+    records = payload if isinstance(payload, list) else [payload]
+    if not records or not all(isinstance(record, dict) for record in records):
+        return _http_response(400,
+                              {'error': 'Expected a customer object or a '
+                                        'list of them'}, keep_alive)
+
+    # cache hits skip encoding and the booster; only the misses join a batch
+    probabilities, missed = lookup_records(records, cache)
+    if missed:
+        # encoding is cheap next to a booster call; doing it before the request
+        # joins a batch means a bad customer fails its own request alone, with
+        # a 400
+        try:
+            X = encode(records, rows=missed)
+        except ValueError as e:
+            return _http_response(400, {'error': str(e)}, keep_alive)
+
+        future = asyncio.get_running_loop().create_future()
+        await queue.put((X, future))
+        try:
+            probabilities[missed] = await future
+        except Exception as e:
+            return _http_response(500, {'error': str(e)}, keep_alive)
+        store_records(records, missed, probabilities, cache)
+    results = format_results(records, probabilities)
+    return _http_response(200,
+                          results if isinstance(payload, list) else results[0],
+                          keep_alive)
+
+
+async def serve(encode, score, bundle_id, host, port, max_batch_size, max_wait,
+                cache=None):
+    """
+    Run the scoring service until cancelled. encode turns a request's customers
+    into a feature matrix (see encode_records) and score turns a batch's matrix
+    into probabilities (see score_batch). cache is the PredictionCache requests
+    are looked up in before they are encoded, whose counters /health reports.
+    """
+    logger = logging.getLogger(__name__)
+    queue = asyncio.Queue()
+    scorer = asyncio.create_task(batch_scorer(queue, score, max_batch_size,
+                                              max_wait))
+    server = await asyncio.start_server(partial(handle_connection, queue=queue,
+                                                encode=encode,
+                                                bundle_id=bundle_id,
+                                                cache=cache), host, port)
+    logger.info(f'Serving bundle {bundle_id} on http://{host}:{port} '
+                f'(batches of up to {max_batch_size}, {max_wait * 1000:g} ms '
+                'wait)')
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        scorer.cancel()
+        if cache is not None:
+            logger.info(f'Prediction cache: {cache.stats()}')
+
+
+if __name__ == '__main__':
+    log_fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    logging.basicConfig(level=logging.INFO, format=log_fmt)
+
+    with run_report('serve'):
+        main()
@@ -4,35 +4,66 @@ import click
 import logging
 import pandas as pd
 import joblib
-from sklearn.impute import SimpleImputer
-from sklearn.preprocessing import MinMaxScaler
+import numpy as np
+from src.cache import file_digest, fingerprint, params_digest, run_cached
+from src.data import tables
+from src.data.tables import read_table, write_table
+from src.features import build_features
+from src.features.build_features import FEATURE_COLUMNS, encode_features
+from src.instrumentation import instrumented, run_report
 
 @click.command()
 @click.argument('input_filepath', type=click.Path(exists=True))
 @click.argument('output_filepath', type=click.Path())
-def main(input_filepath, output_filepath):
+@click.option('--cache-dir', default=None, type=click.Path(file_okay=False),
+              help='Reuse the output of an earlier run on the same input, '
+                   'imputer, scaler and code from this cache.')
+@click.option('--force', is_flag=True,
+              help='With --cache-dir, recompute the cached output.')
+@click.option('--max-cache-mb', default=2048, type=click.IntRange(min=0),
+              help='With --cache-dir, least recently used entries are '
+                   'evicted beyond this size.')
+def main(input_filepath, output_filepath, cache_dir, force, max_cache_mb):
     """Runs data transformation scripts to turn raw data from (input_filepath) into
     transformed data ready to be modeled (saved in output_filepath).
     """
     logger = logging.getLogger(__name__)
     logger.info('Transforming data')
 
-    # Load data
-    data = pd.read_csv(input_filepath)
-
     # Load imputer and scaler from pkl files
     imputer = joblib.load('../models/simple_imputer.pkl')
     scaler = joblib.load('../models/min-max-scaler.pkl')
 
-    # Transform data
-    transformed_data = transform_data(data, imputer, scaler)
+    if cache_dir is None:
+        transform_file(input_filepath, output_filepath, imputer, scaler)
+    else:
+        params = transform_params(imputer, scaler)
+        key = fingerprint('train_model',
+                          [tables.__file__, build_features.__file__, __file__],
+                          data=file_digest(input_filepath, cache_dir),
+                          params=params_digest(params))
+        run_cached(cache_dir, 'train_model', key, {'data': output_filepath},
+                   lambda paths: transform_file(input_filepath, paths['data'],
+                                                imputer, scaler),
+                   force, max_cache_mb << 20)
+    logger.info(f'Data saved to {output_filepath}')
+
+def transform_file(input_filepath, output_filepath, imputer, scaler):
+    """
+    Transform the processed data at input_filepath with the fitted imputer and
+    scaler into output_filepath.
+    """
+    # Load data
+    data = read_table(input_filepath)
 
     # Formatting data
-    X, customer_ids = formatting(transformed_data)
+    X, customer_ids = formatting(data)
+
+    # Transform data
+    X = transform_data(X, imputer, scaler)
 
     # Save the processed data
-    X.to_csv(output_filepath, index=False)
-    logger.info(f'Data saved to {output_filepath}')
+    write_table(X, output_filepath)
 
 def transform_data(df, imputer, scaler):
     logger = logging.getLogger(__name__)
@@ -40,19 +71,38 @@ def transform_data(df, imputer, scaler):
     """
     Function to perform necessary data transformations like encoding and scaling.
     """
-    # Encoding categorical variables and scaling
-    df['gender'] = df['gender'].map({'F': 0, 'M': 1})
-    df['owns_car'] = df['owns_car'].map({'N': 0, 'Y': 1})
-    df['owns_house'] = df['owns_house'].map({'N': 0, 'Y': 1})
+    return transform_features(df, transform_params(imputer, scaler))
+
+@instrumented('transform_features')
+def transform_features(df, params):
+    """
+    Encode, impute and scale df in one pass into a float32 matrix, given the
+    fitted parameters from transform_params or a model bundle.
+    """
+    X = encode_features(df, params=params)
+    return pd.DataFrame(X, columns=FEATURE_COLUMNS, copy=False)
 
-    # One-hot encoding for 'occupation_type'
-    df = pd.get_dummies(df, columns=['occupation_type'], prefix=['ot'])
-    # imputting missing values
-    df = pd.DataFrame(imputer.transform(df), columns=df.columns)
-    # Scaling the dataset
-    df = pd.DataFrame(scaler.transform(df), columns=df.columns)
+def transform_params(imputer, scaler):
+    """
+    Extract the fitted SimpleImputer and MinMaxScaler parameters used by
+    encode_features, as float64 arrays in FEATURE_COLUMNS order.
+    """
+    for fitted in (imputer, scaler):
+        fitted_columns = getattr(fitted, 'feature_names_in_', None)
+        if (fitted_columns is not None
+                and list(fitted_columns) != FEATURE_COLUMNS):
+            raise ValueError(f"{type(fitted).__name__} was fitted on columns "
+                             f"{list(fitted_columns)}")
+    if not np.isnan(imputer.missing_values) or imputer.add_indicator:
+        raise ValueError("Only a SimpleImputer filling NaNs without "
+                         "indicators is supported")
 
-    return df
+    return {
+        'fill_values': np.asarray(imputer.statistics_, dtype=np.float64),
+        'scale': np.asarray(scaler.scale_, dtype=np.float64),
+        'offset': np.asarray(scaler.min_, dtype=np.float64),
+        'clip': scaler.feature_range if scaler.clip else None,
+    }
 
 def formatting(df):
     logger = logging.getLogger(__name__)
@@ -72,4 +122,5 @@ if __name__ == '__main__':
     log_fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
     logging.basicConfig(level=logging.INFO, format=log_fmt)
 
-    main()
+    with run_report('train_model'):
+        main()
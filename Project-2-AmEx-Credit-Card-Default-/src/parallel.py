@@ -0,0 +1,48 @@
+# src/parallel.py
+# -*- coding: utf-8 -*-
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from src.instrumentation import (drain_stages, merge_stages, metrics_enabled,
+                                 start_run)
+
+
+def _init_worker(command, metrics, initializer, initargs):
+    if metrics:
+        start_run(command)
+    if initializer is not None:
+        initializer(*initargs)
+
+
+def _run_chunk(fn, chunk):
+    # the chunk's stage metrics travel back with its result
+    return fn(chunk), drain_stages()
+
+
+def map_chunks(fn, chunks, workers, initializer=None, initargs=(),
+               command='worker'):
+    """
+    Yield fn(chunk) for every chunk of the iterable chunks, in input order,
+    computed on a pool of workers processes. At most two chunks per worker are
+    in flight, so memory stays bounded however many chunks there are.
+
+    initializer(*initargs) runs once in each worker, e.g. to load the assets
+    fn uses. When the run is instrumented, workers collect their stage metrics
+    as command and every chunk's metrics are merged into this process's run.
+    fn and initializer must be picklable: module-level functions or partials
+    of them.
+    """
+    initargs = (command, metrics_enabled(), initializer, initargs)
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=initargs) as executor:
+        pending = deque()
+        chunks = iter(chunks)
+        while True:
+            for chunk in chunks:
+                pending.append(executor.submit(_run_chunk, fn, chunk))
+                if len(pending) >= 2 * workers:
+                    break
+            if not pending:
+                return
+            result, stages = pending.popleft().result()
+            merge_stages(stages)
+            yield result
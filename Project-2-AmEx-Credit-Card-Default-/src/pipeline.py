@@ -0,0 +1,230 @@
+# src/pipeline.py
+# -*- coding: utf-8 -*-
+import click
+import joblib
+import logging
+import numpy as np
+import os
+from functools import partial
+from src.cache import (evict, file_digest, fingerprint, json_digest,
+                       model_digest, params_digest, run_stage)
+from src.data import tables
+from src.data.tables import read_table, write_table, write_table_chunks
+from src.features import build_features
+from src.features.build_features import (PROCESSING_COLUMNS, RAW_DTYPES,
+                                         clean_data, feature_engineering,
+                                         fit_cleaner)
+from src.instrumentation import run_report
+from src.models import explain, predict_model, train_model
+from src.models.bundle import load_bundle
+from src.models.explain import explain_chunks
+from src.models.predict_model import make_predictions
+from src.models.train_model import (formatting, transform_features,
+                                    transform_params)
+
+# cached stages, each entry living in <cache dir>/<stage>/<fingerprint>/, and
+# the modules whose source is part of each stage's fingerprint
+STAGE_MODULES = {'features': [tables, build_features],
+                 'transform': [build_features, train_model],
+                 'score': [predict_model],
+                 'explain': [explain]}
+# customers per booster call of the explain stage
+EXPLAIN_CHUNKSIZE = 10_000
+
+
+@click.command()
+@click.argument('input_filepath', type=click.Path(exists=True))
+@click.argument('output_filepath', type=click.Path())
+@click.option('--bundle-path', default=None, type=click.Path(exists=True),
+              help='Model bundle to load instead of the model, imputer and '
+                   'scaler files.')
+@click.option('--model-path', default='models/best_xgb_model.pkl',
+              type=click.Path())
+@click.option('--imputer-path', default='models/simple_imputer.pkl',
+              type=click.Path())
+@click.option('--scaler-path', default='models/min-max-scaler.pkl',
+              type=click.Path())
+@click.option('--cleaner-path', default=None, type=click.Path(exists=True),
+              help='Fitted cleaner; by default the bundle\'s, or fitted on '
+                   'the input.')
+@click.option('--cache-dir', default='data/interim/cache',
+              type=click.Path(file_okay=False),
+              help='Where stage outputs are cached.')
+@click.option('--max-cache-mb', default=2048, type=click.IntRange(min=0),
+              help='Least recently used entries are evicted beyond this size.')
+@click.option('--force', is_flag=True,
+              help='Recompute every stage, replacing its cache entry.')
+@click.option('--explain-path', default=None, type=click.Path(),
+              help='Also explain the predictions, saving each customer\'s '
+                   'top reasons here.')
+@click.option('--top-k', default=3, type=click.IntRange(min=1),
+              help='Reasons given per explained customer.')
+@click.option('--explain-sample', default=1.0,
+              type=click.FloatRange(min=0, max=1, min_open=True),
+              help='Share of customers to explain, picked by a hash of their '
+                   'customer_id.')
+@click.option('--approximate', is_flag=True,
+              help='Explain with the path-based (Saabas) attribution instead '
+                   'of TreeSHAP.')
+@click.option('--workers', default=None, type=click.IntRange(min=0),
+              help='Explain chunks on this many processes (0 for one per '
+                   'core).')
+def main(input_filepath, output_filepath, bundle_path, model_path,
+         imputer_path, scaler_path, cleaner_path, cache_dir, max_cache_mb,
+         force, explain_path, top_k, explain_sample, approximate, workers):
+    """ Cleans, engineers, transforms and scores raw data from
+        (input_filepath), reusing every stage whose inputs, code and artifacts
+        are unchanged since a previous run, and saves the predictions in
+        output_filepath. With --explain-path, the predictions' top reasons are
+        saved there too.
+    """
+    logger = logging.getLogger(__name__)
+    logger.info('Running the scoring pipeline')
+
+    if bundle_path:
+        bundle = load_bundle(bundle_path)
+        model, params = bundle['model'], bundle['params']
+        cleaner = bundle['cleaner']
+    else:
+        model = joblib.load(model_path)
+        params = transform_params(joblib.load(imputer_path),
+                                  joblib.load(scaler_path))
+        cleaner = None
+    if cleaner_path:
+        cleaner = joblib.load(cleaner_path)
+
+    results = run_pipeline(input_filepath, model, params, cleaner, cache_dir,
+                           force)
+    write_table(results, output_filepath)
+    logger.info(f'{len(results)} predictions saved to {output_filepath}')
+
+    if explain_path:
+        workers = workers if workers != 0 else os.cpu_count()
+        explanations = run_explanations(input_filepath, model, params, cleaner,
+                                        cache_dir, top_k, explain_sample,
+                                        approximate, workers, force)
+        write_table(explanations, explain_path)
+        logger.info(f'{len(explanations)} explanations saved to '
+                    f'{explain_path}')
+
+    size = evict(cache_dir, max_cache_mb << 20)
+    logger.info(f'Cache at {cache_dir} holds {size / (1 << 20):.1f} MB')
+
+
+def run_pipeline(data_path, model, params, cleaner, cache_dir, force=False):
+    """
+    Score the raw data at data_path through the cached 'features' (clean_data
+    and feature_engineering), 'transform' (transform_features) and 'score'
+    stages and return the predictions.
+
+    Each stage's fingerprint covers its upstream fingerprint, the source of the
+    modules it runs and its own artifacts (cleaner, transform parameters,
+    booster), so swapping the model only re-runs 'score'. cleaner may be None
+    to fit one on the input, as make_dataset does.
+    """
+    transform_key, transform = _run_transform(data_path, params, cleaner,
+                                              cache_dir, force)
+    score_key = stage_fingerprint('score', transform=transform_key,
+                                  model=model_digest(model))
+    score = run_stage(cache_dir, 'score', score_key,
+                      partial(_score_stage, transform=transform, model=model),
+                      force)
+
+    return read_table(score / 'predictions.parquet')
+
+
+def run_explanations(data_path, model, params, cleaner, cache_dir, top_k=3,
+                     sample=1.0, approximate=False, workers=None, force=False):
+    """
+    Explain the predictions for the raw data at data_path through the cached
+    'features' and 'transform' stages (see run_pipeline) and an 'explain'
+    stage, and return every sampled customer's top_k reasons (see
+    src.models.explain). The 'explain' fingerprint covers the model and the
+    explanation options, but not workers, which only change how fast the same
+    explanations come.
+    """
+    transform_key, transform = _run_transform(data_path, params, cleaner,
+                                              cache_dir, force)
+    explain_key = stage_fingerprint('explain', transform=transform_key,
+                                    model=model_digest(model), top_k=top_k,
+                                    sample=sample, approximate=approximate)
+    entry = run_stage(cache_dir, 'explain', explain_key,
+                      partial(_explain_stage, transform=transform, model=model,
+                              top_k=top_k, sample=sample,
+                              approximate=approximate, workers=workers), force)
+    return read_table(entry / 'explanations.parquet')
+
+
+def _run_transform(data_path, params, cleaner, cache_dir, force=False):
+    # the 'features' and 'transform' stages shared by scoring and explaining
+    os.makedirs(cache_dir, exist_ok=True)
+
+    features_key = stage_fingerprint('features',
+                                     data=file_digest(data_path, cache_dir),
+                                     cleaner=json_digest(cleaner))
+    features = run_stage(cache_dir, 'features', features_key,
+                         partial(_features_stage, data_path=data_path,
+                                 cleaner=cleaner), force)
+
+    transform_key = stage_fingerprint('transform', features=features_key,
+                                      params=params_digest(params))
+    transform = run_stage(cache_dir, 'transform', transform_key,
+                          partial(_transform_stage, features=features,
+                                  params=params), force)
+    return transform_key, transform
+
+
+def _features_stage(entry, data_path, cleaner):
+    data = read_table(data_path, columns=PROCESSING_COLUMNS, dtype=RAW_DTYPES)
+    cleaned_data = clean_data(data,
+                              cleaner if cleaner is not None
+                              else fit_cleaner(data))
+    write_table(feature_engineering(cleaned_data), entry / 'features.parquet')
+
+
+def _transform_stage(entry, features, params):
+    X, customer_ids = formatting(read_table(features / 'features.parquet'))
+    np.save(entry / 'X.npy', transform_features(X, params).to_numpy())
+    write_table(customer_ids.to_frame(), entry / 'customer_ids.parquet')
+
+
+def _read_customer_ids(transform):
+    ids = read_table(transform / 'customer_ids.parquet')
+    return ids['customer_id'].to_numpy()
+
+
+def _score_stage(entry, transform, model):
+    X = np.load(transform / 'X.npy', mmap_mode='r')
+    customer_ids = _read_customer_ids(transform)
+    write_table(make_predictions(X, model, customer_ids),
+                entry / 'predictions.parquet')
+
+
+def _explain_stage(entry, transform, model, top_k, sample, approximate,
+                   workers):
+    X = np.load(transform / 'X.npy', mmap_mode='r')
+    customer_ids = _read_customer_ids(transform)
+    chunks = ((X[start:start + EXPLAIN_CHUNKSIZE],
+               customer_ids[start:start + EXPLAIN_CHUNKSIZE])
+              for start in range(0, len(X), EXPLAIN_CHUNKSIZE))
+    explanations = explain_chunks(chunks, model.get_booster(), top_k, sample,
+                                  approximate, workers)
+    write_table_chunks(explanations, entry / 'explanations.parquet')
+
+
+def stage_fingerprint(stage, **parts):
+    """
+    Hash a stage's inputs, given as digests, together with the source of the
+    modules it runs (see src.cache.fingerprint).
+    """
+    return fingerprint(stage,
+                       [module.__file__ for module in STAGE_MODULES[stage]],
+                       **parts)
+
+
+if __name__ == '__main__':
+    log_fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    logging.basicConfig(level=logging.INFO, format=log_fmt)
+
+    with run_report('pipeline'):
+        main()
@@ -0,0 +1,182 @@
+# src/visualization/streaming_stats.py
+# -*- coding: utf-8 -*-
+import numpy as np
+import pandas as pd
+from src.data.tables import iter_table, table_format
+from src.parallel import map_chunks
+
+CHUNKSIZE = 1_000_000
+
+
+def column_ranges(path, columns, chunksize=CHUNKSIZE):
+    """
+    Return the (min, max) of each of columns in the table at path, ignoring
+    NaNs, or (nan, nan) for a column without values. Parquet files answer from
+    their row group statistics without reading any rows; other files, and
+    Parquet files written without statistics, are scanned in chunks of
+    chunksize rows.
+    """
+    if table_format(path) == 'parquet':
+        ranges = _parquet_ranges(path, columns)
+        if ranges is not None:
+            return ranges
+
+    ranges = {col: (np.nan, np.nan) for col in columns}
+    for chunk in iter_table(path, chunksize, columns=columns):
+        for col in columns:
+            values = chunk[col].to_numpy(dtype=np.float64, na_value=np.nan)
+            ranges[col] = (np.fmin(ranges[col][0],
+                                   np.nanmin(values, initial=np.inf)),
+                           np.fmax(ranges[col][1],
+                                   np.nanmax(values, initial=-np.inf)))
+    # columns without values keep nan; inf only comes from the initial values
+    return {col: (low, high) if np.isfinite(low) else (np.nan, np.nan)
+            for col, (low, high) in ranges.items()}
+
+
+def _parquet_ranges(path, columns):
+    import pyarrow.parquet as pq
+    metadata = pq.ParquetFile(path).metadata
+    positions = {metadata.schema.column(i).name: i
+                 for i in range(metadata.num_columns)}
+    ranges = {col: (np.nan, np.nan) for col in columns}
+    for r in range(metadata.num_row_groups):
+        row_group = metadata.row_group(r)
+        for col in columns:
+            statistics = row_group.column(positions[col]).statistics
+            if statistics is None or not statistics.has_min_max:
+                if (statistics is not None
+                        and statistics.null_count == row_group.num_rows):
+                    continue
+                return None
+            low, high = ranges[col]
+            ranges[col] = (np.fmin(low, float(statistics.min)),
+                           np.fmax(high, float(statistics.max)))
+    return ranges
+
+
+def histogram_edges(low, high, bins):
+    """
+    Return the edges of bins equal bins over [low, high], as np.histogram (and
+    so DataFrame.hist) lays them out for data with that range.
+    """
+    if np.isnan(low):
+        low, high = 0.0, 1.0
+    elif low == high:
+        low, high = low - 0.5, high + 0.5
+    return np.linspace(low, high, bins + 1)
+
+
+def _bin_counts(X, edges):
+    # np.histogram's arithmetic for equal-width bins, column by column, so the
+    # counts are exactly np.histogram's; NaNs and values outside the edges are
+    # dropped by the range comparison
+    n_bins = edges.shape[1] - 1
+    counts = np.zeros((len(edges), n_bins), dtype=np.int64)
+    for j, column_edges in enumerate(edges):
+        first, last = column_edges[0], column_edges[-1]
+        values = X[:, j]
+        values = values[(values >= first) & (values <= last)]
+        scaled = (values - first) * (n_bins / (last - first))
+        indices = scaled.astype(np.intp)
+        indices[indices == n_bins] -= 1
+        indices[values < column_edges.take(indices)] -= 1
+        above = values >= column_edges.take(indices + 1)
+        indices[above & (indices != n_bins - 1)] += 1
+        counts[j] = np.bincount(indices, minlength=n_bins)
+    return counts
+
+
+def chunk_stats(X, edges):
+    """
+    Summarise a float64 matrix X (rows by columns, NaN where missing) into
+    pairwise-complete moments and fixed-bin histograms, as a dict that
+    merge_stats combines with other chunks' summaries:
+
+    n[i, j]          rows where columns i and j both have values
+    mean[i, j]       mean of column i over those rows
+    m2[i, j]         sum of squared deviations of column i over those rows
+    comoment[i, j]   sum of products of deviations of columns i and j
+    counts[j]        histogram of column j over the equal-width bin edges[j],
+                     edges being a (columns, bins + 1) array of histogram_edges
+
+    Pairwise-complete moments give the same correlations as DataFrame.corr,
+    which skips missing values pair by pair.
+    """
+    valid = ~np.isnan(X)
+    present = valid.astype(np.float64)
+    n = present.T @ present
+
+    # deviations from the chunk's column means keep the sums of products small
+    counts = present.sum(axis=0)
+    shift = np.divide(np.where(valid, X, 0.0).sum(axis=0), counts,
+                      out=np.zeros(X.shape[1]), where=counts > 0)
+    deviations = np.where(valid, X - shift, 0.0)
+    sums = deviations.T @ present
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = np.where(n > 0, sums / n, 0.0)
+        m2 = np.where(n > 0, (deviations ** 2).T @ present - sums ** 2 / n,
+                      0.0)
+        comoment = np.where(n > 0,
+                            deviations.T @ deviations - sums * sums.T / n, 0.0)
+
+    return {
+        'n': n,
+        'mean': mean + shift[:, None],
+        'm2': m2,
+        'comoment': comoment,
+        'counts': _bin_counts(X, edges),
+    }
+
+
+def merge_stats(a, b):
+    """
+    Combine the chunk_stats of two sets of rows into those of their
+    union, with Chan et al.'s pairwise update for the moments. Histogram
+    counts add exactly; the moments agree with a single pass up to
+    floating-point rounding.
+    """
+    n = a['n'] + b['n']
+    share = np.divide(b['n'], n, out=np.zeros_like(n), where=n > 0)
+    delta = b['mean'] - a['mean']
+    return {
+        'n': n,
+        'mean': a['mean'] + delta * share,
+        'm2': a['m2'] + b['m2'] + delta ** 2 * a['n'] * share,
+        'comoment': (a['comoment'] + b['comoment']
+                     + delta * delta.T * a['n'] * share),
+        'counts': a['counts'] + b['counts'],
+    }
+
+
+def correlation(stats, columns):
+    """
+    Return the Pearson correlation matrix of the merged stats as a DataFrame
+    over columns, NaN where a pair has fewer than two rows or no variance.
+    """
+    with np.errstate(invalid='ignore', divide='ignore'):
+        corr = stats['comoment'] / np.sqrt(stats['m2'] * stats['m2'].T)
+    corr[(stats['n'] < 2) | (stats['m2'] <= 0) | (stats['m2'].T <= 0)] = np.nan
+    return pd.DataFrame(np.clip(corr, -1.0, 1.0), index=columns,
+                        columns=columns)
+
+
+def reduce_chunks(chunks, summarise, merge, workers=None):
+    """
+    Summarise each DataFrame of chunks and merge the summaries in chunk order,
+    so the result does not depend on how many workers there are. With workers,
+    chunks are summarised on a pool of processes with at most two per worker in
+    flight; summarise must then be picklable, e.g. a module-level function or a
+    partial of one. Returns None for no chunks.
+    """
+    result = None
+    if not workers or workers < 2:
+        for chunk in chunks:
+            summary = summarise(chunk)
+            result = summary if result is None else merge(result, summary)
+        return result
+
+    for summary in map_chunks(summarise, chunks, workers,
+                              command='statistics worker'):
+        result = summary if result is None else merge(result, summary)
+    return result
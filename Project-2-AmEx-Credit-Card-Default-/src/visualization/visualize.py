@@ -1,23 +1,60 @@
 # src/visualization/visualize.py
 import matplotlib.pyplot as plt
 import seaborn as sns
+import numpy as np
 import pandas as pd
 import click
 import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 from pathlib import Path
+from src.data.tables import iter_table, read_table
+from src.features.build_features import TARGET
+from src.instrumentation import instrumented, run_report
+from src.visualization.streaming_stats import (CHUNKSIZE, chunk_stats,
+                                               column_ranges, correlation,
+                                               histogram_edges, merge_stats,
+                                               reduce_chunks)
+
+# figures of the headless report, by file name (see compute_aggregates)
+REPORT_FIGURES = ['distribution_ccd', 'heatmap', 'histogram_plots',
+                  'distribution_payments', 'income_occupation',
+                  'boxplot_creditscore']
+# DataFrame.hist's default, and the bins of the debt payments histogram
+HISTOGRAM_BINS = 10
+DEBT_BINS = 50
+CLASSES = [0, 1]
 
 @click.command()
 @click.argument('input_filepath', type=click.Path(exists=True))
 @click.argument('output_filepath', type=click.Path())
-def main(input_filepath, output_filepath):
+@click.option('--report', is_flag=True,
+              help='Render every figure headless from precomputed '
+                   'aggregates, in parallel, without showing them.')
+@click.option('--workers', default=None, type=click.IntRange(min=1),
+              help='Processes summarising chunks and rendering with '
+                   '--report; one per figure, up to the CPU count, by '
+                   'default.')
+@click.option('--chunksize', default=CHUNKSIZE, type=click.IntRange(min=1),
+              help='Rows per chunk with --report, which streams the data '
+                   'instead of loading it.')
+def main(input_filepath, output_filepath, report, workers, chunksize):
     """ Runs scripts to create visualizations from processed data
         saved in input_filepath and saves them in output_filepath.
     """
     logger = logging.getLogger(__name__)
     logger.info('Creating visualizations')
 
-    amex_train_fig = pd.read_csv(input_filepath)
-    amex_train_fig = amex_train_fig.drop('Unnamed: 0', axis=1)
+    if report:
+        workers = workers or min(len(REPORT_FIGURES), os.cpu_count() or 1)
+        aggregates = compute_aggregates(input_filepath, chunksize, workers)
+        paths = render_report(aggregates, output_filepath, workers)
+        logger.info(f'{len(paths)} figures saved to {output_filepath}')
+        return
+
+    amex_train_fig = read_table(input_filepath)
+    amex_train_fig = amex_train_fig.drop(columns='Unnamed: 0', errors='ignore')
 
     # Distribution of Credit Card Default Customers
     create_distribution_plot(amex_train_fig, output_filepath)
@@ -97,6 +134,222 @@ def create_credit_score_boxplot(df, output_filepath):
     plt.show()
 
 
+def _values(series):
+    return series.to_numpy(dtype=np.float64, na_value=np.nan)
+
+
+def _box_stats(values, label):
+    # what matplotlib's boxplot computes, with whiskers at 1.5 IQR; outliers
+    # are kept once per distinct value, which draws the same points
+    values = values[~np.isnan(values)]
+    q1, med, q3 = np.percentile(values, [25, 50, 75])
+    iqr = q3 - q1
+    whislo = values[values >= q1 - 1.5 * iqr].min()
+    whishi = values[values <= q3 + 1.5 * iqr].max()
+    fliers = np.unique(values[(values < whislo) | (values > whishi)])
+    return {'label': label, 'q1': q1, 'med': med, 'q3': q3, 'whislo': whislo,
+            'whishi': whishi, 'fliers': fliers}
+
+
+def _chunk_aggregates(df, columns, edges, debt_edges):
+    # the mergeable part of the aggregates of one chunk of rows
+    target = _values(df[TARGET])
+    debt = _values(df['yearly_debt_payments'])
+    income = df.groupby(['occupation_type', TARGET],
+                        observed=True)['net_yearly_income']
+    X = np.column_stack([_values(df[col]) for col in columns])
+    return {
+        'stats': chunk_stats(X, np.stack([edges[col] for col in columns])),
+        'classes': np.array([np.count_nonzero(target == c) for c in CLASSES]),
+        'debt': np.stack([np.histogram(debt[target == c], bins=debt_edges)[0]
+                          for c in CLASSES]),
+        'income': income.agg(['sum', 'count']).astype(np.float64),
+    }
+
+
+def _merge_aggregates(a, b):
+    return {
+        'stats': merge_stats(a['stats'], b['stats']),
+        'classes': a['classes'] + b['classes'],
+        'debt': a['debt'] + b['debt'],
+        'income': a['income'].add(b['income'], fill_value=0),
+    }
+
+
+def report_columns(path):
+    """
+    Return the numeric columns of the table at path, as
+    DataFrame.corr(numeric_only=True) would pick them, judging by its
+    first rows.
+    """
+    first = next(iter_table(path, 1000))
+    return [col for col in first.select_dtypes('number').columns
+            if col != 'Unnamed: 0']
+
+
+@instrumented('compute_aggregates')
+def compute_aggregates(path, chunksize=CHUNKSIZE, workers=None):
+    """
+    Reduce the processed data at path to what each of REPORT_FIGURES draws:
+    class counts, the correlation matrix, binned histograms, group means and
+    box statistics. They are small whatever the number of rows, so rendering
+    never touches the data.
+
+    All but the box statistics are computed in one pass over chunks of
+    chunksize rows, summarised on workers processes and merged (see
+    src.visualization.streaming_stats); histogram edges come from the
+    columns' ranges, which Parquet files hold in their metadata. The credit
+    score quartiles need all values, so only that column and the target are
+    loaded whole.
+    """
+    columns = report_columns(path)
+    ranges = column_ranges(path, columns, chunksize)
+    edges = {col: histogram_edges(*ranges[col], HISTOGRAM_BINS)
+             for col in columns}
+    debt_edges = histogram_edges(*ranges['yearly_debt_payments'], DEBT_BINS)
+
+    needed = list(dict.fromkeys(columns + [TARGET, 'yearly_debt_payments',
+                                           'occupation_type',
+                                           'net_yearly_income']))
+    summarise = partial(_chunk_aggregates, columns=columns, edges=edges,
+                        debt_edges=debt_edges)
+    merged = reduce_chunks(iter_table(path, chunksize, columns=needed),
+                           summarise, _merge_aggregates, workers)
+
+    income = merged['income']
+    income_means = ((income['sum'] / income['count'])
+                    .rename('net_yearly_income').reset_index())
+    scores = read_table(path, columns=[TARGET, 'credit_score'])
+    target = _values(scores[TARGET])
+    credit_score = _values(scores['credit_score'])
+    class_scores = {c: credit_score[target == c] for c in CLASSES}
+
+    return {
+        'distribution_ccd': merged['classes'],
+        'heatmap': correlation(merged['stats'], columns),
+        'histogram_plots': {col: (counts, edges[col])
+                            for col, counts in zip(columns,
+                                                   merged['stats']['counts'])},
+        'distribution_payments': {'edges': debt_edges,
+                                  'counts': dict(zip(CLASSES,
+                                                     merged['debt']))},
+        'income_occupation': income_means,
+        'boxplot_creditscore': [_box_stats(values, str(c))
+                                for c, values in class_scores.items()
+                                if np.any(~np.isnan(values))],
+    }
+
+
+def render_distribution_plot(counts, path):
+    fig, ax = plt.subplots()
+    ax.bar([0, 1], counts, color=sns.color_palette('Set2', 2))
+    ax.set_title('Distribution of Credit Card Default Customers')
+    ax.set_xlabel('Credit Card Default')
+    ax.set_ylabel('Frequency')
+    ax.set_xticks([0, 1])
+    ax.set_xticklabels(['No Default', 'Default'])
+    ax.grid(False)
+    fig.savefig(path)
+    plt.close(fig)
+
+
+def render_heatmap(correlation, path):
+    fig, ax = plt.subplots(figsize=(15, 8))
+    sns.heatmap(correlation, annot=True, ax=ax)
+    ax.set_title('Heatmap Matrix Correlation American Express Dataframe')
+    fig.savefig(path, bbox_inches='tight')
+    plt.close(fig)
+
+
+def render_histograms(histograms, path):
+    # laid out like DataFrame.hist
+    ncols = int(np.ceil(np.sqrt(len(histograms))))
+    nrows = int(np.ceil(len(histograms) / ncols))
+    fig, axes = plt.subplots(nrows, ncols, figsize=(15, 10), squeeze=False)
+    color = sns.color_palette('Set2')[0]
+    for ax, (col, (counts, edges)) in zip(axes.flat, histograms.items()):
+        ax.hist(edges[:-1], bins=edges, weights=counts, color=color)
+        ax.set_title(col)
+        ax.grid(False)
+    for ax in axes.flat[len(histograms):]:
+        ax.set_visible(False)
+    fig.subplots_adjust(hspace=0.5)
+    fig.savefig(path)
+    plt.close(fig)
+
+
+def render_debt_distribution_plot(histogram, path):
+    edges = histogram['edges']
+    centers = (edges[:-1] + edges[1:]) / 2
+    binned = pd.DataFrame({
+        'yearly_debt_payments': np.tile(centers, len(histogram['counts'])),
+        'count': np.concatenate(list(histogram['counts'].values())),
+        TARGET: np.repeat(list(histogram['counts']), len(centers)),
+    })
+    fig, ax = plt.subplots()
+    sns.histplot(data=binned, x='yearly_debt_payments', weights='count',
+                 hue=TARGET, bins=list(edges), palette='Set2', ax=ax)
+    ax.grid(False)
+    ax.set_title('Yearly Debt Payments Distribution By Default History')
+    fig.savefig(path)
+    plt.close(fig)
+
+
+def render_income_occupation_plot(means, path):
+    g = sns.catplot(x='occupation_type', data=means, y='net_yearly_income',
+                    hue=TARGET, kind='bar', palette='Set2', errorbar=None)
+    g.set_xticklabels(rotation=90, horizontalalignment='right')
+    g.ax.set_title('Net Yearly Income By Occupation Type')
+    g.savefig(path)
+    plt.close(g.figure)
+
+
+def render_credit_score_boxplot(stats, path):
+    fig, ax = plt.subplots()
+    boxes = ax.bxp(stats, patch_artist=True)
+    for box, color in zip(boxes['boxes'], sns.color_palette('Set2')):
+        box.set_facecolor(color)
+    ax.set_xlabel(TARGET)
+    ax.set_ylabel('credit_score')
+    ax.set_title('Credit Score By Customers Default History')
+    fig.savefig(path)
+    plt.close(fig)
+
+
+RENDERERS = {'distribution_ccd': render_distribution_plot,
+             'heatmap': render_heatmap, 'histogram_plots': render_histograms,
+             'distribution_payments': render_debt_distribution_plot,
+             'income_occupation': render_income_occupation_plot,
+             'boxplot_creditscore': render_credit_score_boxplot}
+
+
+def _init_renderer():
+    # no display is needed, or used, to draw into files
+    plt.switch_backend('Agg')
+
+
+def _render(name, aggregate, output_filepath):
+    path = os.path.join(output_filepath, f'{name}.png')
+    RENDERERS[name](aggregate, path)
+    return path
+
+
+@instrumented('render_report')
+def render_report(aggregates, output_filepath, workers=None):
+    """
+    Draw each of REPORT_FIGURES from its aggregates (see compute_aggregates)
+    into output_filepath, with the headless Agg backend, on a pool of worker
+    processes. Returns the paths of the figures.
+    """
+    os.makedirs(output_filepath, exist_ok=True)
+    workers = workers or min(len(REPORT_FIGURES), os.cpu_count() or 1)
+    with ProcessPoolExecutor(max_workers=workers,
+                             initializer=_init_renderer) as executor:
+        futures = [executor.submit(_render, name, aggregates[name],
+                                   output_filepath) for name in REPORT_FIGURES]
+        return [future.result() for future in futures]
+
+
 if __name__ == '__main__':
     log_fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
     logging.basicConfig(level=logging.INFO, format=log_fmt)
@@ -104,4 +357,5 @@ if __name__ == '__main__':
     # Not used in this stub but often useful for finding various files
     project_dir = Path(__file__).resolve().parents[2]
 
-    main()
+    with run_report('visualize'):
+        main()
@@ -0,0 +1,64 @@
+# tests/conftest.py
+# -*- coding: utf-8 -*-
+import joblib
+import pandas as pd
+import pytest
+from pathlib import Path
+from src.data.make_synthetic import generate_customers
+from src.features.build_features import (TARGET, clean_data,
+                                         feature_engineering, fit_cleaner)
+from src.models.fit_model import fit_transforms
+from src.models.train_model import (formatting, transform_features,
+                                    transform_params)
+
+PROJECT_DIR = Path(__file__).resolve().parents[1]
+
+
+@pytest.fixture(scope='session')
+def customers():
+    """
+    Synthetic raw customers, with the missing values and 'XNA' genders of the
+    real data, as float64/object columns like the baseline pipeline read them.
+    """
+    return pd.concat(generate_customers(2000, seed=7), ignore_index=True)
+
+
+@pytest.fixture(scope='session')
+def cleaner(customers):
+    return fit_cleaner(customers)
+
+
+@pytest.fixture(scope='session')
+def transforms(customers, cleaner):
+    """
+    Median SimpleImputer and MinMaxScaler fitted on customers. Unlike the
+    shipped identity scaler, this one rescales every column, so any rounding of
+    the raw values before the transform shows in the features.
+    """
+    cleaned = clean_data(customers, cleaner)
+    features = feature_engineering(cleaned).drop(columns=TARGET)
+    X, _ = formatting(features)
+    return fit_transforms(X)
+
+
+@pytest.fixture(scope='session')
+def fitted_params(transforms):
+    return transform_params(*transforms)
+
+
+@pytest.fixture(scope='session')
+def transformed(customers, cleaner, fitted_params):
+    """
+    customers through scoring's transforms: their float32 feature matrix, in
+    FEATURE_COLUMNS order, and their customer_ids.
+    """
+    cleaned = clean_data(customers, cleaner)
+    features = feature_engineering(cleaned).drop(columns=TARGET)
+    X, customer_ids = formatting(features)
+    X = transform_features(X, fitted_params).to_numpy()
+    return X, customer_ids.to_numpy()
+
+
+@pytest.fixture(scope='session')
+def model():
+    return joblib.load(PROJECT_DIR / 'models' / 'best_xgb_model.pkl')
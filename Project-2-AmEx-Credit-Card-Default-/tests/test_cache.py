@@ -0,0 +1,27 @@
+# tests/test_cache.py
+# -*- coding: utf-8 -*-
+import os
+from src.cache import run_cached
+
+
+def test_run_cached_reuses_and_bounds_the_cache(tmp_path):
+    cache_dir, output = tmp_path / 'cache', tmp_path / 'out.txt'
+    calls = []
+
+    def writer(text):
+        def compute(paths):
+            calls.append(text)
+            paths['data'].write_text(text)
+        return compute
+
+    run_cached(cache_dir, 'stage', 'a', {'data': output}, writer('a' * 1000))
+    run_cached(cache_dir, 'stage', 'a', {'data': output}, writer('a' * 1000))
+    assert calls == ['a' * 1000]
+    assert output.read_text() == 'a' * 1000
+
+    # the least recently used entry goes once both no longer fit
+    os.utime(cache_dir / 'stage' / 'a', (0, 0))
+    run_cached(cache_dir, 'stage', 'b', {'data': output}, writer('b' * 1000),
+               max_bytes=1500)
+    assert output.read_text() == 'b' * 1000
+    assert [entry.name for entry in (cache_dir / 'stage').iterdir()] == ['b']
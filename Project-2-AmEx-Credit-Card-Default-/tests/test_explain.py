@@ -0,0 +1,76 @@
+# tests/test_explain.py
+# -*- coding: utf-8 -*-
+import numpy as np
+import pandas as pd
+import pytest
+import xgboost as xgb
+from src.models.explain import (contributions, explain_chunks,
+                                sample_customers, top_reasons)
+
+
+@pytest.fixture
+def booster(model):
+    return model.get_booster()
+
+
+def _chunks(X, customer_ids, size):
+    return [(X[start:start + size], customer_ids[start:start + size])
+            for start in range(0, len(X), size)]
+
+
+@pytest.mark.parametrize('approximate', [False, True])
+def test_contributions_sum_to_the_margin(transformed, booster, approximate):
+    # TreeSHAP is slow on this 329-tree model, so a few hundred rows do
+    X = transformed[0][:300]
+    contribs = contributions(X, booster, approximate)
+    matrix = xgb.DMatrix(X, feature_names=booster.feature_names)
+    margin = booster.predict(matrix, output_margin=True,
+                             validate_features=False)
+
+    assert contribs.shape == (len(X), len(booster.feature_names) + 1)
+    np.testing.assert_allclose(contribs.sum(axis=1), margin, rtol=0, atol=1e-4)
+
+
+def test_top_reasons_order_and_padding():
+    contribs = np.array([[0.1, 0.5, -0.2, 0.3, 9.0],
+                         [-0.1, 0.2, -0.3, 0.0, 9.0],
+                         [-0.1, -0.2, -0.3, -0.4, 9.0]])
+    reasons = top_reasons(contribs, ['a', 'b', 'c', 'd'], top_k=5)
+
+    # the bias column is never a reason, and only risk-raising features are
+    assert reasons['reason_1'].tolist() == ['b', 'b', None]
+    assert reasons['reason_2'].tolist() == ['d', None, None]
+    assert reasons['reason_3'].tolist() == ['a', None, None]
+    assert reasons['reason_5'].tolist() == [None, None, None]
+    np.testing.assert_array_equal(reasons['contribution_1'],
+                                  [0.5, 0.2, np.nan])
+    np.testing.assert_array_equal(reasons['contribution_3'],
+                                  [0.1, np.nan, np.nan])
+    np.testing.assert_array_equal(reasons['contribution_5'], [np.nan] * 3)
+
+
+def test_sample_ignores_chunking(transformed):
+    _, customer_ids = transformed
+    picked = sample_customers(customer_ids, 0.3)
+
+    for size in (1, 7, 500):
+        chunks = _chunks(customer_ids, customer_ids, size)
+        chunked = np.concatenate([sample_customers(ids, 0.3)
+                                  for _, ids in chunks])
+        np.testing.assert_array_equal(chunked, picked)
+    assert 0.2 < picked.mean() < 0.4
+    assert sample_customers(customer_ids, 1.0).all()
+
+
+def test_workers_match_the_serial_run(transformed, booster):
+    X, customer_ids = transformed
+    options = {'top_k': 4, 'sample': 0.5, 'approximate': True}
+    serial = pd.concat(explain_chunks(_chunks(X, customer_ids, 300), booster,
+                                      **options), ignore_index=True)
+    parallel = pd.concat(explain_chunks(_chunks(X, customer_ids, 300), booster,
+                                        workers=2, **options),
+                         ignore_index=True)
+
+    picked = customer_ids[sample_customers(customer_ids, 0.5)]
+    assert serial['customer_id'].tolist() == picked.tolist()
+    pd.testing.assert_frame_equal(parallel, serial)
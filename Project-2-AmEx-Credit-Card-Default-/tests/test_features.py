@@ -0,0 +1,54 @@
+# tests/test_features.py
+# -*- coding: utf-8 -*-
+import numpy as np
+import pandas as pd
+import pytest
+from src.data.tables import read_table
+from src.features.build_features import (FEATURE_COLUMNS, PROCESSING_COLUMNS,
+                                         RAW_DTYPES, TARGET, clean_data,
+                                         encode_features, feature_engineering)
+from src.features.record_features import build_record_tables, encode_record
+from src.models.train_model import formatting, transform_features
+
+
+def _features(data, cleaner):
+    cleaned = clean_data(data, cleaner)
+    features = feature_engineering(cleaned).drop(columns=TARGET)
+    X, _ = formatting(features)
+    return X
+
+
+@pytest.fixture
+def raw_csv(customers, tmp_path):
+    path = tmp_path / 'customers.csv'
+    customers.to_csv(path, index=False)
+    return path
+
+
+def test_compact_dtypes_match_the_float64_sklearn_pipeline(raw_csv, cleaner,
+                                                           transforms,
+                                                           fitted_params):
+    imputer, scaler = transforms
+    # the baseline: pandas' default float64 parsing through the fitted
+    # sklearn objects
+    reference = _features(pd.read_csv(raw_csv), cleaner)
+    encoded = pd.DataFrame(encode_features(reference), columns=FEATURE_COLUMNS)
+    imputed = pd.DataFrame(imputer.transform(encoded), columns=FEATURE_COLUMNS)
+    expected = scaler.transform(imputed).astype(np.float32)
+
+    data = read_table(raw_csv, columns=PROCESSING_COLUMNS, dtype=RAW_DTYPES)
+    X = transform_features(_features(data, cleaner), fitted_params).to_numpy()
+
+    assert X.dtype == np.float32
+    np.testing.assert_array_equal(X, expected)
+
+
+def test_encode_record_matches_the_batch_matrix(raw_csv, cleaner,
+                                                fitted_params):
+    data = read_table(raw_csv, columns=PROCESSING_COLUMNS, dtype=RAW_DTYPES)
+    X = transform_features(_features(data, cleaner), fitted_params).to_numpy()
+
+    tables = build_record_tables(fitted_params, cleaner)
+    for i, record in enumerate(pd.read_csv(raw_csv).to_dict('records')):
+        np.testing.assert_array_equal(encode_record(record, tables), X[i],
+                                      err_msg=f'row {i}')
@@ -0,0 +1,48 @@
+# tests/test_forest.py
+# -*- coding: utf-8 -*-
+import numpy as np
+import pytest
+from src.models.bundle import FORMAT_VERSION, load_bundle, save_bundle
+from src.models.forest import Forest, export_forest
+
+
+@pytest.fixture(scope='module')
+def X(transformed):
+    # every tenth value missing, so the default directions are exercised too
+    X = transformed[0].copy()
+    X.ravel()[::10] = np.nan
+    return X
+
+
+def test_forest_matches_the_booster(model, X):
+    booster = model.get_booster()
+    forest = Forest(export_forest(model), batch_size=100)
+
+    expected = booster.inplace_predict(X, validate_features=False)
+    probabilities = forest.inplace_predict(X)
+    assert probabilities.dtype == np.float32
+    np.testing.assert_allclose(probabilities, expected, rtol=1e-5, atol=1e-6)
+
+
+def test_bundle_round_trip_with_the_numpy_evaluator(model, fitted_params,
+                                                    cleaner, X, tmp_path):
+    path = tmp_path / 'model.bundle'
+    bundle_id = save_bundle(path, model, fitted_params, cleaner)
+    bundle = load_bundle(path, evaluator='numpy')
+
+    assert isinstance(bundle['model'], Forest)
+    assert bundle['bundle_id'] == bundle_id
+    assert bundle['format_version'] == FORMAT_VERSION
+    assert bundle['cleaner'] == cleaner
+    for name in ('fill_values', 'scale', 'offset'):
+        np.testing.assert_array_equal(bundle['params'][name],
+                                      fitted_params[name])
+
+    # the mapped trees evaluate exactly as freshly exported ones
+    exported = Forest(export_forest(model))
+    np.testing.assert_array_equal(bundle['model'].inplace_predict(X),
+                                  exported.inplace_predict(X))
+    np.testing.assert_allclose(
+        bundle['model'].inplace_predict(X),
+        load_bundle(path)['model'].get_booster().inplace_predict(X), rtol=1e-5,
+        atol=1e-6)
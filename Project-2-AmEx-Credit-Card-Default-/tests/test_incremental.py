@@ -0,0 +1,82 @@
+# tests/test_incremental.py
+# -*- coding: utf-8 -*-
+import pytest
+from xgboost import XGBClassifier
+from models import model_deployment
+from models.model_deployment import (incremental_predictions, load_data,
+                                     score_data)
+from src.data.tables import write_table
+from src.features.build_features import TARGET
+from src.models.incremental import save_state
+
+
+@pytest.fixture
+def book(customers, tmp_path):
+    # scored as model_deployment loads it, with the compact dtypes the hashes
+    # depend on
+    path = tmp_path / 'book.parquet'
+    customers.drop(columns=TARGET).to_parquet(path)
+    return load_data(path)
+
+
+@pytest.fixture
+def scored(monkeypatch):
+    # the number of customers each run sends through the scoring pipeline
+    counts = []
+
+    def counting_score_data(df, *args, **kwargs):
+        counts.append(len(df))
+        return score_data(df, *args, **kwargs)
+
+    monkeypatch.setattr(model_deployment, 'score_data', counting_score_data)
+    return counts
+
+
+def _run(df, state_path, model, params, cleaner):
+    results, state = incremental_predictions(df, state_path, model, params,
+                                             cleaner)
+    save_state(state_path, *state)
+    return results
+
+
+def _bytes(results, path):
+    write_table(results, path)
+    return path.read_bytes()
+
+
+def test_second_run_rescores_only_the_changed_rows(book, model, fitted_params,
+                                                   cleaner, scored, tmp_path):
+    state_path = tmp_path / 'state.pkl'
+    _run(book, state_path, model, fitted_params, cleaner)
+    # an unchanged book is not rescored at all
+    assert len(_run(book, state_path, model, fitted_params,
+                    cleaner)) == len(book)
+
+    changed = book.copy()
+    rows = changed.index[[3, 500, 1999]]
+    changed.loc[rows, 'credit_score'] += 100
+    changed.loc[rows[0], 'occupation_type'] = 'Managers'
+    results = _run(changed, state_path, model, fitted_params, cleaner)
+
+    assert scored == [len(book), len(rows)]
+    full = score_data(changed, model, fitted_params, cleaner)
+    for suffix in ('csv', 'parquet'):
+        assert (_bytes(results, tmp_path / f'a.{suffix}')
+                == _bytes(full, tmp_path / f'b.{suffix}'))
+
+
+def test_new_assets_rescore_everyone(book, model, fitted_params, cleaner,
+                                     scored, tmp_path):
+    state_path = tmp_path / 'state.pkl'
+    _run(book, state_path, model, fitted_params, cleaner)
+
+    other_cleaner = dict(cleaner, total_family_members=(
+        cleaner['total_family_members'] + 1))
+    _run(book, state_path, model, fitted_params, other_cleaner)
+
+    other_model = XGBClassifier()
+    other_model.load_model(bytearray(model.get_booster()[:50].save_raw('ubj')))
+    _run(book, state_path, other_model, fitted_params, other_cleaner)
+    _run(book, state_path, other_model, fitted_params, other_cleaner)
+
+    assert scored == [len(book)] * 3
@@ -0,0 +1,51 @@
+# tests/test_instrumentation.py
+# -*- coding: utf-8 -*-
+import threading
+import pytest
+from src import instrumentation
+from src.instrumentation import (finish_run, metrics_enabled, run_report,
+                                 stage, start_run)
+
+
+@pytest.fixture
+def resets(monkeypatch):
+    calls = []
+    monkeypatch.setattr(instrumentation, '_reset_peak_rss',
+                        lambda: calls.append(1))
+    start_run('test', trace_allocations=False)
+    yield calls
+    finish_run(report_path=instrumentation.Path('/dev/null'))
+
+
+def test_metrics_are_off_by_default(monkeypatch, tmp_path):
+    monkeypatch.delenv(instrumentation.METRICS_ENV, raising=False)
+    monkeypatch.setattr(instrumentation, 'REPORT_PATH',
+                        tmp_path / 'reports.jsonl')
+    with run_report('test'):
+        assert not metrics_enabled()
+    assert not (tmp_path / 'reports.jsonl').exists()
+
+
+def test_only_a_stage_running_alone_resets_the_peak(resets):
+    with stage('outer'):
+        with stage('inner'):
+            pass
+    assert len(resets) == 1
+
+    started, release = threading.Event(), threading.Event()
+
+    def other_thread():
+        with stage('other'):
+            started.set()
+            release.wait()
+
+    thread = threading.Thread(target=other_thread)
+    thread.start()
+    started.wait()
+    with stage('concurrent'):
+        pass
+    release.set()
+    thread.join()
+    assert len(resets) == 2
+    assert set(instrumentation._run['stages']) == {'outer', 'inner', 'other',
+                                                   'concurrent'}
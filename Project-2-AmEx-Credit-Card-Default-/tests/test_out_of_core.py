@@ -0,0 +1,74 @@
+# tests/test_out_of_core.py
+# -*- coding: utf-8 -*-
+import numpy as np
+import pandas as pd
+import pytest
+import xgboost as xgb
+from src.features.build_features import CLEANER_COLUMNS, TARGET, fit_cleaner
+from src.models.out_of_core import (SPLITS, ChunkIter, assign_splits,
+                                    iter_split, write_training_chunks)
+
+
+@pytest.fixture
+def raw_csv(customers, tmp_path):
+    path = tmp_path / 'customers.csv'
+    customers.to_csv(path, index=False)
+    return path
+
+
+def test_splits_are_stable_per_customer_across_chunkings(customers):
+    customer_ids = customers['customer_id']
+    splits = assign_splits(customer_ids, 0.3, 0.1)
+
+    for size in (1, 7, 333):
+        chunked = np.concatenate(
+            [assign_splits(customer_ids.iloc[start:start + size], 0.3, 0.1)
+             for start in range(0, len(customer_ids), size)])
+        np.testing.assert_array_equal(chunked, splits)
+    shares = pd.Series(splits).value_counts(normalize=True)
+    assert set(shares.index) == set(SPLITS)
+    assert abs(shares['test'] - 0.3) < 0.05
+    assert abs(shares['validation'] - 0.07) < 0.03
+
+
+def test_cleaner_sees_only_the_fit_rows(customers, raw_csv):
+    labelled = customers.dropna(subset=[TARGET])
+    splits = assign_splits(labelled['customer_id'], 0.3, 0.1)
+    fit_rows = labelled[splits == 'fit']
+
+    chunks = list(iter_split(raw_csv, 300, CLEANER_COLUMNS, 'fit', 0.3, 0.1))
+
+    assert (pd.concat(chunks)['customer_id'].tolist()
+            == fit_rows['customer_id'].tolist())
+    assert fit_cleaner(chunks) == fit_cleaner(fit_rows)
+
+
+class RecordingInput:
+    # stands in for the callback XGBoost passes to DataIter.next
+    def __init__(self):
+        self.labels = []
+
+    def __call__(self, data, label, feature_names):
+        self.labels.append(np.asarray(label).copy())
+
+
+def test_chunk_iter_yields_every_chunk_once_per_reset(raw_csv, cleaner,
+                                                      fitted_params, tmp_path):
+    paths = write_training_chunks(raw_csv, 300, cleaner, fitted_params,
+                                  tmp_path / 'chunks', 0.3, 0.1)
+    expected = [np.load(y_path) for _, y_path in paths['fit']]
+    iterator = ChunkIter(paths['fit'])
+
+    for _ in range(2):
+        recorded = RecordingInput()
+        while iterator.next(recorded):
+            pass
+        assert len(recorded.labels) == len(expected) == 7
+        for labels, chunk_labels in zip(recorded.labels, expected):
+            np.testing.assert_array_equal(labels, chunk_labels)
+        iterator.reset()
+
+    # XGBoost itself goes through the chunks once per pass it makes
+    matrix = xgb.QuantileDMatrix(ChunkIter(paths['fit']))
+    assert matrix.num_row() == sum(len(labels) for labels in expected)
+    np.testing.assert_array_equal(matrix.get_label(), np.concatenate(expected))
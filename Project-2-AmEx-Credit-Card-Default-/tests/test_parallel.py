@@ -0,0 +1,61 @@
+# tests/test_parallel.py
+# -*- coding: utf-8 -*-
+import joblib
+import time
+import pandas as pd
+import pytest
+from pathlib import Path
+from models.model_deployment import (load_data, parallel_predictions,
+                                     score_data, stream_predictions)
+from src.features.build_features import TARGET
+from src.models.train_model import transform_params
+from src.parallel import map_chunks
+
+MODELS_DIR = Path(__file__).resolve().parents[1] / 'models'
+
+
+def _slow_square(x):
+    # early chunks finish last, so results come back out of order
+    time.sleep(0.01 * (10 - x))
+    return x * x
+
+
+def test_map_chunks_keeps_input_order_and_bounds_what_is_in_flight():
+    pulled = []
+
+    def chunks():
+        for x in range(10):
+            pulled.append(x)
+            yield x
+
+    results = map_chunks(_slow_square, chunks(), workers=2)
+    assert next(results) == 0
+    assert len(pulled) <= 4
+    assert list(results) == [x * x for x in range(1, 10)]
+
+
+@pytest.fixture
+def book(customers, tmp_path):
+    path = tmp_path / 'book.parquet'
+    customers.drop(columns=TARGET).to_parquet(path)
+    return path
+
+
+def test_serial_chunked_and_parallel_scoring_agree(book, model, cleaner):
+    asset_paths = {'bundle_path': None,
+                   'model_path': MODELS_DIR / 'best_xgb_model.pkl',
+                   'imputer_path': MODELS_DIR / 'simple_imputer.pkl',
+                   'scaler_path': MODELS_DIR / 'min-max-scaler.pkl',
+                   'evaluator': 'xgboost'}
+    params = transform_params(joblib.load(asset_paths['imputer_path']),
+                              joblib.load(asset_paths['scaler_path']))
+
+    serial = score_data(load_data(book), model, params, cleaner)
+    chunked = pd.concat(stream_predictions(book, model, params, cleaner, 300),
+                        ignore_index=True)
+    parallel = pd.concat(parallel_predictions(book, asset_paths, cleaner,
+                                              300, 2),
+                         ignore_index=True)
+
+    pd.testing.assert_frame_equal(chunked, serial)
+    pd.testing.assert_frame_equal(parallel, serial)
@@ -0,0 +1,111 @@
+# tests/test_prediction_cache.py
+# -*- coding: utf-8 -*-
+import math
+import pytest
+from src.features import record_features
+from src.features.build_features import TARGET
+from src.features.record_features import build_record_tables
+from src.models import predict_model, serve
+from src.models.predict_model import predict_record
+from src.models.prediction_cache import PredictionCache
+from src.models.serve import score_records
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def records(customers):
+    return customers.drop(columns=TARGET).head(4).to_dict('records')
+
+
+@pytest.fixture
+def tables(cleaner, fitted_params):
+    return build_record_tables(fitted_params, cleaner)
+
+
+def test_hit_and_miss(records):
+    cache = PredictionCache('bundle')
+    assert cache.get(records[0]) is None
+    cache.put(records[0], 0.25)
+
+    assert cache.get(records[0]) == 0.25
+    assert cache.get(records[1]) is None
+    assert cache.get(dict(records[0], age=records[0]['age'] + 1)) is None
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses'], stats['size']) == (1, 3, 1)
+
+
+def test_key_is_canonical(records):
+    cache = PredictionCache('bundle')
+    record = dict(records[0], age=40, credit_score=None)
+    cache.put(record, 0.25)
+
+    # field order, int or float numbers and the customer_id do not change
+    # the key
+    assert cache.get(dict(reversed(list(record.items())))) == 0.25
+    assert cache.get(dict(record, age=40.0, credit_score=math.nan)) == 0.25
+    assert cache.get(dict(record, customer_id='someone else')) == 0.25
+    # a missing field is a missing value, and fields the model ignores do
+    # not count
+    assert cache.get({k: v for k, v in record.items()
+                      if k != 'credit_score'}) == 0.25
+    assert cache.get(dict(record, name='someone else')) == 0.25
+
+
+def test_bundles_do_not_share_entries(records):
+    cache = PredictionCache('bundle-a')
+    cache.put(records[0], 0.25)
+    assert cache.key(records[0]) != PredictionCache('bundle-b').key(records[0])
+
+
+def test_entries_expire_after_ttl(records):
+    clock = FakeClock()
+    cache = PredictionCache('bundle', ttl=10, clock=clock)
+    cache.put(records[0], 0.25)
+
+    clock.now = 9.9
+    assert cache.get(records[0]) == 0.25
+    clock.now = 10
+    assert cache.get(records[0]) is None
+    stats = cache.stats()
+    assert (stats['expirations'], stats['size']) == (1, 0)
+
+
+def test_least_recently_used_entry_is_evicted(records):
+    cache = PredictionCache('bundle', max_entries=2)
+    cache.put(records[0], 0.1)
+    cache.put(records[1], 0.2)
+    cache.get(records[0])
+    cache.put(records[2], 0.3)
+
+    assert cache.get(records[1]) is None
+    assert (cache.get(records[0]), cache.get(records[2])) == (0.1, 0.3)
+    assert cache.stats()['evictions'] == 1
+
+
+def test_hits_skip_encoding(records, tables, model, monkeypatch):
+    cache = PredictionCache('bundle')
+    expected = score_records(records, tables, model)
+    assert score_records(records[:2], tables, model,
+                         cache=cache) == expected[:2]
+    assert predict_record(records[2], tables, model, cache) == (
+        expected[2]['prediction_default'],
+        pytest.approx(expected[2]['probability_default']))
+
+    def fail(*args, **kwargs):
+        raise AssertionError('a cached customer was encoded')
+
+    monkeypatch.setattr(serve, 'encode_record', fail)
+    monkeypatch.setattr(predict_model, 'encode_record', fail)
+    monkeypatch.setattr(record_features, 'encode_record', fail)
+    assert score_records(records[:3], tables, model,
+                         cache=cache) == expected[:3]
+    prediction, _ = predict_record(records[0], tables, model, cache)
+    assert prediction == expected[0]['prediction_default']
+    assert cache.stats()['hits'] == 4
@@ -0,0 +1,57 @@
+# tests/test_ranking.py
+# -*- coding: utf-8 -*-
+import numpy as np
+import pandas as pd
+import pytest
+from src.models.ranking import RANK_COLUMN, rank_top, reduce_top, select_top
+
+
+@pytest.fixture
+def results():
+    # few distinct probabilities, so most of the cut falls on ties
+    rng = np.random.default_rng(0)
+    n = 1000
+    occupations = np.array(['Drivers', 'Managers', 'Laborers', None],
+                           dtype=object)
+    probabilities = rng.integers(0, 20, n).astype(np.float32) / 20
+    occupation_types = occupations[rng.integers(0, 4, n)]
+    return pd.DataFrame({'customer_id': [f'CST_{i}' for i in range(n)],
+                         RANK_COLUMN: probabilities,
+                         'occupation_type': occupation_types})
+
+
+def _full_sort_top(results, n, by=None):
+    ranked = results.sort_values(RANK_COLUMN, ascending=False, kind='stable')
+    if by is None:
+        return ranked.head(n).reset_index(drop=True)
+    top = ranked.groupby(by, sort=False, dropna=False).head(n)
+    return top.sort_values(by, kind='stable',
+                           na_position='last').reset_index(drop=True)
+
+
+@pytest.mark.parametrize('by', [None, 'occupation_type'])
+@pytest.mark.parametrize('n', [1, 25, 400, 5000])
+def test_top_matches_a_full_sort(results, n, by):
+    ranked = rank_top(select_top(results, n, by), by)
+    pd.testing.assert_frame_equal(ranked.drop(columns='risk_rank'),
+                                  _full_sort_top(results, n, by))
+
+    if by is None:
+        assert ranked['risk_rank'].tolist() == list(range(1, len(ranked) + 1))
+    else:
+        ranks = ranked.groupby(by, sort=False, dropna=False)['risk_rank']
+        assert all(group.tolist() == list(range(1, len(group) + 1))
+                   for _, group in ranks)
+
+
+@pytest.mark.parametrize('by', [None, 'occupation_type'])
+@pytest.mark.parametrize('chunksize', [1, 37, 300])
+def test_chunked_top_matches_the_full_input(results, chunksize, by):
+    chunks = (select_top(results.iloc[start:start + chunksize], 25, by)
+              for start in range(0, len(results), chunksize))
+    pd.testing.assert_frame_equal(reduce_top(chunks, 25, by),
+                                  select_top(results, 25, by))
+
+
+def test_reduce_top_of_no_chunks_is_none():
+    assert reduce_top([], 10) is None
@@ -0,0 +1,67 @@
+# tests/test_resampling.py
+# -*- coding: utf-8 -*-
+import numpy as np
+import pandas as pd
+import pytest
+from src.models.resampling import (ChunkedSMOTE, balance_weight, make_sampler,
+                                   resample)
+
+pytest.importorskip('imblearn')
+
+
+@pytest.fixture
+def training_rows():
+    # about one positive in eleven, as in the AmEx data
+    rng = np.random.default_rng(0)
+    X = rng.normal(size=(5000, 4)).astype(np.float32)
+    y = (rng.random(5000) < 0.09).astype(np.int64)
+    return X, y
+
+
+@pytest.mark.parametrize('as_frame', [False, True])
+def test_chunked_smote_balances_the_classes(training_rows, as_frame):
+    X, y = training_rows
+    if as_frame:
+        X = pd.DataFrame(X, columns=list('abcd'))
+    sampler = ChunkedSMOTE(chunksize=1000, random_state=0)
+    X_out, y_out = sampler.fit_resample(X, y)
+
+    negatives = np.count_nonzero(y == 0)
+    assert np.count_nonzero(y_out == 0) == negatives
+    # each block is balanced on its own, so the whole output is too
+    assert np.count_nonzero(y_out == 1) == negatives
+    assert len(X_out) == len(y_out) and isinstance(X_out, type(X))
+
+
+def test_chunked_smote_is_reproducible_and_keeps_the_original_rows(
+        training_rows):
+    X, y = training_rows
+    sampler = make_sampler('chunked_smote', seed=3, chunksize=1000)
+    X_out, y_out = resample(X, y, sampler)
+    X_again, _ = resample(X, y,
+                          make_sampler('chunked_smote', seed=3,
+                                       chunksize=1000))
+
+    np.testing.assert_array_equal(X_out, X_again)
+    assert X_out.dtype == np.float32
+    original = {row.tobytes() for row in X}
+    assert sum(row.tobytes() in original for row in X_out) == len(X)
+
+
+def test_blocks_too_small_to_interpolate_pass_through(training_rows):
+    X, y = training_rows
+    # a block of 10 rows cannot hold more than 5 rows of both classes, which
+    # SMOTE's 5 neighbours need
+    sampler = ChunkedSMOTE(chunksize=10, random_state=0)
+    X_out, y_out = sampler.fit_resample(X, y)
+    assert np.bincount(y_out).tolist() == np.bincount(y).tolist()
+
+
+def test_balance_weight_equals_negatives_per_positive(training_rows):
+    _, y = training_rows
+    weight = balance_weight(y)
+    assert weight * np.count_nonzero(y) == pytest.approx(
+        np.count_nonzero(y == 0))
+    # chunk by chunk, as out of core, gives the weight of the whole
+    assert balance_weight(*np.array_split(y, 7)) == weight
+    assert balance_weight(np.zeros(10)) == 10
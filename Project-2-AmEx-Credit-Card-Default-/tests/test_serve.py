@@ -0,0 +1,61 @@
+# tests/test_serve.py
+# -*- coding: utf-8 -*-
+import asyncio
+import json
+import pytest
+from functools import partial
+from src.features.build_features import TARGET
+from src.features.record_features import build_record_tables
+from src.models.serve import (_predict, batch_scorer, encode_records,
+                              score_batch, score_records)
+
+
+def _status_and_body(response):
+    head, body = response.split(b'\r\n\r\n', 1)
+    return int(head.split(b' ', 2)[1]), json.loads(body)
+
+
+@pytest.fixture
+def tables(cleaner, fitted_params):
+    return build_record_tables(fitted_params, cleaner)
+
+
+@pytest.fixture
+def records(customers):
+    return customers.drop(columns=TARGET).head(6).to_dict('records')
+
+
+def test_encode_records_names_the_bad_field(records, tables):
+    bad = dict(records[1], age='forty')
+    with pytest.raises(ValueError,
+                       match="Customer 1: age must be a number, not 'forty'"):
+        encode_records([records[0], bad], tables)
+
+
+def test_bad_request_fails_alone_in_a_shared_batch(records, tables, model):
+    bad = dict(records[0], age='forty')
+    bodies = [records[1:3], bad, records[3], records[4:6]]
+
+    async def send_together():
+        queue = asyncio.Queue()
+        score = partial(score_batch, model=model)
+        # a long wait puts every valid request in the same batch
+        scorer = asyncio.create_task(batch_scorer(queue, score,
+                                                  max_batch_size=256,
+                                                  max_wait=0.2))
+        encode = partial(encode_records, tables=tables)
+        try:
+            return await asyncio.gather(*(_predict(json.dumps(body).encode(),
+                                                   queue, encode, True)
+                                          for body in bodies))
+        finally:
+            scorer.cancel()
+
+    responses = [_status_and_body(response)
+                 for response in asyncio.run(send_together())]
+
+    assert [status for status, _ in responses] == [200, 400, 200, 200]
+    assert 'age' in responses[1][1]['error']
+    assert responses[0][1] == score_records(records[1:3], tables, model)
+    assert responses[2][1] == score_records([records[3]], tables, model)[0]
+    assert responses[3][1] == score_records(records[4:6], tables, model)
@@ -0,0 +1,56 @@
+# tests/test_streaming_stats.py
+# -*- coding: utf-8 -*-
+import numpy as np
+import pandas as pd
+import pytest
+from src.visualization.streaming_stats import (chunk_stats, correlation,
+                                               histogram_edges, merge_stats,
+                                               reduce_chunks)
+
+
+@pytest.fixture
+def data():
+    # correlated columns with missing values in different rows of each, a
+    # run of rows where 'c' is all missing, and whole numbers that fall on
+    # bin edges
+    rng = np.random.default_rng(0)
+    n = 1000
+    base = rng.normal(size=n)
+    df = pd.DataFrame({'a': base * 3 + 100,
+                       'b': -base + rng.normal(scale=0.5, size=n),
+                       'c': rng.integers(0, 10, n).astype(np.float64),
+                       'd': base ** 2})
+    for col, share in (('a', 0.1), ('b', 0.3), ('d', 0.05)):
+        df.loc[rng.random(n) < share, col] = np.nan
+    df.loc[200:450, 'c'] = np.nan
+    return df
+
+
+def _edges(df, bins):
+    return np.array([histogram_edges(df[col].min(), df[col].max(), bins)
+                     for col in df.columns])
+
+
+def _merged_stats(df, edges, chunksize):
+    chunks = (df.iloc[start:start + chunksize]
+              for start in range(0, len(df), chunksize))
+    return reduce_chunks(chunks,
+                         lambda chunk: chunk_stats(chunk.to_numpy(), edges),
+                         merge_stats)
+
+
+@pytest.mark.parametrize('chunksize', [1, 137, 1000])
+def test_merged_correlation_matches_pairwise_complete_corr(data, chunksize):
+    stats = _merged_stats(data, _edges(data, 10), chunksize)
+    pd.testing.assert_frame_equal(correlation(stats, list(data.columns)),
+                                  data.corr(), check_exact=False, rtol=0,
+                                  atol=1e-10)
+
+
+@pytest.mark.parametrize('chunksize', [1, 137, 1000])
+def test_merged_bin_counts_match_np_histogram(data, chunksize):
+    edges = _edges(data, 9)
+    stats = _merged_stats(data, edges, chunksize)
+    for j, col in enumerate(data.columns):
+        expected, _ = np.histogram(data[col].dropna(), bins=edges[j])
+        np.testing.assert_array_equal(stats['counts'][j], expected)